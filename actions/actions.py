@@ -1,32 +1,89 @@
-from typing import Text, List, Any, Dict, Optional
+from functools import lru_cache
+from datetime import datetime
+from types import MappingProxyType
+from typing import Text, List, Any, Dict, Mapping, Optional, NamedTuple, Tuple
 from rasa_sdk import Tracker, FormValidationAction, Action
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.types import DomainDict
 from rasa_sdk.events import SlotSet, AllSlotsReset, ActiveLoop
-
-VALID_CITIES = ["Dhaka", "New York", "London", "Tokyo", "Dubai", "Mumbai", "Paris", "Khulna", "Rajshahi"]
+from .gazetteer import Gazetteer
+from .inventory import Flight, InventoryStore
+from .tracing import span, traced
+
+# Cities, aliases and airport codes are loaded once from actions/cities.yml.
+GAZETTEER = Gazetteer.from_file()
+VALID_CITIES = GAZETTEER.names
+# Prompts name a few cities as examples rather than the whole gazetteer.
+PROMPT_CITY_EXAMPLES = 5
+
+# Flight schedule (actions/schedule.csv) indexed by route when ActionSubmitFlight
+# first runs and rebuilt in the background when the file changes. Without the
+# file ActionSubmitFlight does not list departures.
+INVENTORY = InventoryStore(resolve=GAZETTEER.canonical)
+# Slot holding the flight offered to the user, which an affirm books.
+OFFERED_FLIGHT_SLOT = "offered_flight"
 
 def normalize_message(message: Text) -> Text:
     """Normalize user message by removing extra whitespace and line breaks."""
     return " ".join(message.split())
 
+class MessageIndex(NamedTuple):
+    """Cities and keyword positions of one message.
+
+    Shared by every cache hit of `index_message`, so it is read-only.
+    """
+    mentioned: Tuple[Text, ...]
+    first_seen: Mapping[Text, int]
+    from_idx: int
+    to_idx: int
+
+@lru_cache(maxsize=1024)
+def index_message(message: Text) -> MessageIndex:
+    """Scan a message once; the form validators ask about the same message several times per turn."""
+    msg_lower = message.lower()
+    # Position of the first mention of each city, in order of appearance
+    first_seen = {}
+    for start, _, city in GAZETTEER.find_all(message):
+        first_seen.setdefault(city, start)
+    return MessageIndex(tuple(first_seen), MappingProxyType(first_seen), msg_lower.find("from "), msg_lower.find("to "))
+
 def parse_cities_from_message(message: Text) -> List[Text]:
     """Find all valid cities mentioned in the user message in order."""
-    msg_lower = message.lower()
-    mentioned = []
+    return list(index_message(message).mentioned)
+
+def city_examples(exclude: Optional[Text] = None) -> Text:
+    """A few city names for prompts, without `exclude`."""
+    examples = []
     for city in VALID_CITIES:
-        if city.lower() in msg_lower:
-            mentioned.append(city)
-    # Sort by first occurrence in the message
-    mentioned = sorted(mentioned, key=lambda c: msg_lower.index(c.lower()))
-    return mentioned
+        if not exclude or city.lower() != exclude.lower():
+            examples.append(city)
+            if len(examples) == PROMPT_CITY_EXAMPLES:
+                break
+    suffix = " and more" if len(VALID_CITIES) > len(examples) + (1 if exclude else 0) else ""
+    return ", ".join(examples) + suffix
+
+def is_valid_destination(city: Optional[Text], source: Optional[Text]) -> bool:
+    """A known city other than the source."""
+    return bool(city) and city in GAZETTEER and not (source and city.lower() == source.lower())
+
+def canonical_city(slot_value: Any) -> Text:
+    """Resolve a slot value (name, alias or airport code) to its city name."""
+    city = (slot_value.strip().title() if slot_value else "").strip()
+    return GAZETTEER.canonical(city) or city
 
 def infer_source_destination(message: Text, already_set_source: Optional[Text], already_set_destination: Optional[Text]) -> (Optional[Text], Optional[Text]):
     """Try to infer source and destination from the message using heuristics."""
     # Normalize message
     message = normalize_message(message)
-    msg_lower = message.lower()
-    mentioned = parse_cities_from_message(message)
+    with span("infer_cities"):
+        return _infer_source_destination(message, already_set_source, already_set_destination)
+
+@lru_cache(maxsize=1024)
+def _infer_source_destination(message: Text, already_set_source: Optional[Text], already_set_destination: Optional[Text]) -> (Optional[Text], Optional[Text]):
+    """Memoized on the normalized message and the slots already set."""
+    index = index_message(message)
+    first_seen = index.first_seen
+    mentioned = index.mentioned
 
     # If no cities found
     if not mentioned:
@@ -39,10 +96,10 @@ def infer_source_destination(message: Text, already_set_source: Optional[Text],
             return already_set_source, possible_dests[0]
         elif len(possible_dests) > 1:
             # Try to find a city after "to"
-            to_idx = msg_lower.find("to ")
+            to_idx = index.to_idx
             if to_idx != -1:
                 for c in possible_dests:
-                    if msg_lower.find(c.lower()) > to_idx:
+                    if first_seen[c] > to_idx:
                         return already_set_source, c
             # If we can't decide, pick the first different city
             return already_set_source, possible_dests[0]
@@ -55,27 +112,27 @@ def infer_source_destination(message: Text, already_set_source: Optional[Text],
         if len(possible_sources) == 1:
             return possible_sources[0], already_set_destination
         elif len(possible_sources) > 1:
-            from_idx = msg_lower.find("from ")
+            from_idx = index.from_idx
             if from_idx != -1:
                 for c in possible_sources:
-                    if msg_lower.find(c.lower()) > from_idx:
+                    if first_seen[c] > from_idx:
                         return c, already_set_destination
             return possible_sources[0], already_set_destination
         else:
             return None, already_set_destination
 
     # If we have neither source nor destination:
-    from_idx = msg_lower.find("from ")
-    to_idx = msg_lower.find("to ")
+    from_idx = index.from_idx
+    to_idx = index.to_idx
 
     if from_idx != -1 and to_idx != -1:
         city_after_from = None
         city_after_to = None
         for c in mentioned:
-            cidx = msg_lower.find(c.lower())
-            if cidx > from_idx and (city_after_from is None or cidx < msg_lower.find(city_after_from.lower())):
+            cidx = first_seen[c]
+            if cidx > from_idx and (city_after_from is None or cidx < first_seen[city_after_from]):
                 city_after_from = c
-            if cidx > to_idx and (city_after_to is None or cidx < msg_lower.find(city_after_to.lower())):
+            if cidx > to_idx and (city_after_to is None or cidx < first_seen[city_after_to]):
                 city_after_to = c
         if city_after_from and city_after_to and city_after_from.lower() != city_after_to.lower():
             return city_after_from, city_after_to
@@ -89,6 +146,7 @@ def infer_source_destination(message: Text, already_set_source: Optional[Text],
 
     return None, None
 
+@traced
 class ActionAskSource(Action):
     def name(self) -> Text:
         return "action_ask_source"
@@ -96,9 +154,10 @@ class ActionAskSource(Action):
     def run(self, dispatcher: CollectingDispatcher,
             tracker: Tracker,
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        dispatcher.utter_message(text=f"Which city would you like to fly from? Available cities: {', '.join(VALID_CITIES)}")
+        dispatcher.utter_message(text=f"Which city would you like to fly from? For example: {city_examples()}")
         return []
 
+@traced
 class ActionAskDestination(Action):
     def name(self) -> Text:
         return "action_ask_destination"
@@ -107,10 +166,10 @@ class ActionAskDestination(Action):
             tracker: Tracker,
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         source = tracker.get_slot("source")
-        available_destinations = [c for c in VALID_CITIES if not source or c.lower() != source.lower()]
-        dispatcher.utter_message(text=f"Which city would you like to fly to? Available cities: {', '.join(available_destinations)}")
+        dispatcher.utter_message(text=f"Which city would you like to fly to? For example: {city_examples(exclude=source)}")
         return []
 
+@traced
 class ValidateFlightBookingForm(FormValidationAction):
     def name(self) -> Text:
         return "validate_flight_booking_form"
@@ -131,9 +190,9 @@ class ValidateFlightBookingForm(FormValidationAction):
         tracker: Tracker,
         domain: DomainDict,
     ) -> Dict[Text, Any]:
-        city = (slot_value.strip().title() if slot_value else "").strip()
+        city = canonical_city(slot_value)
         
-        if city not in VALID_CITIES:
+        if city not in GAZETTEER:
             # Fallback parsing
             user_msg = tracker.latest_message.get("text", "")
             user_msg = normalize_message(user_msg)
@@ -141,13 +200,13 @@ class ValidateFlightBookingForm(FormValidationAction):
             current_destination = tracker.get_slot("destination")
             inferred_source, inferred_destination = infer_source_destination(user_msg, current_source, current_destination)
 
-            if inferred_source and inferred_source in VALID_CITIES:
-                if inferred_destination and inferred_destination in VALID_CITIES and inferred_destination.lower() != inferred_source.lower():
+            if inferred_source and inferred_source in GAZETTEER:
+                if inferred_destination and inferred_destination in GAZETTEER and inferred_destination.lower() != inferred_source.lower():
                     return {"source": inferred_source, "destination": inferred_destination}
                 else:
                     return {"source": inferred_source}
             else:
-                dispatcher.utter_message(text=f"Sorry, '{city}' is not a valid city. Please choose from: {', '.join(VALID_CITIES)}")
+                dispatcher.utter_message(text=f"Sorry, '{city}' is not a city I know. For example: {city_examples()}")
                 dispatcher.utter_message(text="Please select a valid source city.")
                 return {"source": None}
         else:
@@ -161,11 +220,10 @@ class ValidateFlightBookingForm(FormValidationAction):
         tracker: Tracker,
         domain: DomainDict,
     ) -> Dict[Text, Any]:
-        city = (slot_value.strip().title() if slot_value else "").strip()
+        city = canonical_city(slot_value)
         source = tracker.get_slot("source")
-        available_destinations = [c for c in VALID_CITIES if not source or c.lower() != source.lower()]
 
-        if city not in available_destinations:
+        if not is_valid_destination(city, source):
             # Fallback parsing
             user_msg = tracker.latest_message.get("text", "")
             user_msg = normalize_message(user_msg)
@@ -175,27 +233,52 @@ class ValidateFlightBookingForm(FormValidationAction):
 
             if current_source and not current_destination:
                 # Only need destination
-                if inferred_destination and inferred_destination in available_destinations:
+                if is_valid_destination(inferred_destination, current_source):
                     return {"destination": inferred_destination}
 
             if not current_source and not current_destination:
                 # If both found from fallback
                 if (inferred_source and inferred_destination and
-                    inferred_source in VALID_CITIES and 
-                    inferred_destination in VALID_CITIES and 
+                    inferred_source in GAZETTEER and 
+                    inferred_destination in GAZETTEER and 
                     inferred_source.lower() != inferred_destination.lower()):
                     return {"source": inferred_source, "destination": inferred_destination}
             
-            dispatcher.utter_message(text=f"Sorry, '{city}' is not a valid destination. Please choose from: {', '.join(available_destinations)}")
-            dispatcher.utter_message(text="Please select a valid destination city.")
-            return {"destination": None}
-
-        if source and city.lower() == source.lower():
-            dispatcher.utter_message(text="Source and destination cannot be the same city. Please choose a different destination.")
+            if source and city.lower() == source.lower():
+                dispatcher.utter_message(text="Source and destination cannot be the same city. Please choose a different destination.")
+            else:
+                dispatcher.utter_message(text=f"Sorry, '{city}' is not a city I know. For example: {city_examples(exclude=source)}")
+                dispatcher.utter_message(text="Please select a valid destination city.")
             return {"destination": None}
 
         return {"destination": city}
 
+def format_flight(flight: Flight) -> Text:
+    return (f"{flight.flight} departing {flight.departure:%a %d %b %H:%M} UTC, "
+            f"arriving {flight.arrival:%a %d %b %H:%M} UTC")
+
+def flight_slot_value(flight: Flight) -> Dict[Text, Text]:
+    return {
+        "flight": flight.flight,
+        "source": flight.source,
+        "destination": flight.destination,
+        "departure": flight.departure.isoformat(),
+        "arrival": flight.arrival.isoformat(),
+    }
+
+def flight_from_slot(value: Any) -> Optional[Flight]:
+    try:
+        return Flight(
+            value["flight"],
+            value["source"],
+            value["destination"],
+            datetime.fromisoformat(value["departure"]),
+            datetime.fromisoformat(value["arrival"]),
+        )
+    except (TypeError, KeyError, ValueError):
+        return None
+
+@traced
 class ActionSubmitFlight(Action):
     def name(self) -> Text:
         return "action_submit_flight"
@@ -209,24 +292,47 @@ class ActionSubmitFlight(Action):
         latest_intent = tracker.get_intent_of_latest_message()
 
         # Validate once more
-        if source not in VALID_CITIES or destination not in VALID_CITIES:
+        if source not in GAZETTEER or destination not in GAZETTEER:
             dispatcher.utter_message(text="Sorry, invalid city detected. Let's start over.")
             return [AllSlotsReset(), ActiveLoop(None)]
-        
+
         if latest_intent == "affirm":
-            dispatcher.utter_message(
-                text=f"Your flight from {source} to {destination} has been booked successfully!"
-            )
+            # Book the flight that was offered, even if the schedule changed since.
+            offered = flight_from_slot(tracker.get_slot(OFFERED_FLIGHT_SLOT))
+            if offered and (offered.source, offered.destination) == (source, destination):
+                dispatcher.utter_message(
+                    text=f"Your flight {format_flight(offered)} from {source} to {destination} has been booked successfully!"
+                )
+            else:
+                dispatcher.utter_message(
+                    text=f"Your flight from {source} to {destination} has been booked successfully!"
+                )
             return [AllSlotsReset(), ActiveLoop(None)]
         elif latest_intent == "deny":
             dispatcher.utter_message(text="Booking cancelled.")
             return [AllSlotsReset(), ActiveLoop(None)]
+
+        # None when no schedule is loaded, then departures are not listed.
+        inventory = INVENTORY.start()
+        with span("inventory"):
+            flights = inventory.current.next_departures(source, destination) if inventory.available else None
+        if flights == []:
+            dispatcher.utter_message(text=f"Sorry, there are no upcoming flights from {source} to {destination}.")
+            return [AllSlotsReset(), ActiveLoop(None)]
+        elif flights:
+            listing = "\n".join(f"- {format_flight(flight)}" for flight in flights)
+            dispatcher.utter_message(
+                text=f"I've found flights from {source} to {destination}:\n{listing}\n"
+                     f"Would you like to book the first one? (Yes/No)"
+            )
+            return [SlotSet(OFFERED_FLIGHT_SLOT, flight_slot_value(flights[0]))]
         else:
             dispatcher.utter_message(
                 text=f"I've found flights from {source} to {destination}. Would you like to proceed with booking? (Yes/No)"
             )
-            return []
+            return [SlotSet(OFFERED_FLIGHT_SLOT, None)]
 
+@traced
 class ActionCheckFlightFormStart(Action):
     def name(self) -> Text:
         return "action_check_flight_form_start"
@@ -242,15 +348,16 @@ class ActionCheckFlightFormStart(Action):
         inferred_source, inferred_destination = infer_source_destination(user_msg, current_source, current_destination)
 
         events = []
-        if inferred_source and inferred_source in VALID_CITIES:
+        if inferred_source and inferred_source in GAZETTEER:
             events.append(SlotSet("source", inferred_source))
-        if inferred_destination and inferred_destination in VALID_CITIES and (not inferred_source or inferred_destination.lower() != inferred_source.lower()):
+        if inferred_destination and inferred_destination in GAZETTEER and (not inferred_source or inferred_destination.lower() != inferred_source.lower()):
             events.append(SlotSet("destination", inferred_destination))
 
         # Start the flight booking form
         events.append(ActiveLoop("flight_booking_form"))
         return events
 
+@traced
 class ActionResetFlightForm(Action):
     def name(self) -> Text:
         return "action_reset_flight_form"
@@ -265,6 +372,7 @@ from rasa_sdk import Action, Tracker
 from rasa_sdk.events import SessionStarted, ActionExecuted
 
 
+@traced
 class ActionSessionStart(Action):
     def name(self) -> Text:
         return "action_session_start"
@@ -0,0 +1,104 @@
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Text, Tuple
+
+import yaml
+
+CITIES_PATH = os.environ.get("CITIES_PATH", os.path.join(os.path.dirname(__file__), "cities.yml"))
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# (start, end, canonical name) of one city mention in a message
+Match = Tuple[int, int, Text]
+
+_TERMINAL = ""
+
+
+def _tokens(text: Text) -> List[Text]:
+    return [token.casefold() for token in TOKEN_PATTERN.findall(text)]
+
+
+class Gazetteer:
+    """Precompiled city names, aliases and airport codes.
+
+    Names and aliases are stored in a trie keyed by lower-cased word tokens, so
+    a message is matched in a single left-to-right pass over its tokens no
+    matter how many cities are known, and mentions always sit on word
+    boundaries.
+    """
+
+    def __init__(self, entries: Iterable[Dict]) -> None:
+        self.names: List[Text] = []
+        self._trie: Dict = {}
+        self._codes: Dict[Text, Text] = {}
+        self._lookup: Dict[Text, Text] = {}
+        for entry in entries:
+            name = entry["name"]
+            self.names.append(name)
+            for phrase in [name, *(entry.get("aliases") or [])]:
+                tokens = _tokens(phrase)
+                if not tokens:
+                    continue
+                node = self._trie
+                for token in tokens:
+                    node = node.setdefault(token, {})
+                node.setdefault(_TERMINAL, name)
+                self._lookup.setdefault(" ".join(tokens), name)
+            for code in entry.get("codes") or []:
+                self._codes.setdefault(code.upper(), name)
+        self._name_set = frozenset(self.names)
+
+    @classmethod
+    def from_file(cls, path: Text = CITIES_PATH) -> "Gazetteer":
+        loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        with open(path, encoding="utf-8") as fh:
+            data = yaml.load(fh, Loader=loader) or {}
+        return cls(data.get("cities") or [])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name: Text) -> bool:
+        return name in self._name_set
+
+    def find_all(self, message: Text) -> List[Match]:
+        """All city mentions in order, preferring the longest name at each position."""
+        words = list(TOKEN_PATTERN.finditer(message))
+        folded = [word.group().casefold() for word in words]
+        matches: List[Match] = []
+        i = 0
+        while i < len(words):
+            node = self._trie
+            found: Optional[Tuple[int, Text]] = None
+            j = i
+            while j < len(words):
+                node = node.get(folded[j])
+                if node is None:
+                    break
+                if _TERMINAL in node:
+                    found = (j, node[_TERMINAL])
+                j += 1
+            if found is not None:
+                last, name = found
+                matches.append((words[i].start(), words[last].end(), name))
+                i = last + 1
+                continue
+            word = words[i].group()
+            if word.isupper() and word in self._codes:
+                matches.append((words[i].start(), words[i].end(), self._codes[word]))
+            i += 1
+        return matches
+
+    def mentioned(self, message: Text) -> List[Text]:
+        """Distinct cities mentioned in the message, in order of first mention."""
+        return list(dict.fromkeys(name for _, _, name in self.find_all(message)))
+
+    def canonical(self, text: Text) -> Optional[Text]:
+        """Resolve a whole slot value such as "new york", "Bombay" or "dac" to its city."""
+        if not text:
+            return None
+        tokens = _tokens(text)
+        name = self._lookup.get(" ".join(tokens))
+        if name is None and len(tokens) == 1:
+            name = self._codes.get(tokens[0].upper())
+        return name
@@ -0,0 +1,248 @@
+import csv
+import logging
+import os
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+# CSV with a header row: flight,source,destination,departure,arrival. Times are
+# ISO 8601; times without an offset are taken as UTC.
+SCHEDULE_PATH = os.environ.get("SCHEDULE_PATH", os.path.join(os.path.dirname(__file__), "schedule.csv"))
+# Seconds between checks of the schedule file for changes; 0 disables reloads.
+SCHEDULE_REFRESH_INTERVAL = float(os.environ.get("SCHEDULE_REFRESH_INTERVAL", "60"))
+
+Route = Tuple[Text, Text]
+
+
+class Flight(NamedTuple):
+    flight: Text
+    source: Text
+    destination: Text
+    departure: datetime
+    arrival: datetime
+
+
+def _timestamp(value: Text) -> float:
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+class _RouteTable:
+    """Departures of one route in time order, as parallel compact columns."""
+
+    __slots__ = ("departures", "arrivals", "flights")
+
+    def __init__(self, rows: List[Tuple[float, float, Text]]) -> None:
+        rows.sort()
+        self.departures = array("d", (row[0] for row in rows))
+        self.arrivals = array("d", (row[1] for row in rows))
+        self.flights = [row[2] for row in rows]
+
+
+class FlightInventory:
+    """Read-only route index over a flight schedule.
+
+    Rows are grouped by (source, destination) and sorted by departure time, so
+    the next departures of a route are one bisect and a slice away however
+    large the schedule is. An instance is never modified after it is built,
+    so it can be shared by concurrent actions without locking.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[Text, Text, Text, float, float]]) -> None:
+        grouped: Dict[Route, List[Tuple[float, float, Text]]] = {}
+        count = 0
+        for flight, source, destination, departure, arrival in rows:
+            grouped.setdefault((source, destination), []).append((departure, arrival, flight))
+            count += 1
+        self._routes: Dict[Route, _RouteTable] = {route: _RouteTable(rows) for route, rows in grouped.items()}
+        self._count = count
+
+    @classmethod
+    def from_file(
+        cls, path: Text = SCHEDULE_PATH, resolve: Optional[Callable[[Text], Optional[Text]]] = None
+    ) -> "FlightInventory":
+        """Load a schedule CSV; `resolve` maps the file's city names or airport codes to slot values."""
+        resolved: Dict[Text, Text] = {}
+
+        def city(value: Text) -> Text:
+            name = resolved.get(value)
+            if name is None:
+                name = resolved[value] = (resolve(value) if resolve else None) or value
+            return name
+
+        def rows():
+            with open(path, newline="", encoding="utf-8") as fh:
+                for row in csv.DictReader(fh):
+                    yield (
+                        row["flight"],
+                        city(row["source"]),
+                        city(row["destination"]),
+                        _timestamp(row["departure"]),
+                        _timestamp(row["arrival"]),
+                    )
+
+        return cls(rows())
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def routes(self) -> List[Route]:
+        return list(self._routes)
+
+    def next_departures(
+        self, source: Text, destination: Text, after: Optional[float] = None, limit: int = 3
+    ) -> List[Flight]:
+        """The first `limit` flights of the route departing at or after `after` (default: now)."""
+        table = self._routes.get((source, destination))
+        if table is None:
+            return []
+        start = bisect_left(table.departures, time.time() if after is None else after)
+        end = min(start + limit, len(table.departures))
+        return [
+            Flight(
+                table.flights[i],
+                source,
+                destination,
+                datetime.fromtimestamp(table.departures[i], timezone.utc),
+                datetime.fromtimestamp(table.arrivals[i], timezone.utc),
+            )
+            for i in range(start, end)
+        ]
+
+
+class InventoryStore:
+    """Holds the current FlightInventory and swaps in a rebuilt one when the file changes.
+
+    Rebuilding happens in a background thread; actions keep reading the
+    inventory they picked up until the new one is fully built and replaces it
+    with a single reference assignment. Nothing is read before `start`, which
+    the first action to need the schedule calls, so importing the actions
+    neither reads the file nor starts a thread.
+    """
+
+    def __init__(
+        self, path: Text = SCHEDULE_PATH, resolve: Optional[Callable[[Text], Optional[Text]]] = None
+    ) -> None:
+        self.path = path
+        self.resolve = resolve
+        self.current = FlightInventory(())
+        self.loaded_mtime: Optional[float] = None
+        self._reloading = threading.Lock()
+        self._starting = threading.Lock()
+        self._started = False
+        self._watcher: Optional[threading.Thread] = None
+
+    def start(self) -> "InventoryStore":
+        """Load the schedule and watch it for changes, the first time only."""
+        if not self._started:
+            with self._starting:
+                if not self._started:
+                    self.load()
+                    self.watch()
+                    self._started = True
+        return self
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def load(self) -> bool:
+        """Build the index from the file if it changed since the last load; False if nothing was loaded."""
+        if not self._reloading.acquire(blocking=False):
+            return False
+        try:
+            mtime = self._mtime()
+            if mtime is None or mtime == self.loaded_mtime:
+                return False
+            started = time.perf_counter()
+            try:
+                inventory = FlightInventory.from_file(self.path, self.resolve)
+            except (OSError, KeyError, ValueError) as e:
+                logger.error(f"Could not load flight schedule {self.path}: {e}")
+                return False
+            self.current = inventory
+            self.loaded_mtime = mtime
+            logger.info(
+                f"Loaded {len(inventory)} flights on {len(inventory.routes)} routes from {self.path} "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+            return True
+        finally:
+            self._reloading.release()
+
+    def refresh_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.load, name="schedule-reload", daemon=True)
+        thread.start()
+        return thread
+
+    def watch(self, interval: float = SCHEDULE_REFRESH_INTERVAL) -> None:
+        """Check the file every `interval` seconds and rebuild the index when it changes."""
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        def run() -> None:
+            while True:
+                time.sleep(interval)
+                if self._mtime() != self.loaded_mtime:
+                    self.load()
+
+        self._watcher = threading.Thread(target=run, name="schedule-watch", daemon=True)
+        self._watcher.start()
+
+    @property
+    def available(self) -> bool:
+        return self.loaded_mtime is not None
+
+
+def generate_schedule(
+    path: Text,
+    cities: List[Text],
+    rows: int,
+    start: Optional[datetime] = None,
+    days: int = 30,
+    seed: int = 7,
+) -> None:
+    """Write a synthetic schedule of `rows` flights between `cities` over `days` days."""
+    rng = random.Random(seed)
+    start = start or datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    span = days * 86400
+    with open(path, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(["flight", "source", "destination", "departure", "arrival"])
+        for i in range(rows):
+            source, destination = rng.sample(cities, 2)
+            departure = start + timedelta(seconds=rng.randrange(0, span, 300))
+            arrival = departure + timedelta(minutes=rng.randrange(60, 16 * 60, 5))
+            writer.writerow([
+                f"{source[:2].upper()}{rng.randrange(100, 9999)}",
+                source,
+                destination,
+                departure.isoformat(),
+                arrival.isoformat(),
+            ])
+
+
+if __name__ == "__main__":
+    # python3 -m actions.inventory [path] --rows 20000 --days 30
+    import argparse
+
+    from .gazetteer import Gazetteer
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic flight schedule for the actions.")
+    parser.add_argument("path", nargs="?", default=SCHEDULE_PATH)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+    generate_schedule(args.path, Gazetteer.from_file().names, args.rows, days=args.days)
+    print(f"Wrote {args.rows} flights to {args.path}")
@@ -0,0 +1,90 @@
+import functools
+import inspect
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, List, Optional, Text, Tuple
+
+logger = logging.getLogger(__name__)
+
+# With TRACING=1 the middleware puts its trace ID here in the forwarded tracker,
+# the one place of the webhook payload an action can read.
+TRACE_METADATA_KEY = "trace_id"
+
+
+class ActionTrace:
+    """Spans of one action run: (name, start offset, duration) in seconds."""
+
+    __slots__ = ("trace_id", "action", "started", "spans")
+
+    def __init__(self, trace_id: Text, action: Text) -> None:
+        self.trace_id = trace_id
+        self.action = action
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[Text, float, float]] = []
+
+    def log(self) -> None:
+        spans = " ".join(f"{name}@{offset * 1e3:.2f}+{duration * 1e3:.2f}ms" for name, offset, duration in self.spans)
+        logger.info(
+            f"Trace {self.trace_id} {self.action} total={(time.perf_counter() - self.started) * 1e3:.2f}ms {spans}".rstrip()
+        )
+
+
+_current: ContextVar[Optional[ActionTrace]] = ContextVar("action_trace", default=None)
+
+
+def trace_id_of(tracker: Any) -> Optional[Text]:
+    metadata = (tracker.latest_message or {}).get("metadata")
+    return metadata.get(TRACE_METADATA_KEY) if isinstance(metadata, dict) else None
+
+
+@contextmanager
+def span(name: Text) -> Iterator[None]:
+    """Time a block as a span of the running action; a no-op outside a traced run."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append((name, started - trace.started, time.perf_counter() - started))
+
+
+def traced(cls):
+    """Class decorator: log the spans of each run that carries a trace ID."""
+    run = cls.run
+
+    def start(self, tracker) -> Optional[ActionTrace]:
+        trace_id = trace_id_of(tracker)
+        return ActionTrace(trace_id, self.name()) if trace_id else None
+
+    if inspect.iscoroutinefunction(run):
+        @functools.wraps(run)
+        async def traced_run(self, dispatcher, tracker, domain):
+            trace = start(self, tracker)
+            if trace is None:
+                return await run(self, dispatcher, tracker, domain)
+            token = _current.set(trace)
+            try:
+                return await run(self, dispatcher, tracker, domain)
+            finally:
+                _current.reset(token)
+                trace.log()
+    else:
+        @functools.wraps(run)
+        def traced_run(self, dispatcher, tracker, domain):
+            trace = start(self, tracker)
+            if trace is None:
+                return run(self, dispatcher, tracker, domain)
+            token = _current.set(trace)
+            try:
+                return run(self, dispatcher, tracker, domain)
+            finally:
+                _current.reset(token)
+                trace.log()
+
+    cls.run = traced_run
+    return cls
@@ -1,8 +1,12 @@
+import argparse
 import asyncio
 import httpx
+import random
 import sys
 import logging
 import time
+import uuid
+import yaml
 from typing import Dict, Any, Optional, List
 
 # Set up logging
@@ -24,14 +28,32 @@ class RasaClient:
         server_url: str = "http://localhost",
         server_port: int = 5005,
         sleep_delay: float = 0.0,
-        sender_id: str = "default"  # Changed to 'default' since we know it works
+        sender_id: str = "default",  # Changed to 'default' since we know it works
+        state_mode: str = "tracker",
+        middleware_url: str = "http://localhost:5055",
+        refresh_every: int = 5
     ) -> None:
+        """
+        `state_mode` decides how active_form/slots are refreshed after a message:
+        "tracker" fetches the full Rasa tracker every turn, "middleware" reads the
+        small /state/{sender_id} endpoint of the middleware (SENDER_STATE=1), and
+        "lazy" fetches the tracker only while a form is active, after a reply
+        that prompts for something (as a form asking for a slot does), or every
+        `refresh_every` turns.
+        """
+        if state_mode not in ("tracker", "middleware", "lazy"):
+            raise ValueError(f"Unknown state mode: {state_mode}")
         self.server_url = f"{server_url}:{server_port}"
         self.sleep_delay = sleep_delay
         self.sender_id = sender_id
+        self.state_mode = state_mode
+        self.middleware_url = middleware_url
+        self.refresh_every = max(1, refresh_every)
+        self.turns = 0
         self.active_form: Optional[str] = None
         self.slots: Dict[str, Any] = {}
         self.client: Optional[httpx.AsyncClient] = None
+        self.owns_client = True
 
     @classmethod
     async def create(
@@ -39,15 +61,25 @@ class RasaClient:
         server_url: str = "http://localhost",
         server_port: int = 5005,
         sleep_delay: float = 0.0,
-        sender_id: str = "default"
+        sender_id: str = "default",
+        client: Optional[httpx.AsyncClient] = None,
+        state_mode: str = "tracker",
+        middleware_url: str = "http://localhost:5055",
+        refresh_every: int = 5
     ) -> "RasaClient":
-        instance = cls(server_url, server_port, sleep_delay, sender_id)
-        instance.client = httpx.AsyncClient(timeout=httpx.Timeout(30.0))
+        """Create a client; pass `client` to share one connection pool between several clients."""
+        instance = cls(server_url, server_port, sleep_delay, sender_id, state_mode, middleware_url, refresh_every)
+        if client is not None:
+            instance.client = client
+            instance.owns_client = False
+        else:
+            instance.client = httpx.AsyncClient(timeout=httpx.Timeout(30.0))
         return instance
 
     async def close(self) -> None:
         if self.client:
-            await self.client.aclose()
+            if self.owns_client:
+                await self.client.aclose()
             self.client = None
 
     async def get_server_status(self) -> Dict[str, Any]:
@@ -95,9 +127,54 @@ class RasaClient:
             logger.error(f"Failed to reset conversation: {e}")
             # Continue anyway since we know the webhook endpoint works
 
-    async def send_message(self, message_text: str) -> List[Dict[str, Any]]:
+    async def get_middleware_state(self) -> Optional[Dict[str, Any]]:
+        """Slots and active loop the middleware last saw for this sender, None if unknown."""
+        if not self.client:
+            raise RasaClientError("Client not initialized")
+        response = await self.client.get(f"{self.middleware_url}/state/{self.sender_id}")
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    @staticmethod
+    def is_prompt(messages: Optional[List[Dict[str, Any]]]) -> bool:
+        """Whether the bot asked for something: a question or buttons, as slot and form prompts are."""
+        return any(msg.get("buttons") or "?" in (msg.get("text") or "") for msg in messages or [])
+
+    async def refresh_state(self, bot_messages: Optional[List[Dict[str, Any]]] = None) -> None:
+        """Update active_form and slots according to the client's state mode.
+
+        In lazy mode `bot_messages`, the reply to the last message, decides
+        whether a form may just have started.
         """
-        Send a message using the webhook endpoint which we know works reliably.
+        if (
+            self.state_mode == "lazy"
+            and not self.active_form
+            and self.turns % self.refresh_every
+            and not self.is_prompt(bot_messages)
+        ):
+            return
+        try:
+            if self.state_mode == "middleware":
+                state = await self.get_middleware_state()
+                if state is None:
+                    # No action has run for this sender yet, nothing changed.
+                    return
+                self.active_form = state.get("active_loop")
+                self.slots = state.get("slots", {})
+            else:
+                tracker_data = await self.get_tracker()
+                self.active_form = tracker_data.get("active_loop", {}).get("name")
+                self.slots = tracker_data.get("slots", {})
+        except Exception as e:
+            logger.error(f"Tracker update failed: {e}")
+            self.active_form = None
+            self.slots = {}
+
+    async def post_message(self, message_text: str) -> List[Dict[str, Any]]:
+        """
+        Send a message and refresh the tracker state, raising on any error.
         """
         if not self.client:
             raise RasaClientError("Client not initialized")
@@ -108,24 +185,27 @@ class RasaClient:
             "message": message_text
         }
 
-        try:
-            response = await self.client.post(url, json=payload)
-            response.raise_for_status()
-            resp_json = response.json()
+        response = await self.client.post(url, json=payload)
+        response.raise_for_status()
+        resp_json = response.json()
 
-            # Update tracker state
-            try:
-                tracker_data = await self.get_tracker()
-                self.active_form = tracker_data.get("active_loop", {}).get("name")
-                self.slots = tracker_data.get("slots", {})
-            except Exception as e:
-                logger.error(f"Tracker update failed: {e}")
-                self.active_form = None
-                self.slots = {}
+        self.turns += 1
+        await self.refresh_state(resp_json)
+
+        if self.active_form and self.sleep_delay > 0:
+            await asyncio.sleep(self.sleep_delay)
+
+        return resp_json
 
-            if self.active_form and self.sleep_delay > 0:
-                await asyncio.sleep(self.sleep_delay)
+    async def send_message(self, message_text: str) -> List[Dict[str, Any]]:
+        """
+        Send a message using the webhook endpoint which we know works reliably.
+        """
+        if not self.client:
+            raise RasaClientError("Client not initialized")
 
+        try:
+            resp_json = await self.post_message(message_text)
             return resp_json if resp_json else [{"text": "No response from bot"}]
         except Exception as e:
             logger.error(f"Message send failed: {e}")
@@ -159,9 +239,118 @@ async def interactive_chat(client: RasaClient) -> None:
             logger.error(f"Chat error: {e}")
             print("Bot: An error occurred. Please try again.")
 
-async def main() -> None:
+def load_nlu_examples(path: str = "data/nlu.yml") -> Dict[str, List[str]]:
+    """Read the training examples of every intent from a Rasa NLU file."""
+    with open(path) as fh:
+        nlu = yaml.safe_load(fh).get("nlu", [])
+    examples: Dict[str, List[str]] = {}
+    for block in nlu:
+        if "intent" not in block:
+            continue
+        lines = block.get("examples", "").splitlines()
+        examples[block["intent"]] = [line.strip()[2:].strip() for line in lines if line.strip().startswith("- ")]
+    return examples
+
+def inform_city(text: str) -> str:
+    """The city of an `inform` example: "from Dhaka" and "to Dhaka" both name Dhaka."""
+    for prefix in ("from ", "to "):
+        if text.lower().startswith(prefix):
+            return text[len(prefix):]
+    return text
+
+def build_dialogue(examples: Dict[str, List[str]], rng: random.Random, scripted: bool) -> List[str]:
+    """
+    A flight-booking conversation: greet, book, give the cities, confirm, say bye.
+    The cities are answered with `inform` examples, "from X" or a bare city for
+    the source and "to Y" or a bare city for the destination. Scripted
+    dialogues always use the first fitting example of each intent.
+    """
+    pick = (lambda options: options[0]) if scripted else rng.choice
+    informs = examples["inform"]
+    source = pick([text for text in informs if not text.lower().startswith("to ")])
+    destination = pick([
+        text for text in informs
+        if not text.lower().startswith("from ") and inform_city(text).lower() != inform_city(source).lower()
+    ])
+    dialogue = [pick(examples["greet"]), pick(examples["book_flight"])]
+    # Book_flight examples may already name the cities; the extra turns then
+    # exercise the form validation with an already filled slot.
+    dialogue += [source, destination]
+    dialogue += [pick(examples["affirm"]) if scripted or rng.random() < 0.8 else pick(examples["deny"])]
+    dialogue += [pick(examples["thanks"]), pick(examples["goodbye"])]
+    return dialogue
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def load_test(
+    users: int,
+    dialogues: int = 1,
+    server_url: str = "http://localhost",
+    server_port: int = 5005,
+    scripted: bool = False,
+    max_connections: int = 100,
+    seed: Optional[int] = None,
+    state_mode: str = "tracker",
+    middleware_url: str = "http://localhost:5055",
+) -> Dict[str, Any]:
+    """
+    Run `users` simulated users concurrently, each with its own sender_id and
+    `dialogues` flight-booking conversations, over one shared httpx client.
+    """
+    examples = load_nlu_examples()
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    shared = httpx.AsyncClient(timeout=httpx.Timeout(30.0), limits=limits)
+
+    async def simulated_user(index: int) -> None:
+        nonlocal errors
+        client = await RasaClient.create(
+            server_url, server_port, sender_id=f"loadtest-{index}-{uuid.uuid4().hex[:8]}", client=shared,
+            state_mode=state_mode, middleware_url=middleware_url
+        )
+        try:
+            for _ in range(dialogues):
+                for message in build_dialogue(examples, rng, scripted):
+                    start = time.perf_counter()
+                    try:
+                        await client.post_message(message)
+                        latencies.append(time.perf_counter() - start)
+                    except Exception as e:
+                        errors += 1
+                        logger.debug(f"Turn failed for {client.sender_id}: {e}")
+        finally:
+            await client.close()
+
+    start = time.perf_counter()
     try:
-        client = await RasaClient.create()
+        await asyncio.gather(*(simulated_user(i) for i in range(users)))
+    finally:
+        await shared.aclose()
+    elapsed = time.perf_counter() - start
+
+    turns = len(latencies) + errors
+    report = {
+        "users": users,
+        "turns": turns,
+        "errors": errors,
+        "error_rate": errors / turns if turns else 0.0,
+        "elapsed_s": elapsed,
+        "turns_per_s": len(latencies) / elapsed if elapsed else 0.0,
+    }
+    if latencies:
+        for pct in (50, 95, 99):
+            report[f"p{pct}_ms"] = percentile(latencies, pct) * 1e3
+    return report
+
+async def main(args: argparse.Namespace) -> None:
+    try:
+        client = await RasaClient.create(
+            args.server_url, args.port, state_mode=args.state_mode, middleware_url=args.middleware_url
+        )
         
         # Verify server is up
         try:
@@ -169,7 +358,7 @@ async def main() -> None:
             logger.info(f"Connected to Rasa server. Status: {status}")
         except Exception as e:
             logger.error(f"Server connection failed: {e}")
-            print("Error: Ensure Rasa server is running at http://localhost:5005")
+            print(f"Error: Ensure Rasa server is running at {client.server_url}")
             return
 
         # Try to reset but continue even if it fails
@@ -188,4 +377,27 @@ async def main() -> None:
         await client.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Chat with the Rasa bot, or load test it with --users.")
+    parser.add_argument("--server-url", default="http://localhost")
+    parser.add_argument("--port", type=int, default=5005)
+    parser.add_argument("--users", type=int, default=0, help="run a headless load test with this many concurrent users")
+    parser.add_argument("--dialogues", type=int, default=1, help="conversations per simulated user")
+    parser.add_argument("--scripted", action="store_true", help="use the same scripted dialogue for every user")
+    parser.add_argument("--max-connections", type=int, default=100, help="connection pool size of the shared client")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--state-mode", choices=("tracker", "middleware", "lazy"), default="tracker",
+                        help="how slots/active form are refreshed after each message")
+    parser.add_argument("--middleware-url", default="http://localhost:5055",
+                        help="middleware serving /state/{sender_id}, for --state-mode middleware")
+    args = parser.parse_args()
+
+    if args.users > 0:
+        report = asyncio.run(load_test(
+            args.users, args.dialogues, args.server_url, args.port, scripted=args.scripted,
+            max_connections=args.max_connections, seed=args.seed, state_mode=args.state_mode,
+            middleware_url=args.middleware_url,
+        ))
+        for key, value in report.items():
+            print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+    else:
+        asyncio.run(main(args))
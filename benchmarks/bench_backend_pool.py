@@ -0,0 +1,77 @@
+"""Tail latency across several action servers, one of them deliberately slow.
+
+Starts stub action servers in child processes and drives ``middleware.app``
+concurrently through an ASGI transport, once per balancing policy.
+
+    python3 benchmarks/bench_backend_pool.py --fast 2 --slow-delay 0.25 --concurrency 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import middleware  # noqa: E402
+from benchmarks.payloads import make_payload  # noqa: E402
+from benchmarks.stub_action_server import start_process  # noqa: E402
+
+
+def percentile(samples, pct: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+async def run_policy(policy: str, urls, body: bytes, n: int, concurrency: int):
+    middleware.backend_pool = middleware.BackendPool(urls, policy=policy)
+    transport = httpx.ASGITransport(app=middleware.app)
+    headers = {"content-type": "application/json"}
+    samples = []
+    remaining = iter(range(n))
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await client.post("/webhook", content=body, headers=headers)
+            response.raise_for_status()
+            samples.append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://middleware", timeout=30.0) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    served = [backend.requests for backend in middleware.backend_pool.backends]
+    print(
+        f"{policy:<18} rps={n / elapsed:7.1f} p50={percentile(samples, 50) * 1e3:7.1f}ms "
+        f"p95={percentile(samples, 95) * 1e3:7.1f}ms p99={percentile(samples, 99) * 1e3:7.1f}ms "
+        f"requests per backend={served}"
+    )
+
+
+async def main(args, urls) -> None:
+    middleware.logger.disabled = True
+    middleware.app.state.upstream = middleware.create_upstream_client()
+    body = middleware.dumps_json(make_payload(2000))
+    for policy in ("round_robin", "least_outstanding"):
+        await run_policy(policy, urls, body, args.requests, args.concurrency)
+    await middleware.app.state.upstream.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--fast", type=int, default=2, help="number of fast stub servers")
+    parser.add_argument("--fast-delay", type=float, default=0.005)
+    parser.add_argument("--slow-delay", type=float, default=0.25)
+    args = parser.parse_args()
+    stubs = [start_process(args.fast_delay) for _ in range(args.fast)]
+    stubs.append(start_process(args.slow_delay))
+    try:
+        asyncio.run(main(args, [url for _, url in stubs]))
+    finally:
+        for proc, _ in stubs:
+            proc.terminate()
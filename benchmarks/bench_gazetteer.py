@@ -0,0 +1,79 @@
+"""City matching: the original per-city substring loop vs. the Gazetteer trie.
+
+Generates gazetteers of 10, 1k and 10k synthetic cities (a mix of one and two
+word names) and times both matchers over the same message corpus.
+
+    python3 benchmarks/bench_gazetteer.py --messages 2000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from actions.gazetteer import Gazetteer  # noqa: E402
+
+SYLLABLES = ["ka", "ra", "dha", "lon", "to", "kyo", "du", "bai", "mum", "pa", "ris", "khul",
+             "na", "raj", "sha", "hi", "chit", "ta", "gong", "syl", "het", "bar", "isal", "ran"]
+TEMPLATES = [
+    "I want to book a flight from {a} to {b}",
+    "book me a flight from {a} to {b} please",
+    "looking for flights to {b} from {a} next week",
+    "{a}",
+    "I need to go to {b}",
+    "what about flying from {a}",
+]
+
+
+def city_names(count: int, rng: random.Random) -> list:
+    names = set()
+    while len(names) < count:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+        if rng.random() < 0.2:
+            word += " " + "".join(rng.choice(SYLLABLES) for _ in range(2)).title()
+        names.add(word)
+    return sorted(names)
+
+
+def legacy_parse_cities(message: str, cities: list) -> list:
+    """parse_cities_from_message as it was before the gazetteer."""
+    msg_lower = message.lower()
+    mentioned = []
+    for city in cities:
+        if city.lower() in msg_lower:
+            mentioned.append(city)
+    return sorted(mentioned, key=lambda c: msg_lower.index(c.lower()))
+
+
+def time_per_message(fn, messages) -> float:
+    start = time.perf_counter()
+    for message in messages:
+        fn(message)
+    return (time.perf_counter() - start) / len(messages)
+
+
+def main(messages_count: int, sizes) -> None:
+    rng = random.Random(7)
+    print(f"{'cities':>7} {'legacy loop':>14} {'gazetteer':>12} {'build':>9}")
+    for size in sizes:
+        names = city_names(size, rng)
+        messages = [
+            rng.choice(TEMPLATES).format(a=rng.choice(names), b=rng.choice(names))
+            for _ in range(messages_count)
+        ]
+        start = time.perf_counter()
+        gazetteer = Gazetteer({"name": name} for name in names)
+        build = time.perf_counter() - start
+        legacy = time_per_message(lambda m: legacy_parse_cities(m, names), messages)
+        trie = time_per_message(gazetteer.mentioned, messages)
+        print(f"{size:>7} {legacy * 1e6:>12.1f}us {trie * 1e6:>10.1f}us {build * 1e3:>7.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    args = parser.parse_args()
+    main(args.messages, args.sizes)
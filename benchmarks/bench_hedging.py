@@ -0,0 +1,82 @@
+"""Tail latency with and without hedged requests to the action servers.
+
+Starts stub action servers in child processes that answer in --delay but take
+--tail-delay on a --tail-rate share of calls, then drives ``middleware.app``
+through an ASGI transport with hedging off and on for an idempotent action.
+Prints latency percentiles and how many extra requests hedging cost.
+
+    python3 benchmarks/bench_hedging.py --servers 2 --tail-delay 0.5 --tail-rate 0.02
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import middleware  # noqa: E402
+from benchmarks.bench_backend_pool import percentile  # noqa: E402
+from benchmarks.payloads import make_payload  # noqa: E402
+from benchmarks.stub_action_server import start_process  # noqa: E402
+
+ACTION = "action_ask_destination"
+
+
+async def run(hedge: bool, urls, body: bytes, n: int, concurrency: int) -> None:
+    middleware.backend_pool = middleware.BackendPool(urls)
+    policy = middleware.upstream_policy = middleware.UpstreamPolicy(
+        default_deadline=5.0, idempotent=[ACTION], hedge=hedge, hedge_min_samples=50,
+    )
+    transport = httpx.ASGITransport(app=middleware.app)
+    headers = {"content-type": "application/json"}
+    samples = []
+    remaining = iter(range(n))
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await client.post("/webhook", content=body, headers=headers)
+            response.raise_for_status()
+            samples.append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://middleware", timeout=30.0) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    sent = sum(backend.requests for backend in middleware.backend_pool.backends)
+    print(
+        f"hedging={'on ' if hedge else 'off'} rps={n / elapsed:7.1f} p50={percentile(samples, 50) * 1e3:7.1f}ms "
+        f"p95={percentile(samples, 95) * 1e3:7.1f}ms p99={percentile(samples, 99) * 1e3:7.1f}ms "
+        f"max={max(samples) * 1e3:7.1f}ms upstream requests={sent} ({sent / n:.3f}/call) "
+        f"hedged={policy.hedged} hedge_wins={policy.hedge_wins}"
+    )
+
+
+async def main(args, urls) -> None:
+    middleware.logger.disabled = True
+    middleware.app.state.upstream = middleware.create_upstream_client()
+    body = middleware.dumps_json(make_payload(2000, next_action=ACTION))
+    for hedge in (False, True):
+        await run(hedge, urls, body, args.requests, args.concurrency)
+    await middleware.app.state.upstream.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--servers", type=int, default=2, help="number of stub servers")
+    parser.add_argument("--delay", type=float, default=0.005)
+    parser.add_argument("--tail-delay", type=float, default=0.5)
+    parser.add_argument("--tail-rate", type=float, default=0.02)
+    args = parser.parse_args()
+    stubs = [start_process(args.delay, tail_delay=args.tail_delay, tail_rate=args.tail_rate)
+             for _ in range(args.servers)]
+    try:
+        asyncio.run(main(args, [url for _, url in stubs]))
+    finally:
+        for proc, _ in stubs:
+            proc.terminate()
@@ -0,0 +1,90 @@
+"""Next-departures lookups: linear scan of the schedule vs. the route index.
+
+Generates a synthetic schedule of --rows flights, times loading it into a
+FlightInventory, then answers --queries "next 3 departures from A to B after
+t" lookups both by scanning every row (what filtering the raw schedule per
+request costs) and through the index, and prints per-query p50/p99.
+
+    python3 benchmarks/bench_inventory.py --rows 1000000 --queries 2000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from actions.gazetteer import Gazetteer  # noqa: E402
+from actions.inventory import FlightInventory, _timestamp, generate_schedule  # noqa: E402
+from benchmarks.replay import percentile  # noqa: E402
+
+LIMIT = 3
+
+
+def scan(rows, source: str, destination: str, after: float):
+    matches = [row for row in rows if row[1] == source and row[2] == destination and row[3] >= after]
+    # Same order as the index: departure, then arrival and flight number.
+    matches.sort(key=lambda row: (row[3], row[4], row[0]))
+    return matches[:LIMIT]
+
+
+def timed(fn, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(*query)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main(rows: int, queries: int, scan_queries: int) -> None:
+    gazetteer = Gazetteer.from_file()
+    start_time = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "schedule.csv")
+        started = time.perf_counter()
+        generate_schedule(path, gazetteer.names, rows, start=start_time)
+        print(f"schedule: {rows} rows, {os.path.getsize(path) / 1e6:.1f} MB "
+              f"(generated in {time.perf_counter() - started:.1f}s)")
+
+        started = time.perf_counter()
+        inventory = FlightInventory.from_file(path, gazetteer.canonical)
+        print(f"index build:  {time.perf_counter() - started:8.2f} s ({len(inventory.routes)} routes)")
+
+        # The baseline works on rows already parsed into memory, so only the
+        # lookup itself is compared.
+        with open(path) as fh:
+            next(fh)
+            parsed = [
+                (flight, source, destination, _timestamp(departure), _timestamp(arrival))
+                for flight, source, destination, departure, arrival in (line.rstrip("\n").split(",") for line in fh)
+            ]
+
+    rng = random.Random(1)
+    base = start_time.timestamp()
+    lookups = [
+        (*rng.choice(inventory.routes), base + rng.uniform(0, 30 * 86400))
+        for _ in range(queries)
+    ]
+    for indexed, query in zip((inventory.next_departures(*q, limit=LIMIT) for q in lookups[:20]), lookups):
+        assert [f.flight for f in indexed] == [row[0] for row in scan(parsed, *query)]
+
+    for label, fn, batch in (
+        ("linear scan", lambda s, d, t: scan(parsed, s, d, t), lookups[:scan_queries]),
+        ("route index", lambda s, d, t: inventory.next_departures(s, d, t, LIMIT), lookups),
+    ):
+        latencies = timed(fn, batch)
+        print(f"{label}:  p50 {percentile(latencies, 50) * 1e6:10.1f}us  "
+              f"p99 {percentile(latencies, 99) * 1e6:10.1f}us  ({len(batch)} queries)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--scan-queries", type=int, default=20, help="queries for the (slow) linear scan")
+    args = parser.parse_args()
+    main(args.rows, args.queries, args.scan_queries)
@@ -0,0 +1,85 @@
+"""Finding one conversation in middleware.log: full scan vs. log_query's offset index.
+
+Writes a synthetic log in the middleware's sync format (request and response
+lines, requests of --size bytes spread over --senders senders), builds the
+index and updates it after more traffic, then times a grep-style scan of
+every line against an indexed query for one sender on the same log.
+
+    python3 benchmarks/bench_log_query.py --turns 5000 --size 40000
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.payloads import make_payload  # noqa: E402
+from log_query import LogIndex, read_rows  # noqa: E402
+
+ACTIONS = ["action_session_start", "action_check_flight_form_start", "validate_flight_booking_form",
+           "action_ask_destination", "action_submit_flight"]
+RESPONSE = {"events": [{"event": "slot", "timestamp": None, "name": "source", "value": "Dhaka"}], "responses": []}
+
+
+def write_log(path: str, turns: int, size: int, senders: int, first: int = 0) -> None:
+    with open(path, "a") as fh:
+        for i in range(first, first + turns):
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(1738268090 + i)) + ",000 [INFO] "
+            payload = make_payload(size, ACTIONS[i % len(ACTIONS)], f"sender-{i % senders}")
+            fh.write(stamp + "################# request from rasa core #################\n")
+            fh.write(stamp + "Incoming request from Rasa: %r\n" % payload)
+            fh.write(stamp + "################# response from action server #################\n")
+            fh.write(stamp + "Outgoing response from action server: %r\n" % RESPONSE)
+
+
+def full_scan(path: str, sender_id: str) -> int:
+    """What highlight_log_keyword.sh amounts to: every line is read and matched."""
+    needle = re.compile(r"Incoming request from Rasa: .*'sender_id': '%s'" % re.escape(sender_id))
+    found = 0
+    with open(path, errors="replace") as fh:
+        for line in fh:
+            if needle.search(line):
+                found += 1
+    return found
+
+
+def main(turns: int, size: int, senders: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "middleware.log")
+        write_log(path, turns, size, senders)
+        print(f"log: {os.path.getsize(path) / 1e6:.1f} MB, {turns} turns, {senders} senders")
+
+        index = LogIndex(path)
+        start = time.perf_counter()
+        index.update()
+        print(f"index build:        {(time.perf_counter() - start) * 1e3:8.1f} ms")
+
+        write_log(path, turns // 10, size, senders, first=turns)
+        start = time.perf_counter()
+        added = index.update()
+        print(f"incremental update: {(time.perf_counter() - start) * 1e3:8.1f} ms (+{added} records)")
+
+        # Both lookups run on the appended log, so they find the same requests.
+        start = time.perf_counter()
+        matches = full_scan(path, "sender-3")
+        print(f"full scan:          {(time.perf_counter() - start) * 1e3:8.1f} ms ({matches} requests)")
+
+        start = time.perf_counter()
+        rows = list(index.query(sender_id="sender-3", direction="request"))
+        print(f"indexed lookup:     {(time.perf_counter() - start) * 1e3:8.1f} ms ({len(rows)} requests)")
+        # Converting the repr payloads to JSON dominates once they are found.
+        start = time.perf_counter()
+        records = list(read_rows(path, rows))
+        print(f"read + parse:       {(time.perf_counter() - start) * 1e3:8.1f} ms ({len(records)} payloads)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=40000, help="approximate request payload size in bytes")
+    parser.add_argument("--senders", type=int, default=100)
+    args = parser.parse_args()
+    main(args.turns, args.size, args.senders)
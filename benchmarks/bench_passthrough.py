@@ -0,0 +1,77 @@
+"""CPU and wall time per request: parsing proxy vs. PASSTHROUGH mode.
+
+Drives ``middleware.app`` in-process through an ASGI transport against a stub
+action server running in a separate process, so the reported CPU time covers
+the middleware plus the benchmark client, but not the upstream.
+
+    python3 benchmarks/bench_passthrough.py --requests 2000 --size 40000 --logging queue
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import middleware  # noqa: E402
+from benchmarks.payloads import make_payload  # noqa: E402
+from benchmarks.stub_action_server import start_process  # noqa: E402
+
+
+def configure_logging(mode: str, tmpdir: str) -> None:
+    middleware.logger.handlers.clear()
+    if mode == "off":
+        middleware.logger.disabled = True
+    elif mode == "sync":
+        middleware.logger.addHandler(logging.FileHandler(os.path.join(tmpdir, "middleware.log")))
+    elif mode == "queue":
+        middleware.json_log = middleware.QueuedJsonLogger(os.path.join(tmpdir, "middleware.jsonl"))
+        middleware.json_log.start()
+
+
+async def run_mode(passthrough: bool, body: bytes, n: int):
+    middleware.PASSTHROUGH = passthrough
+    transport = httpx.ASGITransport(app=middleware.app)
+    headers = {"content-type": "application/json"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://middleware") as client:
+        for _ in range(50):
+            await client.post("/webhook", content=body, headers=headers)
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        for _ in range(n):
+            response = await client.post("/webhook", content=body, headers=headers)
+            response.raise_for_status()
+        return (time.process_time() - cpu_start) / n, (time.perf_counter() - wall_start) / n
+
+
+async def main(args) -> None:
+    body = middleware.dumps_json(make_payload(args.size))
+    middleware.app.state.upstream = middleware.create_upstream_client()
+    print(f"payload={len(body)} bytes logging={args.logging} requests={args.requests}")
+    for label, passthrough in (("parse", False), ("passthrough", True)):
+        cpu, wall = await run_mode(passthrough, body, args.requests)
+        print(f"{label:<12} cpu={cpu * 1e6:8.1f}us/req wall={wall * 1e6:8.1f}us/req")
+    await middleware.app.state.upstream.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=40000, help="approximate payload size in bytes")
+    parser.add_argument("--logging", choices=("off", "sync", "queue"), default="queue")
+    args = parser.parse_args()
+    stub, url = start_process()
+    middleware.backend_pool = middleware.BackendPool([url])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configure_logging(args.logging, tmpdir)
+        try:
+            asyncio.run(main(args))
+        finally:
+            stub.terminate()
+            if middleware.json_log is not None:
+                middleware.json_log.stop()
@@ -0,0 +1,62 @@
+"""Forwarding the full tracker vs. the slice the tracker manifest keeps.
+
+For conversations of growing length, times what one webhook call costs on
+both sides of the hop: encoding the forwarded payload in the middleware and
+decoding it (plus building the rasa_sdk Tracker, when rasa_sdk is installed)
+in the action server, and prints the bytes sent.
+
+    python3 benchmarks/bench_tracker_manifest.py --sizes 10000 40000 200000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import middleware  # noqa: E402
+from benchmarks.payloads import make_payload  # noqa: E402
+
+try:
+    from rasa_sdk.interfaces import Tracker
+except ImportError:
+    Tracker = None
+
+MANIFEST = {"action_ask_destination": {"events": 0, "slots": ["source"], "latest_message": False}}
+
+
+def per_call(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def action_server_side(body: bytes) -> None:
+    payload = middleware.loads_json(body)
+    if Tracker is not None:
+        Tracker.from_dict(payload["tracker"])
+
+
+def main(sizes, repeat: int) -> None:
+    slimmer = middleware.TrackerSlimmer(MANIFEST)
+    print(f"{'payload':>8} {'':>6} {'bytes':>8} {'encode':>10} {'decode':>10}"
+          + ("" if Tracker is not None else "   (rasa_sdk not installed: decode is JSON only)"))
+    for size in sizes:
+        payload = make_payload(size, next_action="action_ask_destination")
+        for label, forwarded in (("full", payload), ("slim", None)):
+            def encode():
+                return middleware.dumps_json(slimmer.slim(payload) if forwarded is None else forwarded)
+
+            body = encode()
+            encode_time = per_call(encode, repeat)
+            decode_time = per_call(lambda: action_server_side(body), repeat)
+            print(f"{size:>8} {label:>6} {len(body):>8} {encode_time * 1e6:>8.1f}us {decode_time * 1e6:>8.1f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 40000, 200000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    main(args.sizes, args.repeat)
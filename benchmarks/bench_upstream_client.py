@@ -0,0 +1,77 @@
+"""Per-request overhead of a fresh httpx client per call vs. the shared pool.
+
+Starts a stub action server in-process and posts a Rasa-sized payload to it
+sequentially, first the way ``action_webhook`` used to (new ``AsyncClient``
+per call), then through ``middleware.create_upstream_client()``.
+
+    python3 benchmarks/bench_upstream_client.py --requests 2000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import middleware  # noqa: E402
+from benchmarks.stub_action_server import start_in_thread  # noqa: E402
+
+PAYLOAD = {
+    "next_action": "action_ask_destination",
+    "sender_id": "bench",
+    "tracker": {"sender_id": "bench", "slots": {"source": "Dhaka"}, "events": []},
+    "domain": {},
+    "version": "3.6.2",
+}
+
+
+def summarize(label: str, samples) -> None:
+    samples = sorted(samples)
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    print(
+        f"{label:<16} mean={statistics.mean(samples) * 1e3:7.3f}ms "
+        f"p50={statistics.median(samples) * 1e3:7.3f}ms p99={p99 * 1e3:7.3f}ms"
+    )
+
+
+async def per_call_client(url: str, n: int):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        async with httpx.AsyncClient() as client:
+            response = await client.post(url, json=PAYLOAD, timeout=10.0)
+            response.json()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def shared_client(url: str, n: int):
+    samples = []
+    client = middleware.create_upstream_client()
+    try:
+        for _ in range(n):
+            start = time.perf_counter()
+            response = await client.post(url, json=PAYLOAD)
+            response.json()
+            samples.append(time.perf_counter() - start)
+    finally:
+        await client.aclose()
+    return samples
+
+
+async def main(n: int) -> None:
+    url = f"{start_in_thread()}/webhook"
+    await shared_client(url, 50)  # warm up the stub server
+    summarize("client per call", await per_call_client(url, n))
+    summarize("shared pool", await shared_client(url, n))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
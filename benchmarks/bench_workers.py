@@ -0,0 +1,109 @@
+"""Middleware throughput with 1..N worker processes.
+
+Starts a stub action server, then for each worker count launches
+``middleware.py --workers N`` and drives it closed-loop from several client
+processes (so the load generator is not the bottleneck), spreading requests
+over many sender_ids. Prints requests/s and p50/p95 latency per worker count.
+Scaling stops at the number of free cores: the stub server and the clients
+need CPU too.
+
+    python3 benchmarks/bench_workers.py --workers 1 2 4 --requests 4000 --size 20000
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.payloads import make_payload  # noqa: E402
+from benchmarks.replay import Results, closed_loop, percentile  # noqa: E402
+from benchmarks.stub_action_server import free_port, scratch_dir, start_process, wait_until_up  # noqa: E402
+
+
+def start_middleware(workers: int, stub_url: str, logging: str) -> Tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(os.environ, ACTION_SERVERS=stub_url, HEALTH_CHECK_INTERVAL="0", LOG_MODE=logging)
+    env.pop("MULTIPROC_DIR", None)
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "middleware.py"), "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers)],
+        cwd=scratch_dir("bench-workers-"), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    wait_until_up(url)
+    # Give every worker time to finish its startup before measuring.
+    time.sleep(1.0 + 0.2 * workers)
+    return proc, url
+
+
+def client_process(url: str, bodies: List[bytes], total: int, concurrency: int) -> Tuple[List[float], int]:
+    async def run() -> Results:
+        results = Results()
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0) as client:
+            await closed_loop(client, bodies, total, concurrency, results)
+        return results
+
+    results = asyncio.run(run())
+    return results.latencies, results.errors
+
+
+def measure(url: str, bodies: List[bytes], requests: int, clients: int, concurrency: int) -> Tuple[float, List[float], int]:
+    per_client = requests // clients
+    with multiprocessing.Pool(clients) as pool:
+        start = time.perf_counter()
+        outcomes = pool.starmap(client_process, [(url, bodies, per_client, concurrency)] * clients)
+        elapsed = time.perf_counter() - start
+    latencies = [latency for client_latencies, _ in outcomes for latency in client_latencies]
+    errors = sum(client_errors for _, client_errors in outcomes)
+    return elapsed, latencies, errors
+
+
+def main(args) -> None:
+    bodies = [
+        json.dumps(make_payload(args.size, sender_id=f"bench-{i}"), separators=(",", ":")).encode()
+        for i in range(args.senders)
+    ]
+    stub, stub_url = start_process(args.stub_delay)
+    print(f"cpus={os.cpu_count()} clients={args.clients}x{args.concurrency} size={args.size}B logging={args.logging}")
+    print(f"{'workers':>7} {'req/s':>9} {'p50':>9} {'p95':>9} {'errors':>7}  scaling")
+    try:
+        baseline = None
+        for workers in args.workers:
+            proc, url = start_middleware(workers, stub_url, args.logging)
+            try:
+                measure(url, bodies, args.requests // 10, args.clients, args.concurrency)  # warm-up
+                elapsed, latencies, errors = measure(url, bodies, args.requests, args.clients, args.concurrency)
+            finally:
+                proc.terminate()
+                proc.wait(30)
+            throughput = len(latencies) / elapsed
+            baseline = baseline or throughput
+            print(f"{workers:>7} {throughput:>9.1f} {percentile(latencies, 50) * 1e3:>7.2f}ms "
+                  f"{percentile(latencies, 95) * 1e3:>7.2f}ms {errors:>7}  x{throughput / baseline:.2f}")
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--size", type=int, default=20000, help="approximate request payload size in bytes")
+    parser.add_argument("--senders", type=int, default=64)
+    parser.add_argument("--clients", type=int, default=2, help="load generator processes")
+    parser.add_argument("--concurrency", type=int, default=16, help="in-flight requests per client process")
+    parser.add_argument("--stub-delay", type=float, default=0.0, help="stub action server delay in seconds")
+    parser.add_argument("--logging", choices=("sync", "queue"), default="queue")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,74 @@
+"""Synthetic Rasa webhook payloads of a given size for the benchmarks."""
+import json
+from typing import Any, Dict
+
+DOMAIN = {
+    "version": "3.1",
+    "intents": ["affirm", "book_flight", "deny", "goodbye", "greet", "inform", "out_of_scope", "thanks"],
+    "slots": {
+        "source": {"type": "text", "influence_conversation": True},
+        "destination": {"type": "text", "influence_conversation": True},
+    },
+    "forms": {"flight_booking_form": {"required_slots": ["source", "destination"]}},
+}
+
+
+def _turn(i: int) -> list:
+    ts = 1738268090.0 + i
+    metadata = {"model_id": "25afb97e722d4bffb7f2ed80bf58aac4", "assistant_id": "20240812-142103-meek-liquidation"}
+    return [
+        {
+            "event": "user", "timestamp": ts, "metadata": metadata,
+            "text": "book a flight from Dhaka to London",
+            "parse_data": {
+                "intent": {"name": "book_flight", "confidence": 0.98},
+                "entities": [],
+                "text": "book a flight from Dhaka to London",
+                "message_id": f"msg-{i}",
+                "metadata": {},
+            },
+            "input_channel": "rest", "message_id": f"msg-{i}",
+        },
+        {
+            "event": "action", "timestamp": ts + 0.1, "metadata": metadata,
+            "name": "action_check_flight_form_start", "policy": "RulePolicy",
+            "confidence": 1.0, "action_text": None, "hide_rule_turn": False,
+        },
+        {
+            "event": "bot", "timestamp": ts + 0.2, "metadata": metadata,
+            "text": "Which city would you like to fly to?",
+            "data": {"elements": None, "quick_replies": None, "buttons": None,
+                     "attachment": None, "image": None, "custom": None},
+        },
+    ]
+
+
+def make_payload(target_bytes: int = 2000, next_action: str = "action_ask_destination",
+                 sender_id: str = "bench") -> Dict[str, Any]:
+    """Build a webhook payload whose JSON encoding is at least `target_bytes`."""
+    events: list = []
+    payload = {
+        "next_action": next_action,
+        "sender_id": sender_id,
+        "tracker": {
+            "sender_id": sender_id,
+            "slots": {"source": "Dhaka", "destination": None, "requested_slot": "destination"},
+            "latest_message": {"intent": {"name": "inform"}, "entities": [], "text": "London"},
+            "followup_action": None,
+            "paused": False,
+            "events": events,
+            "latest_input_channel": "rest",
+            "active_loop": {"name": "flight_booking_form"},
+            "latest_action_name": "action_listen",
+        },
+        "domain": DOMAIN,
+        "version": "3.6.21",
+    }
+    size = len(json.dumps(payload, separators=(",", ":")))
+    i = 0
+    while size < target_bytes:
+        turn = _turn(i)
+        events.extend(turn)
+        size += len(json.dumps(turn, separators=(",", ":")))
+        i += 1
+    return payload
@@ -0,0 +1,165 @@
+"""Replay a middleware capture file against the middleware and report latency.
+
+Reads the JSON lines written with ``CAPTURE_PATH`` and posts each recorded
+webhook request to the middleware, either closed-loop with ``--concurrency``
+workers or open-loop at ``--rate`` requests per second. With ``--start`` it
+launches a stub action server (answering from the same capture) and the
+middleware itself, so no Rasa or action server has to be running.
+
+    CAPTURE_PATH=capture.jsonl python3 middleware.py    # record traffic
+    python3 benchmarks/replay.py capture.jsonl --start --concurrency 16 --senders 16 --requests 5000
+    python3 benchmarks/replay.py capture.jsonl --url http://localhost:5055 --rate 200 --duration 30
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.stub_action_server import free_port, scratch_dir, start_process, wait_until_up  # noqa: E402
+
+
+def load_requests(path: str, senders: int = 1) -> List[bytes]:
+    """Read the recorded requests; with `senders` > 1 spread them over that many sender_ids.
+
+    The middleware runs requests of one sender one at a time, so a capture of a
+    single conversation needs spreading to exercise concurrency.
+    """
+    bodies = []
+    with open(path) as fh:
+        for line in fh:
+            request = json.loads(line)["data"].get("request")
+            if not isinstance(request, dict):
+                continue
+            if senders > 1:
+                sender_id = f"{request.get('sender_id')}-{len(bodies) % senders}"
+                request["sender_id"] = sender_id
+                if isinstance(request.get("tracker"), dict):
+                    request["tracker"]["sender_id"] = sender_id
+            bodies.append(json.dumps(request, separators=(",", ":")).encode("utf-8"))
+    if not bodies:
+        raise SystemExit(f"No webhook requests found in {path}")
+    return bodies
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Results:
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.errors = 0
+
+    async def send(self, client: httpx.AsyncClient, body: bytes) -> None:
+        start = time.perf_counter()
+        try:
+            response = await client.post("/webhook", content=body, headers={"content-type": "application/json"})
+            ok = response.is_success
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            self.latencies.append(time.perf_counter() - start)
+        else:
+            self.errors += 1
+
+    def report(self, elapsed: float) -> None:
+        done = len(self.latencies)
+        print(f"requests={done + self.errors} errors={self.errors} elapsed={elapsed:.2f}s "
+              f"throughput={done / elapsed:.1f} req/s")
+        if done:
+            print(f"latency p50={percentile(self.latencies, 50) * 1e3:.2f}ms "
+                  f"p95={percentile(self.latencies, 95) * 1e3:.2f}ms "
+                  f"p99={percentile(self.latencies, 99) * 1e3:.2f}ms")
+
+
+async def closed_loop(client: httpx.AsyncClient, bodies: List[bytes], total: int, concurrency: int,
+                      results: Results) -> None:
+    remaining = itertools.islice(itertools.cycle(bodies), total)
+
+    async def worker() -> None:
+        for body in remaining:
+            await results.send(client, body)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def open_loop(client: httpx.AsyncClient, bodies: List[bytes], rate: float, duration: float,
+                    results: Results) -> None:
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    pending = set()
+    for i, body in enumerate(itertools.cycle(bodies)):
+        due = start + i * interval
+        if due - start >= duration:
+            break
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.ensure_future(results.send(client, body))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+    if pending:
+        await asyncio.gather(*pending)
+
+
+def start_stack(capture: str, delay: float) -> "tuple[list, str]":
+    stub, stub_url = start_process(delay, capture)
+    port = free_port()
+    env = dict(os.environ, ACTION_SERVERS=stub_url, HEALTH_CHECK_INTERVAL="0")
+    env.pop("CAPTURE_PATH", None)
+    middleware = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "middleware:app", "--app-dir", ROOT, "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=scratch_dir("replay-"), env=env, stdout=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    wait_until_up(url)
+    return [stub, middleware], url
+
+
+async def main(args, url: str) -> None:
+    bodies = load_requests(args.capture, args.senders)
+    limits = httpx.Limits(max_connections=max(args.concurrency, 100), max_keepalive_connections=max(args.concurrency, 100))
+    results = Results()
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30.0) as client:
+        start = time.perf_counter()
+        if args.rate:
+            await open_loop(client, bodies, args.rate, args.duration, results)
+        else:
+            await closed_loop(client, bodies, args.requests, args.concurrency, results)
+        results.report(time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="capture file written by the middleware")
+    parser.add_argument("--url", default="http://localhost:5055", help="middleware base URL")
+    parser.add_argument("--start", action="store_true", help="start a stub action server and the middleware")
+    parser.add_argument("--stub-delay", type=float, default=0.0, help="stub action server delay in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="closed-loop workers")
+    parser.add_argument("--senders", type=int, default=1, help="spread requests over this many sender_ids")
+    parser.add_argument("--requests", type=int, default=1000, help="closed-loop request count")
+    parser.add_argument("--rate", type=float, default=0.0, help="open-loop requests per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="open-loop duration in seconds")
+    args = parser.parse_args()
+
+    processes: Optional[list] = None
+    url = args.url
+    if args.start:
+        processes, url = start_stack(os.path.abspath(args.capture), args.stub_delay)
+    try:
+        asyncio.run(main(args, url))
+    finally:
+        for proc in processes or []:
+            proc.terminate()
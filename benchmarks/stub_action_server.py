@@ -0,0 +1,124 @@
+"""Minimal stand-in for the rasa_sdk action server used by the benchmarks.
+
+Answers every ``POST /webhook`` with a fixed rasa_sdk-shaped response, or with
+the responses recorded for the same next_action in a capture file, so the
+middleware can be exercised without Rasa or the real actions running.
+
+    python3 benchmarks/stub_action_server.py --port 6060 --delay 0.005 [--capture capture.jsonl]
+    python3 benchmarks/stub_action_server.py --delay 0.005 --tail-delay 0.5 --tail-rate 0.02   # slow 2% of calls
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+
+STUB_RESPONSE = {
+    "events": [],
+    "responses": [{"text": "Which city would you like to fly to?"}],
+}
+
+
+def load_capture_responses(path: str) -> dict:
+    """Map each next_action in a middleware capture file to its recorded responses."""
+    recorded: dict = {}
+    with open(path) as fh:
+        for line in fh:
+            exchange = json.loads(line)["data"]
+            if exchange.get("status") == 200 and isinstance(exchange.get("response"), dict):
+                recorded.setdefault(exchange["next_action"], []).append(exchange["response"])
+    return {action: itertools.cycle(responses) for action, responses in recorded.items()}
+
+
+def create_stub_app(delay: float = 0.0, capture: str = "", tail_delay: float = 0.0, tail_rate: float = 0.0) -> FastAPI:
+    stub = FastAPI()
+    recorded = load_capture_responses(capture) if capture else {}
+
+    @stub.post("/webhook")
+    async def webhook(request: Request):
+        body = await request.body()
+        pause = tail_delay if tail_rate and random.random() < tail_rate else delay
+        if pause > 0:
+            await asyncio.sleep(pause)
+        if recorded:
+            responses = recorded.get(json.loads(body).get("next_action"))
+            if responses is not None:
+                return next(responses)
+        return STUB_RESPONSE
+
+    @stub.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    return stub
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def scratch_dir(prefix: str) -> str:
+    """A fresh working directory for a child process, so the logs it writes stay out of the repo."""
+    return tempfile.mkdtemp(prefix=prefix)
+
+
+def start_in_thread(delay: float = 0.0, port: int = 0) -> str:
+    """Run a stub server in a daemon thread and return its base URL."""
+    port = port or free_port()
+    config = uvicorn.Config(create_stub_app(delay), host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+def wait_until_up(url: str, attempts: int = 200) -> None:
+    for _ in range(attempts):
+        try:
+            httpx.get(f"{url}/health")
+            return
+        except httpx.TransportError:
+            time.sleep(0.05)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_process(delay: float = 0.0, capture: str = "", tail_delay: float = 0.0,
+                  tail_rate: float = 0.0) -> "tuple[subprocess.Popen, str]":
+    """Run a stub server in a child process and return it with its base URL."""
+    port = free_port()
+    command = [sys.executable, os.path.abspath(__file__), "--host", "127.0.0.1",
+               "--port", str(port), "--delay", str(delay), "--tail-delay", str(tail_delay),
+               "--tail-rate", str(tail_rate)]
+    if capture:
+        command += ["--capture", capture]
+    proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    wait_until_up(url)
+    return proc, url
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=6060)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to sleep per request")
+    parser.add_argument("--capture", default="", help="middleware capture file to answer from")
+    parser.add_argument("--tail-delay", type=float, default=0.0, help="seconds to sleep on a slow call")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="share of calls that are slow")
+    args = parser.parse_args()
+    uvicorn.run(create_stub_app(args.delay, args.capture, args.tail_delay, args.tail_rate),
+                host=args.host, port=args.port)
@@ -0,0 +1,349 @@
+"""Repeatable benchmark suite for the action helpers and the proxy hot path.
+
+Microbenchmarks time normalize_message, parse_cities_from_message and
+infer_source_destination over a generated message corpus (memo caches
+cleared, so every call scans). Proxy cases drive ``middleware.app`` in-process
+through an ASGI transport, with the action server replaced by an in-memory
+stub so only the middleware is measured, for small and 40 KB trackers with
+logging off, sync (middleware.log) and queued (LOG_MODE=queue). Each case
+reports the median time per operation over --repeat runs, the throughput
+that implies and, for the proxy, the peak memory allocated per request
+(tracemalloc).
+
+Results are compared with benchmarks/baseline.json; the run exits 1 when a
+case got slower, or allocates more, by over --tolerance, so it can gate a
+deploy. Timings only compare on the machine the baseline was recorded on,
+which the file names; re-record with --save after an intended change.
+
+    python3 benchmarks/suite.py
+    python3 benchmarks/suite.py --only proxy --tolerance 0.15
+    python3 benchmarks/suite.py --save
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+# Measure the middleware as configured by default, whatever this shell exports.
+for name in ("PASSTHROUGH", "TRACING", "LOG_MODE", "LOG_TRACKER_DELTA", "SENDER_STATE", "CAPTURE_PATH",
+             "IN_PROCESS_ACTIONS", "MULTIPROC_DIR"):
+    os.environ.pop(name, None)
+os.environ.setdefault("MIDDLEWARE_CONFIG", os.path.join(ROOT, "middleware.yml"))
+
+import middleware  # noqa: E402
+from benchmarks.payloads import make_payload  # noqa: E402
+from benchmarks.stub_action_server import STUB_RESPONSE  # noqa: E402
+
+try:
+    from actions import actions
+except ImportError:
+    actions = None
+
+TEMPLATES = [
+    "I want to book a flight from {a} to {b}",
+    "book me a flight from {a} to {b} please",
+    "looking for flights to {b} from {a} next week",
+    "{a}",
+    "I need to go to {b}",
+    "what about flying from {a}",
+    "hi there, can you   find me something\n to {b}?",
+    "from {a}",
+]
+FILLER = ["asap", "tomorrow", "on friday", "for two adults", "cheapest please", "thanks", "", ""]
+PROXY_SIZES = (("small", 2000), ("40kb", 40000))
+LOG_MODES = ("off", "sync", "queue")
+MICRO_CASES = ("actions.normalize_message", "actions.parse_cities_from_message", "actions.infer_source_destination")
+MIN_RUN_TIME = 0.05
+
+Result = Dict[str, Optional[float]]
+
+
+def message_corpus(names: List[str], count: int, seed: int = 7) -> List[str]:
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        a, b = rng.sample(names, 2)
+        text = rng.choice(TEMPLATES).format(a=a if rng.random() < 0.8 else a.lower(), b=b)
+        messages.append(f"{text} {rng.choice(FILLER)}".replace(" ", "  " if rng.random() < 0.3 else " "))
+    return messages
+
+
+def summarize(samples: List[float]) -> Result:
+    """Seconds per operation of each run to the reported figures.
+
+    The median is what gets compared: on a shared host the fastest run is
+    an outlier as often as the slowest one.
+    """
+    return {"us_per_op": round(statistics.median(samples) * 1e6, 3), "best_us": round(min(samples) * 1e6, 3)}
+
+
+def without_gc(run: Callable[[], float]) -> float:
+    """Like timeit, keep cyclic GC pauses out of the timed runs."""
+    gc.collect()
+    gc.disable()
+    try:
+        return run()
+    finally:
+        gc.enable()
+
+
+def micro_cases(count: int) -> Dict[str, Callable[[], float]]:
+    messages = message_corpus(actions.GAZETTEER.names, count)
+    normalized = [actions.normalize_message(message) for message in messages]
+
+    def per_call(fn: Callable[[str], Any], corpus: List[str]) -> Callable[[], float]:
+        def run() -> float:
+            # Pass over the corpus for at least MIN_RUN_TIME so one run is not
+            # just timer noise, clearing the memo caches outside the clock.
+            elapsed, calls = 0.0, 0
+            while elapsed < MIN_RUN_TIME:
+                actions.index_message.cache_clear()
+                actions._infer_source_destination.cache_clear()
+                start = time.perf_counter()
+                for message in corpus:
+                    fn(message)
+                elapsed += time.perf_counter() - start
+                calls += len(corpus)
+            return elapsed / calls
+        return run
+
+    return {
+        "actions.normalize_message": per_call(actions.normalize_message, messages),
+        "actions.parse_cities_from_message": per_call(actions.parse_cities_from_message, normalized),
+        "actions.infer_source_destination": per_call(
+            lambda message: actions.infer_source_destination(message, None, None), messages
+        ),
+    }
+
+
+def stub_upstream() -> httpx.AsyncClient:
+    body = json.dumps(STUB_RESPONSE).encode()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=body, headers={"content-type": "application/json"})
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def set_logging(mode: str, tmpdir: str) -> None:
+    if middleware.json_log is not None:
+        middleware.json_log.stop()
+        middleware.json_log = None
+    middleware.logger.handlers.clear()
+    middleware.logger.disabled = mode == "off"
+    if mode == "sync":
+        handler = middleware.AppendFileHandler(os.path.join(tmpdir, "middleware.log"))
+        handler.setFormatter(middleware.formatter)
+        middleware.logger.addHandler(handler)
+    elif mode == "queue":
+        middleware.json_log = middleware.QueuedJsonLogger(os.path.join(tmpdir, "middleware.jsonl"))
+        middleware.json_log.start()
+
+
+async def proxy_case(body: bytes, requests: int, repeat: int, allocations: int) -> Result:
+    headers = {"content-type": "application/json"}
+    transport = httpx.ASGITransport(app=middleware.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://middleware") as client:
+        async def post() -> None:
+            response = await client.post("/webhook", content=body, headers=headers)
+            response.raise_for_status()
+
+        for _ in range(50):
+            await post()
+        samples = []
+        for _ in range(repeat):
+            gc.collect()
+            gc.disable()
+            try:
+                start = time.perf_counter()
+                for _ in range(requests):
+                    await post()
+                samples.append((time.perf_counter() - start) / requests)
+            finally:
+                gc.enable()
+
+        tracemalloc.start()
+        peaks = []
+        try:
+            for _ in range(allocations):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                await post()
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        finally:
+            tracemalloc.stop()
+    return dict(summarize(samples), alloc_kb=round(statistics.median(peaks) / 1024, 1))
+
+
+async def proxy_result(size: int, mode: str, requests: int, repeat: int, allocations: int) -> Result:
+    middleware.app.state.upstream = stub_upstream()
+    middleware.backend_pool = middleware.BackendPool(["http://stub-action-server"])
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            set_logging(mode, tmpdir)
+            try:
+                return await proxy_case(middleware.dumps_json(make_payload(size)), requests, repeat, allocations)
+            finally:
+                set_logging("off", tmpdir)
+    finally:
+        await middleware.app.state.upstream.aclose()
+
+
+def case_names() -> List[str]:
+    return list(MICRO_CASES) + [f"proxy.{label}.log_{mode}" for label, _ in PROXY_SIZES for mode in LOG_MODES]
+
+
+def run_case(name: str, args) -> Optional[Result]:
+    """Run one case in this process; None when it cannot run here."""
+    if name in MICRO_CASES:
+        if actions is None:
+            return None
+        run = micro_cases(args.messages)[name]
+        return dict(summarize([without_gc(run) for _ in range(args.repeat)]), alloc_kb=None)
+    _, label, mode = name.split(".")
+    size = dict(PROXY_SIZES)[label]
+    return asyncio.run(proxy_result(size, mode[len("log_"):], args.requests, args.repeat, args.allocations))
+
+
+def run_case_process(name: str, args) -> Optional[Result]:
+    """Run one case in a fresh interpreter with a fixed hash seed.
+
+    Cases measured one after another in the same process drift by tens of
+    percent with the heap and cache state the earlier ones leave behind, and
+    string hashing is randomised per process; both would swamp a regression.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--case", name, "--repeat", str(args.repeat),
+               "--messages", str(args.messages), "--requests", str(args.requests),
+               "--allocations", str(args.allocations)]
+    output = subprocess.run(command, env=dict(os.environ, PYTHONHASHSEED="0"), check=True,
+                            stdout=subprocess.PIPE, cwd=tempfile.gettempdir()).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def machine() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "orjson": middleware.orjson is not None,
+    }
+
+
+def print_result(name: str, result: Result) -> None:
+    alloc = f"{result['alloc_kb']:9.1f}KB" if result.get("alloc_kb") is not None else f"{'-':>11}"
+    print(f"{name:<38} {result['us_per_op']:10.2f}us {1e6 / result['us_per_op']:11.0f}/s {alloc}")
+
+
+def regressions_of(result: Result, base: Result, tolerance: float) -> List[str]:
+    """How `result` is slower or hungrier than `base` by more than `tolerance`."""
+    found = []
+    change = result["us_per_op"] / base["us_per_op"] - 1
+    if change > tolerance:
+        found.append(f"{change:+.0%} time per op")
+    if base.get("alloc_kb") is not None and result.get("alloc_kb") is not None:
+        # Half a KB of slack so tiny cases do not trip on allocator noise.
+        if result["alloc_kb"] > base["alloc_kb"] * (1 + tolerance) + 0.5:
+            found.append(f"{base['alloc_kb']:.1f}KB -> {result['alloc_kb']:.1f}KB allocated per op")
+    return found
+
+
+def compare(results: Dict[str, Result], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print each case against the baseline; returns the regressions."""
+    if baseline.get("machine") != machine():
+        print(f"warning: baseline was recorded on {baseline.get('machine')}, timings may not compare")
+    regressions = []
+    print(f"\n{'case':<38} {'baseline':>12} {'now':>12} {'change':>8}")
+    for name, result in results.items():
+        base = baseline["cases"].get(name)
+        if base is None:
+            print(f"{name:<38} {'(new)':>12} {result['us_per_op']:10.2f}us")
+            continue
+        found = regressions_of(result, base, tolerance)
+        regressions.extend(f"{name}: {problem}" for problem in found)
+        change = result["us_per_op"] / base["us_per_op"] - 1
+        print(f"{name:<38} {base['us_per_op']:10.2f}us {result['us_per_op']:10.2f}us {change:>+8.1%}"
+              + ("  REGRESSION" if found else ""))
+    return regressions
+
+
+def main(args) -> int:
+    if args.case:
+        print(json.dumps(run_case(args.case, args)))
+        return 0
+    print(f"{'case':<38} {'per op':>12} {'throughput':>13} {'alloc/op':>11}")
+    results: Dict[str, Result] = {}
+    for name in case_names():
+        if args.only and args.only not in name:
+            continue
+        result = run_case_process(name, args)
+        if result is None:
+            print(f"{name:<38} skipped (rasa_sdk is not installed)")
+            continue
+        results[name] = result
+        print_result(name, result)
+
+    if args.save:
+        baseline = {"machine": machine(), "recorded": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                    "cases": results}
+        if os.path.exists(args.baseline) and args.only:
+            # A partial run only replaces the cases it ran.
+            with open(args.baseline) as fh:
+                baseline["cases"] = dict(json.load(fh)["cases"], **results)
+        with open(args.baseline, "w") as fh:
+            json.dump(baseline, fh, indent=2, sort_keys=True)
+            fh.write("\n")
+        print(f"\nbaseline written to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"\nno baseline at {args.baseline}; record one with --save")
+        return 0
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    for name, result in results.items():
+        base = baseline["cases"].get(name)
+        if base is not None and regressions_of(result, base, args.tolerance):
+            # Timings on a shared host swing by tens of percent between runs;
+            # a case only fails if a second run is no better.
+            print(f"{name}: re-running to rule out noise")
+            again = run_case_process(name, args)
+            results[name] = dict(again, us_per_op=min(result["us_per_op"], again["us_per_op"]))
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nregressions over {:.0%}:\n  ".format(args.tolerance) + "\n  ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.getLogger("actions").setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--only", help="run only the cases whose name contains this, e.g. proxy or 40kb")
+    parser.add_argument("--repeat", type=int, default=10, help="runs per case; the median counts")
+    parser.add_argument("--messages", type=int, default=2000, help="messages in the action helper corpus")
+    parser.add_argument("--requests", type=int, default=200, help="webhook calls per proxy run")
+    parser.add_argument("--allocations", type=int, default=50, help="webhook calls traced for allocations")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing, 0.25 = 25%%")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="record these results as the new baseline")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,360 @@
+"""Query middleware.log (or the LOG_MODE=queue JSON lines) through an offset index.
+
+The first run scans the log once and writes a sidecar SQLite index
+(`<log>.idx`, one row per payload: offset, length, timestamp, direction,
+sender_id, next_action), with B-tree indexes on sender_id, next_action and
+timestamp and a record of how far the log has been indexed. Later runs only
+index the bytes appended since, a query looks up just the matching rows and
+reads their payloads from the log through mmap. Python-repr payloads are
+converted to JSON on output.
+
+Responses are logged with the sender_id and next_action of their request.
+Logs written before that only have them on requests, so their responses are
+attributed to the most recent request logged before them, which is only
+right while one call is in flight at a time.
+
+    python3 log_query.py middleware.log --sender user --since "2025-01-31 02:40" --until "2025-01-31 03:00"
+    python3 log_query.py middleware.log --action action_submit_flight --direction request --limit 5
+    python3 log_query.py middleware.jsonl --sender default --highlight next_action latest_action_name
+"""
+import argparse
+import ast
+import json
+import mmap
+import os
+import re
+import sqlite3
+import sys
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+INDEX_VERSION = 2
+# Offset, length, timestamp, direction, sender_id, next_action
+IndexRow = Tuple[int, int, float, str, Optional[str], Optional[str]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS records (
+    offset INTEGER, length INTEGER, ts REAL, direction TEXT, sender_id TEXT, next_action TEXT
+);
+CREATE INDEX IF NOT EXISTS records_ts ON records (ts);
+CREATE INDEX IF NOT EXISTS records_sender ON records (sender_id, ts);
+CREATE INDEX IF NOT EXISTS records_action ON records (next_action, ts);
+"""
+
+LINE_PREFIX = re.compile(rb"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),(\d{3}) \[[A-Z]+\] ")
+# Header lines of the older two-line format; the payload follows on the next line.
+HEADERS = {
+    b"===== Incoming request from Rasa =====": "request",
+    b"===== Response from real action server =====": "response",
+}
+# Messages with the payload on the same line.
+INLINE = (
+    (b"Incoming request from Rasa: ", "request"),
+    (b"Outgoing response from action server: ", "response"),
+    (b"Incoming request: ", "request"),
+    (b"Action response: ", "response"),
+)
+# Response line naming its request: `<marker>{"sender_id":..,"next_action":..}: <payload>`.
+KEYED_RESPONSE = b"Outgoing response from action server for "
+# next_action and sender_id come first in a webhook payload (and in the keys
+# of a queue record), so only the head of a (possibly 40 KB) line is searched.
+KEY_WINDOW = 1024
+NEXT_ACTION = re.compile(rb"""["']next_action["']:\s*["']([^"']*)["']""")
+SENDER_ID = re.compile(rb"""["']sender_id["']:\s*["']([^"']*)["']""")
+QUEUE_RECORD = re.compile(rb'\{"ts":\s*([0-9.eE+-]+),\s*"event":\s*"(\w+)"')
+
+COLORS = ["\033[1;32m", "\033[1;34m", "\033[1;33m", "\033[1;31m", "\033[1;36m", "\033[1;35m"]
+RESET = "\033[0m"
+
+
+def _match(pattern: "re.Pattern[bytes]", head: bytes) -> Optional[str]:
+    found = pattern.search(head)
+    return found.group(1).decode("utf-8", "replace") if found else None
+
+
+def _guess_direction(head: bytes) -> Optional[str]:
+    if NEXT_ACTION.search(head):
+        return "request"
+    if re.match(rb"""\{\s*["'](events|responses)["']""", head):
+        return "response"
+    return None
+
+
+class LogIndex:
+    """Sidecar SQLite index over one log file, updated incrementally."""
+
+    def __init__(self, log_path: str) -> None:
+        self.log_path = log_path
+        self.index_path = log_path + ".idx"
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            try:
+                self._db = self._open()
+            except sqlite3.DatabaseError:
+                # An index in the line format of older versions.
+                os.remove(self.index_path)
+                self._db = self._open()
+        return self._db
+
+    def _open(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.index_path, isolation_level=None)
+        db.executescript(SCHEMA)
+        return db
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _head_crc(self, size: int) -> int:
+        with open(self.log_path, "rb") as fh:
+            return zlib.crc32(fh.read(min(size, 4096)))
+
+    def _load_meta(self) -> Optional[Dict[str, Any]]:
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'state'").fetchone()
+        if row is None:
+            return None
+        meta = json.loads(row[0])
+        stat = os.stat(self.log_path)
+        if (
+            meta.get("version") != INDEX_VERSION
+            or meta.get("inode") != stat.st_ino
+            or meta.get("indexed_to", 0) > stat.st_size
+            or meta.get("head_crc") != self._head_crc(meta.get("head_size", 0))
+        ):
+            # Rotated or truncated log, or an index from another version.
+            return None
+        return meta
+
+    def update(self, rebuild: bool = False) -> int:
+        """Index whatever was appended since the last run; returns the number of new rows."""
+        meta = None if rebuild else self._load_meta()
+        stat = os.stat(self.log_path)
+        new_rows: List[IndexRow] = []
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            if meta is None:
+                meta = {"indexed_to": 0, "pending": None, "last_request": [None, None]}
+                self.db.execute("DELETE FROM records")
+            if stat.st_size > meta["indexed_to"]:
+                with open(self.log_path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    meta["indexed_to"] = self._scan(mm, meta, new_rows)
+            self.db.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?)", new_rows)
+            meta.update(
+                version=INDEX_VERSION,
+                inode=stat.st_ino,
+                head_size=min(stat.st_size, 4096),
+                head_crc=self._head_crc(stat.st_size),
+            )
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('state', ?)", (json.dumps(meta),))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return len(new_rows)
+
+    @staticmethod
+    def _scan(mm: mmap.mmap, meta: Dict[str, Any], rows: List[IndexRow]) -> int:
+        """Index the complete lines after meta["indexed_to"]; returns the new end offset."""
+        pos = meta["indexed_to"]
+        pending = meta["pending"]
+        last_sender, last_action = meta["last_request"]
+        while True:
+            end = mm.find(b"\n", pos)
+            if end == -1:
+                # A line still being written is picked up by the next update.
+                break
+            start = pos
+            pos = end + 1
+            ts: Optional[float] = None
+            prefix = LINE_PREFIX.match(mm[start:start + 64])
+            if prefix:
+                ts = time.mktime(time.strptime(prefix.group(1).decode(), "%Y-%m-%d %H:%M:%S")) + int(prefix.group(2)) / 1000
+                start += prefix.end()
+            if mm[start:start + 1] == b"{":
+                head = mm[start:min(end, start + KEY_WINDOW)]
+                direction = None
+                if prefix is None:
+                    # LOG_MODE=queue record: {"ts":..,"event":..,[keys,]"data":{..}};
+                    # the whole record is indexed and the keys are looked up in its head.
+                    record = QUEUE_RECORD.match(head)
+                    if record is None:
+                        continue
+                    ts, direction = float(record.group(1)), record.group(2).decode()
+                    if direction == "response" and SENDER_ID.search(head):
+                        rows.append((start, end - start, ts, direction, _match(SENDER_ID, head), _match(NEXT_ACTION, head)))
+                        continue
+                elif pending is not None:
+                    direction = pending["direction"]
+                else:
+                    direction = _guess_direction(head)
+                pending = None
+                if direction is None:
+                    continue
+                if direction == "request":
+                    last_sender = _match(SENDER_ID, head)
+                    last_action = _match(NEXT_ACTION, head)
+                rows.append((start, end - start, ts or 0.0, direction, last_sender, last_action))
+                continue
+            message = mm[start:end].rstrip(b"\r")
+            if message in HEADERS:
+                pending = {"direction": HEADERS[message]}
+                continue
+            pending = None
+            if message.startswith(KEYED_RESPONSE):
+                text = message[len(KEYED_RESPONSE):len(KEYED_RESPONSE) + KEY_WINDOW].decode("utf-8", "replace")
+                try:
+                    keys, used = json.JSONDecoder().raw_decode(text)
+                except ValueError:
+                    continue
+                start += len(KEYED_RESPONSE) + len(text[:used].encode("utf-8")) + len(b": ")
+                rows.append((start, end - start, ts or 0.0, "response", keys.get("sender_id"), keys.get("next_action")))
+                continue
+            for marker, direction in INLINE:
+                if message.startswith(marker):
+                    start += len(marker)
+                    head = mm[start:min(end, start + KEY_WINDOW)]
+                    if direction == "request":
+                        last_sender = _match(SENDER_ID, head)
+                        last_action = _match(NEXT_ACTION, head)
+                    rows.append((start, end - start, ts or 0.0, direction, last_sender, last_action))
+                    break
+        meta["pending"] = pending
+        meta["last_request"] = [last_sender, last_action]
+        return pos
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def query(
+        self,
+        sender_id: Optional[str] = None,
+        next_action: Optional[str] = None,
+        direction: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 0,
+    ) -> Iterator[IndexRow]:
+        """Matching rows in time order, looked up through the sender, action or time index."""
+        clauses, params = [], []
+        for column, value in (("sender_id", sender_id), ("next_action", next_action), ("direction", direction)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts <= ?")
+            params.append(until)
+        sql = "SELECT * FROM records"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        # Log order breaks ties; several processes may share one file.
+        sql += " ORDER BY ts, offset"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        yield from self.db.execute(sql, params)
+
+
+def parse_payload(raw: bytes) -> Any:
+    """Parse a logged payload, which is JSON or a Python repr of a dict."""
+    text = raw.decode("utf-8", "replace")
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def read_rows(log_path: str, rows: List[IndexRow]) -> Iterator[Dict[str, Any]]:
+    if not rows:
+        return
+    with open(log_path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for offset, length, ts, direction, sender_id, next_action in rows:
+            data = parse_payload(mm[offset:offset + length])
+            if isinstance(data, dict) and "event" in data and "data" in data and "ts" in data:
+                data = data["data"]
+            yield {
+                "ts": ts,
+                "time": datetime.fromtimestamp(ts).isoformat(sep=" ", timespec="milliseconds"),
+                "direction": direction,
+                "sender_id": sender_id,
+                "next_action": next_action,
+                "data": data,
+            }
+
+
+def parse_time(value: str) -> float:
+    """Epoch seconds or a local "YYYY-MM-DD[ HH:MM[:SS]]" timestamp."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"Unrecognised time: {value}")
+
+
+def highlight(text: str, words: List[str]) -> str:
+    for i, word in enumerate(words):
+        color = COLORS[i % len(COLORS)]
+        text = re.sub(word, lambda m: f"{color}{m.group(0)}{RESET}", text)
+    return text
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("log", nargs="?", default="middleware.log")
+    parser.add_argument("--sender", help="sender_id to select")
+    parser.add_argument("--action", help="next_action to select")
+    parser.add_argument("--direction", choices=("request", "response"))
+    parser.add_argument("--since", type=parse_time)
+    parser.add_argument("--until", type=parse_time)
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many records (0 = all)")
+    parser.add_argument("--reindex", action="store_true", help="rebuild the index from scratch")
+    parser.add_argument("--stats", action="store_true", help="print index counts instead of records")
+    parser.add_argument("--indent", type=int, default=None, help="pretty-print the JSON output")
+    parser.add_argument("--highlight", nargs="+", default=[], metavar="WORD",
+                        help="colour these regexes in the output, like highlight_log_keyword.sh did")
+    args = parser.parse_args()
+
+    index = LogIndex(args.log)
+    started = time.perf_counter()
+    added = index.update(rebuild=args.reindex)
+    print(f"indexed {added} new records ({len(index)} total) in {time.perf_counter() - started:.3f}s",
+          file=sys.stderr)
+
+    rows = list(index.query(args.sender, args.action, args.direction, args.since, args.until, args.limit))
+    if args.stats:
+        counts: Dict[str, int] = {}
+        for row in rows:
+            key = f"{row[4]}\t{row[3]}\t{row[5]}"
+            counts[key] = counts.get(key, 0) + 1
+        print("sender_id\tdirection\tnext_action\tcount")
+        for key, count in sorted(counts.items()):
+            print(f"{key}\t{count}")
+        return
+    try:
+        for record in read_rows(args.log, rows):
+            line = json.dumps(record, indent=args.indent, ensure_ascii=False, default=str)
+            print(highlight(line, args.highlight) if args.highlight else line)
+    except BrokenPipeError:
+        # Piped into head/less that exited early.
+        sys.stderr.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,2204 @@
 # middleware.py (Updated)
+import argparse
+import hmac
+import os
+import asyncio
+import json
+import random
+import re
+import signal
+import sqlite3
+import tempfile
+from bisect import bisect_left
+import queue
+import threading
+import time
 import uvicorn
+try:
+    import fcntl
+except ImportError:  # Windows: snapshots of exited workers are kept as they are
+    fcntl = None
 import logging
 import sys
 import httpx
-from fastapi import FastAPI, Request, HTTPException
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import FastAPI, Request, HTTPException, Response
+from fastapi.responses import JSONResponse
+
+
+
+class AppendFileHandler(logging.Handler):
+    """Append each record to a file with a single O_APPEND write.
+
+    logging.FileHandler writes through an 8 KB buffer, so the 40 KB payload
+    lines of several worker processes sharing middleware.log could interleave.
+    One write() per record on an O_APPEND descriptor keeps every line whole.
+    Like FileHandler, the file is reopened on the next record after `close`
+    (uvicorn's logging setup closes every existing handler).
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = os.path.abspath(path)
+        self.fd: Optional[int] = None
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            data = (self.format(record) + "\n").encode("utf-8", "replace")
+            if self.fd is None:
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            while data:
+                written = os.write(self.fd, data)
+                data = data[written:]
+        except Exception:
+            self.handleError(record)
+
+    def close(self) -> None:
+        self.acquire()
+        try:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+        except OSError:
+            self.fd = None
+        finally:
+            self.release()
+        super().close()
+
 
 logger = logging.getLogger("middleware_logger")
 logger.setLevel(logging.INFO)
 formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
 
-file_handler = logging.FileHandler("middleware.log", mode="a")
-file_handler.setFormatter(formatter)
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(formatter)
+# Worker processes import this module twice (as __mp_main__ and as the app
+# module); the handlers are attached only once.
+if not logger.handlers:
+    file_handler = AppendFileHandler("middleware.log")
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(formatter)
 
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
 
-REAL_ACTION_SERVER = "http://localhost:6060"
-app = FastAPI()
+# Optional per-action settings (see middleware.yml). Missing file means defaults.
+MIDDLEWARE_CONFIG = os.environ.get("MIDDLEWARE_CONFIG", "middleware.yml")
 
-@app.post("/webhook")
-async def action_webhook(request: Request):
+
+def load_config(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    import yaml
+
+    with open(path) as fh:
+        return yaml.safe_load(fh) or {}
+
+
+config = load_config(MIDDLEWARE_CONFIG)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_json(obj: Any) -> bytes:
+    """Serialize to compact JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, default=str, separators=(",", ":")).encode("utf-8")
+
+
+def loads_json(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+# Directory shared by the worker processes of `python3 middleware.py --workers N`
+# for their metrics snapshots and sender state. The launcher creates one when
+# it is not set; empty means a single process that keeps everything in memory.
+MULTIPROC_DIR = os.environ.get("MULTIPROC_DIR", "")
+WORKER_ID = str(os.getpid())
+
+
+# "sync" logs every payload through `logger` inside the request handler,
+# "queue" hands the raw objects to a background JSON-lines writer.
+LOG_MODE = os.environ.get("LOG_MODE", "sync")
+LOG_JSON_PATH = os.environ.get("LOG_JSON_PATH", "middleware.jsonl")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.environ.get("LOG_BATCH_SIZE", "256"))
+LOG_FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", "0.5"))
+# "drop" discards records once the queue is full, "sample" additionally keeps
+# only one in LOG_SAMPLE_RATE records once the queue is half full.
+LOG_QUEUE_POLICY = os.environ.get("LOG_QUEUE_POLICY", "drop")
+LOG_SAMPLE_RATE = int(os.environ.get("LOG_SAMPLE_RATE", "10"))
+
+
+class QueuedJsonLogger:
+    """Write log records as JSON lines from a background thread.
+
+    `submit` only enqueues the raw objects, so the event loop never pays for
+    serialization or disk writes. The writer thread drains the queue in
+    batches and flushes after every batch. `keys` (sender_id and next_action
+    of a response) are written as top-level fields before `data`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        maxsize: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 0.5,
+        policy: str = "drop",
+        sample_rate: int = 10,
+    ) -> None:
+        if policy not in ("drop", "sample"):
+            raise ValueError(f"Unknown log queue policy: {policy}")
+        self.path = path
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.sample_rate = max(1, sample_rate)
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self._pressure_count = 0
+        self._queue: "queue.Queue[Tuple[float, str, Any, Optional[Dict[str, str]]]]" = queue.Queue(maxsize)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="json-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the writer thread after everything queued has been written."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, event: str, data: Any, keys: Optional[Dict[str, str]] = None) -> None:
+        if self.policy == "sample" and self._queue.qsize() >= self.maxsize // 2:
+            self._pressure_count += 1
+            if self._pressure_count % self.sample_rate:
+                self.sampled_out += 1
+                return
+        try:
+            self._queue.put_nowait((time.time(), event, data, keys))
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.submitted += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "submitted": self.submitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+        }
+
+    def _drain(self) -> List[Tuple[float, str, Any, Optional[Dict[str, str]]]]:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        # Unbuffered, so each batch is a single O_APPEND write even when
+        # several worker processes share the file.
+        with open(self.path, "ab", buffering=0) as fh:
+            while not (self._stop.is_set() and self._queue.empty()):
+                batch = self._drain()
+                if not batch:
+                    continue
+                lines = []
+                for ts, event, data, keys in batch:
+                    try:
+                        lines.append(self._record_line(ts, event, data, keys))
+                    except Exception as e:
+                        logger.error(f"Could not serialize {event} log record: {e}")
+                if lines:
+                    data = memoryview(b"\n".join(lines) + b"\n")
+                    while data:
+                        data = data[fh.write(data):]
+                    self.written += len(lines)
+
+    @staticmethod
+    def _record_line(ts: float, event: str, data: Any, keys: Optional[Dict[str, str]] = None) -> bytes:
+        record = {"ts": ts, "event": event}
+        if keys:
+            record.update(keys)
+        if isinstance(data, bytes):
+            # Raw body from passthrough mode, embedded as it is once it has
+            # parsed as JSON; re-encoded if it spans several lines, kept as a
+            # string if the action server did not send JSON.
+            try:
+                parsed = loads_json(data)
+            except ValueError:
+                return dumps_json(dict(record, data=data.decode("utf-8", "replace")))
+            if b"\n" in data or b"\r" in data:
+                data = dumps_json(parsed)
+            return dumps_json(record)[:-1] + b',"data":' + data + b"}"
+        if isinstance(data, dict) and any(isinstance(value, bytes) for value in data.values()):
+            data = {key: _parse_or_text(value) if isinstance(value, bytes) else value for key, value in data.items()}
+        return dumps_json(dict(record, data=data))
+
+
+def _parse_or_text(raw: bytes) -> Any:
     try:
-        incoming_data = await request.json()
+        return loads_json(raw)
+    except ValueError:
+        return raw.decode("utf-8", "replace")
+
+
+json_log: Optional[QueuedJsonLogger] = None
+if LOG_MODE == "queue":
+    json_log = QueuedJsonLogger(
+        LOG_JSON_PATH,
+        maxsize=LOG_QUEUE_SIZE,
+        batch_size=LOG_BATCH_SIZE,
+        flush_interval=LOG_FLUSH_INTERVAL,
+        policy=LOG_QUEUE_POLICY,
+        sample_rate=LOG_SAMPLE_RATE,
+    )
+
+
+# With CAPTURE_PATH set every webhook request/response pair is appended to that
+# file as one compact JSON line, for benchmarks/replay.py to play back.
+CAPTURE_PATH = os.environ.get("CAPTURE_PATH", "")
+
+capture_log: Optional[QueuedJsonLogger] = None
+if CAPTURE_PATH:
+    capture_log = QueuedJsonLogger(CAPTURE_PATH, maxsize=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE)
+
+
+# With LOG_TRACKER_DELTA=1 requests are logged as the events and slots that
+# changed since the previous request of the same sender, with a full snapshot
+# every LOG_SNAPSHOT_EVERY requests so conversations can be reconstructed.
+LOG_TRACKER_DELTA = os.environ.get("LOG_TRACKER_DELTA", "0") == "1"
+LOG_SNAPSHOT_EVERY = int(os.environ.get("LOG_SNAPSHOT_EVERY", "20"))
+LOG_DELTA_MAX_SENDERS = int(os.environ.get("LOG_DELTA_MAX_SENDERS", "10000"))
+
+
+class TrackerDeltaLog:
+    """Reduce incoming webhook payloads to per-sender tracker deltas.
+
+    Remembers the event count and slots last seen for each sender_id in an
+    LRU of at most `max_senders` entries. A sender that is new, evicted, due
+    for a snapshot or whose event history shrank gets the full payload logged.
+    With several workers each one keeps its own LRU, so records carry a
+    `worker` id and a conversation is rebuilt per (worker, sender_id).
+    """
+
+    def __init__(self, snapshot_every: int = 20, max_senders: int = 10000, worker: Optional[str] = None) -> None:
+        self.snapshot_every = max(1, snapshot_every)
+        self.max_senders = max_senders
+        self.worker = worker
+        self._senders: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def reduce(self, incoming_data: Dict[str, Any]) -> Dict[str, Any]:
+        tracker = incoming_data.get("tracker") or {}
+        sender_id = incoming_data.get("sender_id") or tracker.get("sender_id")
+        events = tracker.get("events") or []
+        slots = tracker.get("slots") or {}
+
+        state = self._senders.get(sender_id)
+        if state is not None:
+            self._senders.move_to_end(sender_id)
+        if (
+            state is None
+            or state["requests"] >= self.snapshot_every
+            or len(events) < state["event_count"]
+        ):
+            self._remember(sender_id, len(events), slots, requests=1)
+            snapshot = dict(incoming_data, snapshot=True)
+            if self.worker is not None:
+                snapshot["worker"] = self.worker
+            return snapshot
+
+        changed_slots = {
+            name: value for name, value in slots.items()
+            if name not in state["slots"] or state["slots"][name] != value
+        }
+        delta = {
+            "next_action": incoming_data.get("next_action"),
+            "sender_id": sender_id,
+            "snapshot": False,
+            "event_offset": state["event_count"],
+            "new_events": events[state["event_count"]:],
+            "changed_slots": changed_slots,
+        }
+        if self.worker is not None:
+            delta["worker"] = self.worker
+        self._remember(sender_id, len(events), slots, requests=state["requests"] + 1)
+        return delta
+
+    def _remember(self, sender_id: str, event_count: int, slots: Dict[str, Any], requests: int) -> None:
+        self._senders[sender_id] = {
+            "event_count": event_count,
+            "slots": dict(slots),
+            "requests": requests,
+        }
+        self._senders.move_to_end(sender_id)
+        while len(self._senders) > self.max_senders:
+            self._senders.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._senders)
+
+
+tracker_delta_log: Optional[TrackerDeltaLog] = None
+if LOG_TRACKER_DELTA:
+    tracker_delta_log = TrackerDeltaLog(
+        LOG_SNAPSHOT_EVERY, LOG_DELTA_MAX_SENDERS, worker=WORKER_ID if MULTIPROC_DIR else None
+    )
+
+
+# With SENDER_STATE=1 the latest slots and active loop of each sender, as seen
+# in webhook traffic, are served on /state/{sender_id}.
+SENDER_STATE = os.environ.get("SENDER_STATE", "0") == "1"
+SENDER_STATE_MAX_SENDERS = int(os.environ.get("SENDER_STATE_MAX_SENDERS", "10000"))
+
+
+class SenderStateStore:
+    """Latest slots and active loop per sender_id, bounded with LRU eviction.
+
+    The state is the request tracker with the events returned by the action
+    applied on top. Slots Rasa sets itself after the last action of a turn only
+    show up with the sender's next webhook call.
+    """
+
+    def __init__(self, max_senders: int = 10000) -> None:
+        self.max_senders = max_senders
+        self._senders: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def observe(self, request_data: Dict[str, Any], response_data: Any) -> None:
+        tracker = request_data.get("tracker") or {}
+        sender_id = request_data.get("sender_id") or tracker.get("sender_id")
+        if not sender_id:
+            return
+        slots = dict(tracker.get("slots") or {})
+        active_loop = (tracker.get("active_loop") or {}).get("name")
+        events = response_data.get("events") if isinstance(response_data, dict) else None
+        for event in events or []:
+            kind = event.get("event")
+            if kind == "slot":
+                slots[event.get("name")] = event.get("value")
+            elif kind == "reset_slots":
+                slots = {name: None for name in slots}
+            elif kind == "active_loop":
+                active_loop = event.get("name")
+        self.put(sender_id, {
+            "sender_id": sender_id,
+            "active_loop": active_loop,
+            "slots": slots,
+            "updated": time.time(),
+        })
+
+    def put(self, sender_id: str, state: Dict[str, Any]) -> None:
+        self._senders[sender_id] = state
+        self._senders.move_to_end(sender_id)
+        while len(self._senders) > self.max_senders:
+            self._senders.popitem(last=False)
+
+    def get(self, sender_id: str) -> Optional[Dict[str, Any]]:
+        return self._senders.get(sender_id)
+
+
+class SharedSenderStateStore(SenderStateStore):
+    """SenderStateStore kept in a SQLite file that all workers share.
+
+    A sender's requests can land on any worker, so /state must not depend on
+    which process answers it. `put` only records the state in memory; a
+    writer thread stores what changed every `flush_interval` seconds in one
+    transaction, so the event loop never waits on the database lock. Until
+    then `get` answers from memory on this worker. Writes skip fsync; the
+    state is a cache that the next webhook call rebuilds. Rows beyond
+    `max_senders` are pruned by age every `prune_every` writes.
+    """
+
+    def __init__(
+        self, path: str, max_senders: int = 10000, prune_every: int = 1000, flush_interval: float = 0.05
+    ) -> None:
+        super().__init__(max_senders)
+        self.path = path
+        self.prune_every = prune_every
+        self.flush_interval = flush_interval
+        self._writes = 0
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._db = self._connect()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sender_state (sender_id TEXT PRIMARY KEY, updated REAL, state BLOB)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA synchronous=OFF")
+        return db
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sender-state-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the writer thread after everything pending has been stored."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def put(self, sender_id: str, state: Dict[str, Any]) -> None:
+        with self._lock:
+            self._pending[sender_id] = state
+
+    def get(self, sender_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            state = self._pending.get(sender_id)
+        if state is not None:
+            return state
+        row = self._db.execute("SELECT state FROM sender_state WHERE sender_id = ?", (sender_id,)).fetchone()
+        return loads_json(row[0]) if row else None
+
+    def flush(self, db: Optional[sqlite3.Connection] = None) -> int:
+        """Store the pending states in one transaction; returns how many."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        db = db or self._db
+        db.execute("BEGIN")
+        try:
+            db.executemany(
+                "INSERT OR REPLACE INTO sender_state VALUES (?, ?, ?)",
+                [(sender_id, state["updated"], dumps_json(state)) for sender_id, state in pending.items()],
+            )
+            if (self._writes + len(pending)) // self.prune_every > self._writes // self.prune_every:
+                db.execute(
+                    "DELETE FROM sender_state WHERE sender_id NOT IN "
+                    "(SELECT sender_id FROM sender_state ORDER BY updated DESC LIMIT ?)",
+                    (self.max_senders,),
+                )
+            db.execute("COMMIT")
+        except sqlite3.Error:
+            db.execute("ROLLBACK")
+            with self._lock:
+                # Newer states that arrived meanwhile win over the failed batch.
+                self._pending = dict(pending, **self._pending)
+            raise
+        self._writes += len(pending)
+        return len(pending)
+
+    def _run(self) -> None:
+        db = self._connect()
+        try:
+            stopping = False
+            while not stopping:
+                stopping = self._stop.wait(self.flush_interval)
+                try:
+                    self.flush(db)
+                except sqlite3.Error as e:
+                    logger.error(f"Could not store sender state: {e}")
+        finally:
+            db.close()
+
+
+sender_state: Optional[SenderStateStore] = None
+if SENDER_STATE:
+    if MULTIPROC_DIR:
+        sender_state = SharedSenderStateStore(os.path.join(MULTIPROC_DIR, "sender_state.db"), SENDER_STATE_MAX_SENDERS)
+    else:
+        sender_state = SenderStateStore(SENDER_STATE_MAX_SENDERS)
+
+
+def log_exchange(event: str, data: Any, timer: Optional["RequestTimer"] = None) -> None:
+    """Log a request from Rasa or a response from the action server.
+
+    `data` is either the parsed payload or, in passthrough mode, the raw JSON
+    body, which is only parsed here when the tracker delta log needs fields.
+    Responses are logged with the sender_id and next_action of their request
+    from `timer`, since calls of several senders are in flight at once.
+    """
+    if event == "request" and tracker_delta_log is not None:
+        if isinstance(data, bytes):
+            data = loads_json(data)
+        data = tracker_delta_log.reduce(data)
+    keys = {"sender_id": timer.sender_id, "next_action": timer.next_action} if timer is not None else None
+    if json_log is not None:
+        json_log.submit(event, data, keys)
+        return
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", "replace")
+    if event == "request":
         logger.info("################# request from rasa core #################")
-        logger.info("Incoming request from Rasa: %s", incoming_data)
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{REAL_ACTION_SERVER}/webhook",
-                json=incoming_data,
-                timeout=10.0
+        logger.info("Incoming request from Rasa: %s", data)
+    else:
+        logger.info("################# response from action server #################")
+        if keys is None:
+            logger.info("Outgoing response from action server: %s", data)
+        else:
+            logger.info("Outgoing response from action server for %s: %s", dumps_json(keys).decode(), data)
+
+
+REAL_ACTION_SERVER = os.environ.get("REAL_ACTION_SERVER", "http://localhost:6060")
+# Comma separated list of action servers to balance across.
+ACTION_SERVERS = [url.strip() for url in os.environ.get("ACTION_SERVERS", REAL_ACTION_SERVER).split(",") if url.strip()]
+# "least_outstanding" or "round_robin".
+BACKEND_POLICY = os.environ.get("BACKEND_POLICY", "least_outstanding")
+HEALTH_CHECK_INTERVAL = float(os.environ.get("HEALTH_CHECK_INTERVAL", "5.0"))
+HEALTH_CHECK_TIMEOUT = float(os.environ.get("HEALTH_CHECK_TIMEOUT", "1.0"))
+# A backend's circuit opens after BREAKER_FAILURES consecutive failures and
+# stays open for a cool-off that doubles on every re-trip, up to the maximum.
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", "3"))
+BREAKER_COOLOFF = float(os.environ.get("BREAKER_COOLOFF", "1.0"))
+BREAKER_MAX_COOLOFF = float(os.environ.get("BREAKER_MAX_COOLOFF", "60.0"))
+
+# Upstream connection pool. One client is shared by every webhook call so
+# connections to the action server are kept alive between Rasa actions.
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", "30.0"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "2.0"))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "10.0"))
+# HTTP/2 needs the optional `h2` package and is only negotiated over https.
+UPSTREAM_HTTP2 = os.environ.get("UPSTREAM_HTTP2", "0") == "1"
+
+
+def create_upstream_client() -> httpx.AsyncClient:
+    http2 = UPSTREAM_HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("UPSTREAM_HTTP2 is set but the 'h2' package is missing, using HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+        http2=http2,
+    )
+
+
+class NoBackendAvailable(Exception):
+    pass
+
+
+class Backend:
+    """One action server with its in-flight count, health and circuit breaker."""
+
+    def __init__(self, url: str) -> None:
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.half_open_trial = False
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def state(self) -> str:
+        if self.open_until == 0.0:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half_open"
+
+    def available(self) -> bool:
+        if not self.healthy:
+            return False
+        state = self.state
+        # A half-open circuit lets a single trial request through.
+        return state == "closed" or (state == "half_open" and not self.half_open_trial)
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.half_open_trial = False
+
+    def record_failure(
+        self, failures_to_trip: int, cooloff: float, max_cooloff: float, trial: bool = False, counted: bool = True
+    ) -> None:
+        """Count a failed call; `trial` marks the one call let through a half-open circuit.
+
+        Calls already in flight when the circuit opened fail as well, so only
+        a failure while closed, or of the trial itself, (re)opens it. Retries
+        and hedges of a call are not `counted` towards tripping.
+        """
+        self.failures += 1
+        if not (counted or trial):
+            return
+        self.consecutive_failures += 1
+        if trial or (self.state == "closed" and self.consecutive_failures >= failures_to_trip):
+            # The exponent is capped; past ~2**30 cool-offs are at the maximum anyway.
+            self.open_until = time.monotonic() + min(cooloff * 2 ** min(self.trips, 30), max_cooloff)
+            self.trips += 1
+        if trial:
+            self.half_open_trial = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class BackendPool:
+    """Spread webhook calls over several action servers.
+
+    Picks the available backend with the fewest outstanding requests (or the
+    next one in turn with the `round_robin` policy). Backends that fail their
+    health probe or whose circuit is open are skipped.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        policy: str = "least_outstanding",
+        failures_to_trip: int = 3,
+        cooloff: float = 1.0,
+        max_cooloff: float = 60.0,
+    ) -> None:
+        if not urls:
+            raise ValueError("At least one action server is required")
+        if policy not in ("least_outstanding", "round_robin"):
+            raise ValueError(f"Unknown backend policy: {policy}")
+        self.backends = [Backend(url) for url in urls]
+        self.policy = policy
+        self.failures_to_trip = failures_to_trip
+        self.cooloff = cooloff
+        self.max_cooloff = max_cooloff
+        self._next = 0
+
+    def acquire(self) -> Tuple[Backend, bool]:
+        """Pick a backend; the flag is True when the call is its half-open trial."""
+        candidates = [backend for backend in self.backends if backend.available()]
+        if not candidates:
+            raise NoBackendAvailable("No action server available")
+        if self.policy == "round_robin":
+            backend = candidates[self._next % len(candidates)]
+            self._next += 1
+        else:
+            fewest = min(backend.outstanding for backend in candidates)
+            backend = random.choice([b for b in candidates if b.outstanding == fewest])
+        trial = backend.state == "half_open"
+        if trial:
+            backend.half_open_trial = True
+        backend.outstanding += 1
+        backend.requests += 1
+        return backend, trial
+
+    def release(self, backend: Backend, ok: Optional[bool], trial: bool = False, counted: bool = True) -> None:
+        """Return a backend; `ok=None` (e.g. a cancelled call) counts as neither outcome."""
+        backend.outstanding -= 1
+        if ok is None:
+            if trial:
+                backend.half_open_trial = False
+        elif ok:
+            backend.record_success()
+        else:
+            backend.record_failure(self.failures_to_trip, self.cooloff, self.max_cooloff, trial, counted)
+
+    async def post(self, client: httpx.AsyncClient, path: str, count_failure: bool = True, **kwargs) -> httpx.Response:
+        """POST to the chosen backend, counting transport errors and 5xx as failures.
+
+        With `count_failure=False` (retries and hedges of a call that already
+        counted) a failure does not move the breaker towards tripping.
+        """
+        backend, trial = self.acquire()
+        ok: Optional[bool] = None
+        try:
+            response = await client.post(f"{backend.url}{path}", **kwargs)
+            ok = response.status_code < 500
+            return response
+        except httpx.RequestError:
+            ok = False
+            raise
+        finally:
+            self.release(backend, ok, trial, count_failure)
+
+    async def probe(self, client: httpx.AsyncClient, timeout: float) -> None:
+        async def check(backend: Backend) -> None:
+            try:
+                response = await client.get(f"{backend.url}/health", timeout=timeout)
+                healthy = response.status_code == 200
+            except httpx.HTTPError:
+                healthy = False
+            if healthy != backend.healthy:
+                logger.warning(f"Action server {backend.url} is now {'healthy' if healthy else 'unhealthy'}")
+            backend.healthy = healthy
+
+        await asyncio.gather(*(check(backend) for backend in self.backends))
+
+    async def probe_forever(self, client: httpx.AsyncClient, interval: float, timeout: float) -> None:
+        while True:
+            try:
+                await self.probe(client, timeout)
+            except Exception as e:
+                logger.error(f"Health probe failed: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [backend.stats() for backend in self.backends]
+
+
+backend_pool = BackendPool(
+    ACTION_SERVERS,
+    policy=BACKEND_POLICY,
+    failures_to_trip=BREAKER_FAILURES,
+    cooloff=BREAKER_COOLOFF,
+    max_cooloff=BREAKER_MAX_COOLOFF,
+)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# Remaining budget in milliseconds. Honoured when a caller in front of the
+# middleware sends it, and always sent on to the action server.
+DEADLINE_HEADER = "x-deadline-ms"
+# Statuses worth another attempt of an idempotent action.
+RETRYABLE_STATUSES = frozenset({502, 503, 504})
+
+
+class UpstreamPolicy:
+    """Deadlines, retries and hedging for calls to the action servers.
+
+    Every call gets the deadline budget of its action (`deadlines`, else
+    `default_deadline`), and each attempt only gets what is left of it; an
+    idempotent attempt that can still be retried gets `attempt_share` of
+    that, so a retry fits after it times out. Connection failures (refused,
+    connect or pool timeouts) are retried for every action, since the request
+    never reached a server; read timeouts and 502/503/504 only for
+    `idempotent` actions.
+    With hedging on, an idempotent call that has not answered after the
+    action's recent p`hedge_percentile` latency gets a second request, to the
+    least loaded backend, and the first good answer wins. Hedges are capped at
+    `hedge_max_ratio` of all calls so a slow backend cannot double the load.
+    """
+
+    def __init__(
+        self,
+        default_deadline: float = 10.0,
+        deadlines: Optional[Dict[str, float]] = None,
+        idempotent: Optional[List[str]] = None,
+        retries: int = 2,
+        retry_backoff: float = 0.05,
+        attempt_share: float = 0.5,
+        hedge: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_delay: float = 0.01,
+        hedge_min_samples: int = 50,
+        hedge_max_ratio: float = 0.1,
+        window: int = 200,
+    ) -> None:
+        self.default_deadline = default_deadline
+        self.deadlines = {name: float(value) for name, value in (deadlines or {}).items()}
+        self.idempotent = frozenset(idempotent or [])
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.attempt_share = attempt_share
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_ratio = hedge_max_ratio
+        self.window = window
+        self.calls = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.deadline_exceeded = 0
+        # next_action -> [recent latencies, samples seen]; hedge delays derived from them
+        self._latencies: Dict[str, List[Any]] = {}
+        self._hedge_delays: Dict[str, Tuple[int, float]] = {}
+
+    def deadline_for(self, action: str, header: Optional[str] = None) -> float:
+        budget = self.deadlines.get(action, self.default_deadline)
+        if header:
+            try:
+                budget = min(budget, float(header) / 1000)
+            except ValueError:
+                pass
+        return budget
+
+    def observe(self, action: str, seconds: float) -> None:
+        entry = self._latencies.get(action)
+        if entry is None:
+            entry = self._latencies[action] = [deque(maxlen=self.window), 0]
+        entry[0].append(seconds)
+        entry[1] += 1
+
+    def hedge_delay(self, action: str) -> Optional[float]:
+        """p`hedge_percentile` of the action's recent latencies, None while there are too few."""
+        entry = self._latencies.get(action)
+        if entry is None or len(entry[0]) < self.hedge_min_samples:
+            return None
+        samples, seen = entry
+        cached = self._hedge_delays.get(action)
+        # Re-sorted every window/10 new samples rather than on every call.
+        if cached is None or seen - cached[0] >= max(1, self.window // 10):
+            ordered = sorted(samples)
+            index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))
+            cached = self._hedge_delays[action] = (seen, max(self.hedge_min_delay, ordered[index]))
+        return cached[1]
+
+    async def post(
+        self,
+        pool: "BackendPool",
+        client: httpx.AsyncClient,
+        path: str,
+        action: str,
+        deadline_header: Optional[str] = None,
+        **kwargs,
+    ) -> httpx.Response:
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + self.deadline_for(action, deadline_header)
+        idempotent = action in self.idempotent
+        attempt = 0
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self.deadline_exceeded += 1
+                raise DeadlineExceeded(f"Deadline of {action} exceeded after {attempt} attempt(s)")
+            if idempotent and attempt < self.retries:
+                remaining *= self.attempt_share
+            try:
+                response = await self._attempt(pool, client, path, action, remaining, idempotent, attempt == 0, kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                if attempt >= self.retries:
+                    raise
+                error: Exception = e
+            except httpx.TimeoutException as e:
+                if deadline - loop.time() <= 0:
+                    self.deadline_exceeded += 1
+                    raise DeadlineExceeded(f"Deadline of {action} exceeded: {e!r}") from e
+                if not (idempotent and attempt < self.retries):
+                    raise
+                error = e
+            else:
+                if not (idempotent and response.status_code in RETRYABLE_STATUSES and attempt < self.retries):
+                    if response.status_code < 500:
+                        self.observe(action, loop.time() - started)
+                    return response
+                error = httpx.HTTPStatusError(
+                    f"Action server returned {response.status_code}", request=response.request, response=response
+                )
+            attempt += 1
+            self.retried += 1
+            logger.warning(f"Retrying {action} (attempt {attempt + 1}): {error!r}")
+            await asyncio.sleep(min(self.retry_backoff * 2 ** (attempt - 1), max(0.0, deadline - loop.time())))
+
+    async def _attempt(
+        self,
+        pool: "BackendPool",
+        client: httpx.AsyncClient,
+        path: str,
+        action: str,
+        remaining: float,
+        idempotent: bool,
+        first_attempt: bool,
+        kwargs: Dict[str, Any],
+    ) -> httpx.Response:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + remaining
+
+        def send(count_failure: bool) -> "asyncio.Future[httpx.Response]":
+            budget = deadline - loop.time()
+            headers = dict(kwargs.get("headers") or {}, **{DEADLINE_HEADER: str(int(budget * 1000))})
+            timeout = httpx.Timeout(budget, connect=min(UPSTREAM_CONNECT_TIMEOUT, budget))
+            return asyncio.ensure_future(
+                pool.post(client, path, count_failure, **dict(kwargs, headers=headers, timeout=timeout))
             )
-            response.raise_for_status()
-            response_data = response.json()
-            logger.info("################# response from action server #################")
-            logger.info("Outgoing response from action server: %s", response_data)
-            return response_data
-    except httpx.RequestError as e:
+
+        delay = self.hedge_delay(action) if self.hedge and idempotent else None
+        # One logical call counts once towards the breaker, however many
+        # requests its retries and hedges send.
+        first = send(first_attempt)
+        if delay is None or delay >= remaining or self.hedged >= self.hedge_max_ratio * self.calls:
+            return await first
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+        except asyncio.CancelledError:
+            first.cancel()
+            raise
+        if done:
+            return first.result()
+
+        self.hedged += 1
+        second = send(False)
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result().status_code < 500:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Both failed: report the first request's outcome.
+            return first.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "retries": self.retried,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "deadline_exceeded": self.deadline_exceeded,
+            "hedge_delays_ms": {
+                action: round(delay * 1e3, 3) for action, (_, delay) in self._hedge_delays.items()
+            },
+        }
+
+
+_upstream_config = config.get("upstream") or {}
+_hedge_config = _upstream_config.get("hedge") or {}
+upstream_policy = UpstreamPolicy(
+    default_deadline=float(_upstream_config.get("default_deadline", UPSTREAM_READ_TIMEOUT)),
+    deadlines=_upstream_config.get("deadlines") or {},
+    idempotent=_upstream_config.get("idempotent") or [],
+    retries=int(_upstream_config.get("retries", 2)),
+    retry_backoff=float(_upstream_config.get("retry_backoff", 0.05)),
+    attempt_share=float(_upstream_config.get("attempt_share", 0.5)),
+    hedge=bool(_hedge_config.get("enabled", False)),
+    hedge_percentile=float(_hedge_config.get("percentile", 95)),
+    hedge_min_delay=float(_hedge_config.get("min_delay", 0.01)),
+    hedge_min_samples=int(_hedge_config.get("min_samples", 50)),
+    hedge_max_ratio=float(_hedge_config.get("max_ratio", 0.1)),
+)
+
+
+# With PASSTHROUGH=1 request and response bodies are forwarded as raw bytes
+# and only parsed when logging or the response cache need their fields.
+PASSTHROUGH = os.environ.get("PASSTHROUGH", "0") == "1"
+
+# Headers that describe a single connection or that the server sets itself.
+UNFORWARDED_HEADERS = frozenset({
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te",
+    "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+    "content-encoding", "date", "server",
+})
+
+
+def forwardable_headers(headers) -> Dict[str, str]:
+    return {name: value for name, value in headers.items() if name.lower() not in UNFORWARDED_HEADERS}
+
+
+# Rasa sends next_action and sender_id before the tracker, so the first match
+# in a raw body is the top level field.
+TOP_LEVEL_PATTERNS = {
+    key: re.compile(rb'"' + key.encode() + rb'"\s*:\s*"((?:[^"\\]|\\.)*)"')
+    for key in ("next_action", "sender_id")
+}
+
+
+def top_level_field(payload: Any, key: str) -> str:
+    """Read next_action or sender_id from a parsed payload or a raw JSON body."""
+    if isinstance(payload, bytes):
+        match = TOP_LEVEL_PATTERNS[key].search(payload)
+        return match.group(1).decode("utf-8", "replace") if match else ""
+    return payload.get(key) or ""
+
+
+def sender_id_of(payload: Any) -> str:
+    return top_level_field(payload, "sender_id")
+
+
+# At most MAX_UPSTREAM_CONCURRENCY actions run at once; up to MAX_QUEUE_DEPTH
+# more may wait for a slot before new requests are shed with a 503. Requests
+# of the same sender always run one after another, in arrival order.
+MAX_UPSTREAM_CONCURRENCY = int(os.environ.get("MAX_UPSTREAM_CONCURRENCY", "64"))
+MAX_QUEUE_DEPTH = int(os.environ.get("MAX_QUEUE_DEPTH", "256"))
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionController:
+    """Bound concurrent action calls and serialize them per sender_id."""
+
+    def __init__(self, max_concurrency: int = 64, max_queue: int = 256) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._senders: Dict[str, List] = {}
+
+    @asynccontextmanager
+    async def slot(self, sender_id: str):
+        if self.waiting >= self.max_queue:
+            self.shed += 1
+            raise Overloaded(f"Queue full ({self.waiting} waiting), shedding request from {sender_id!r}")
+        # [lock, users] so the lock can be dropped once nobody holds or waits for it.
+        entry = self._senders.setdefault(sender_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await entry[0].acquire()
+            try:
+                await self._semaphore.acquire()
+            except BaseException:
+                entry[0].release()
+                raise
+        except BaseException:
+            self._leave(sender_id, entry)
+            raise
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - start
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        self.admitted += 1
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            entry[0].release()
+            self._leave(sender_id, entry)
+
+    def _leave(self, sender_id: str, entry: List) -> None:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._senders[sender_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "mean_wait_ms": round(self.total_wait / self.admitted * 1e3, 3) if self.admitted else 0.0,
+            "max_wait_ms": round(self.max_wait * 1e3, 3),
+        }
+
+
+admission = AdmissionController(MAX_UPSTREAM_CONCURRENCY, MAX_QUEUE_DEPTH)
+
+
+def extract_field(data: Any, path: str) -> Any:
+    """Look up a dotted path such as `tracker.slots.source` in a payload."""
+    for part in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+class ResponseCache:
+    """LRU + TTL cache of action server responses for deterministic actions.
+
+    `actions` maps a next_action to the payload fields its response depends
+    on. Actions that are not listed are never cached.
+    """
+
+    def __init__(self, actions: Dict[str, List[str]], max_entries: int = 1024, ttl: float = 300.0) -> None:
+        self.actions = {name: list(fields or []) for name, fields in actions.items()}
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+
+    def key_for(self, incoming_data: Dict[str, Any]) -> Optional[Tuple]:
+        next_action = incoming_data.get("next_action")
+        if next_action not in self.actions:
+            return None
+        values = (
+            json.dumps(extract_field(incoming_data, field), sort_keys=True, default=str)
+            for field in self.actions[next_action]
+        )
+        return (next_action, *values)
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Tuple, value: Any) -> None:
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+        }
+
+
+response_cache: Optional[ResponseCache] = None
+_cache_config = config.get("response_cache") or {}
+if _cache_config.get("enabled"):
+    response_cache = ResponseCache(
+        _cache_config.get("actions") or {},
+        max_entries=int(_cache_config.get("max_entries", 1024)),
+        ttl=float(_cache_config.get("ttl", 300)),
+    )
+
+
+class TrackerSlimmer:
+    """Trim the tracker of a webhook payload to the parts its action reads.
+
+    `actions` maps a next_action to what it needs: `events` (keep only the
+    last N; absent keeps all), `slots` (names to keep; absent keeps all) and
+    `latest_message` (false drops it). The remaining tracker fields are small
+    and always kept. Actions that are not listed get the full tracker.
+    """
+
+    def __init__(self, actions: Dict[str, Dict[str, Any]]) -> None:
+        self.actions = {name: dict(spec or {}) for name, spec in actions.items()}
+        self.slimmed = 0
+        self.events_dropped = 0
+
+    def handles(self, action_name: Optional[str]) -> bool:
+        return action_name in self.actions
+
+    def slim(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        spec = self.actions.get(payload.get("next_action"))
+        tracker = payload.get("tracker")
+        if spec is None or not isinstance(tracker, dict):
+            return payload
+        tracker = dict(tracker)
+        events = tracker.get("events")
+        keep = spec.get("events")
+        if keep is not None and isinstance(events, list) and len(events) > keep:
+            tracker["events"] = events[len(events) - int(keep):]
+            self.events_dropped += len(events) - len(tracker["events"])
+        if spec.get("slots") is not None and isinstance(tracker.get("slots"), dict):
+            wanted = spec["slots"]
+            tracker["slots"] = {name: value for name, value in tracker["slots"].items() if name in wanted}
+        if spec.get("latest_message") is False:
+            tracker["latest_message"] = {}
+        self.slimmed += 1
+        return dict(payload, tracker=tracker)
+
+    def stats(self) -> Dict[str, int]:
+        return {"slimmed": self.slimmed, "events_dropped": self.events_dropped}
+
+
+tracker_slimmer: Optional[TrackerSlimmer] = None
+_manifest_config = config.get("tracker_manifest") or {}
+if _manifest_config.get("enabled"):
+    tracker_slimmer = TrackerSlimmer(_manifest_config.get("actions") or {})
+
+
+# With IN_PROCESS_ACTIONS=1 the middleware imports ACTIONS_PACKAGE and runs
+# its actions through the rasa_sdk executor itself. Actions it cannot load are
+# still sent to the action servers.
+IN_PROCESS_ACTIONS = os.environ.get("IN_PROCESS_ACTIONS", "0") == "1"
+ACTIONS_PACKAGE = os.environ.get("ACTIONS_PACKAGE", "actions")
+
+
+class InProcessActions:
+    """Execute webhook payloads with a local rasa_sdk ActionExecutor.
+
+    `run` mirrors the action server's /webhook endpoint and returns the status
+    code and body it would have answered with.
+    """
+
+    def __init__(self, package: str) -> None:
+        from rasa_sdk.executor import ActionExecutor
+
+        self.executor = ActionExecutor()
+        self.executor.register_package(package)
+
+    def handles(self, action_name: Optional[str]) -> bool:
+        return action_name in self.executor.actions
+
+    async def run(self, action_call: Dict[str, Any]) -> Tuple[int, Any]:
+        from rasa_sdk.interfaces import ActionExecutionRejection, ActionNotFoundException
+
+        try:
+            result = await self.executor.run(action_call)
+        except ActionExecutionRejection as e:
+            return 400, {"error": e.message, "action_name": e.action_name}
+        except ActionNotFoundException as e:
+            return 404, {"error": e.message, "action_name": e.action_name}
+        if hasattr(result, "model_dump"):
+            # rasa_sdk >= 3.8 wraps the response in a pydantic model.
+            result = result.model_dump()
+        return 200, result
+
+
+in_process_actions: Optional[InProcessActions] = None
+
+
+def load_in_process_actions() -> Optional[InProcessActions]:
+    try:
+        actions = InProcessActions(ACTIONS_PACKAGE)
+    except Exception as e:
+        logger.warning(f"Could not load '{ACTIONS_PACKAGE}' in-process, using {', '.join(ACTION_SERVERS)}: {e}")
+        return None
+    # The action server logs the actions' own lines (the trace spans of
+    # actions.tracing among them); in-process they go to the middleware's log.
+    actions_logger = logging.getLogger(ACTIONS_PACKAGE)
+    if actions_logger.level == logging.NOTSET or actions_logger.level > logging.INFO:
+        actions_logger.setLevel(logging.INFO)
+    for handler in logger.handlers:
+        if handler not in actions_logger.handlers:
+            actions_logger.addHandler(handler)
+    actions_logger.propagate = False
+    logger.info(f"Running actions in-process: {sorted(actions.executor.actions)}")
+    return actions
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 32768, 65536, 131072, 262144, 1048576)
+# Distinct next_action values tracked before new ones are folded into "other".
+MAX_ACTION_LABELS = 200
+# With MULTIPROC_DIR each worker publishes its metrics every
+# METRICS_SYNC_INTERVAL seconds; gauges of workers silent for longer than
+# METRICS_STALE_AFTER are left out of /metrics.
+METRICS_SYNC_INTERVAL = float(os.environ.get("METRICS_SYNC_INTERVAL", "1.0"))
+METRICS_STALE_AFTER = float(os.environ.get("METRICS_STALE_AFTER", "10.0"))
+# Counters of exited workers are folded into this one snapshot, so the
+# directory does not grow with every worker restart.
+EXITED_METRICS = "metrics-exited.json"
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def snapshot(self) -> List[Any]:
+        return [[list(label_values), value] for label_values, value in self._values.items()]
+
+    def merge(self, snapshot: List[Any]) -> None:
+        for label_values, value in snapshot:
+            self.inc(*label_values, amount=value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram; `observe` is a bisect and three increments."""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...], labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def snapshot(self) -> List[Any]:
+        return [[list(label_values), counts, total, count] for label_values, (counts, total, count) in self._series.items()]
+
+    def merge(self, snapshot: List[Any]) -> None:
+        for label_values, counts, total, count in snapshot:
+            series = self._series.get(tuple(label_values))
+            if series is None:
+                series = self._series[tuple(label_values)] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
+            series[2] += count
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else repr(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, le)} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# TRACING=1 gives every webhook call a trace ID (the caller's x-trace-id when it
+# sends a valid one), returned in the response, sent on to the action server as
+# a header and in tracker.latest_message.metadata where actions can read it,
+# and logs one line per call with the start offset and duration of each phase.
+TRACING = os.environ.get("TRACING", "0") == "1"
+TRACE_HEADER = "x-trace-id"
+TRACE_ID_PATTERN = re.compile(r"^[0-9A-Za-z_.-]{1,64}$")
+
+
+def trace_id_for(headers) -> str:
+    incoming = headers.get(TRACE_HEADER)
+    if incoming and TRACE_ID_PATTERN.match(incoming):
+        return incoming
+    return os.urandom(8).hex()
+
+
+def with_trace_id(payload: Dict[str, Any], trace_id: str) -> Dict[str, Any]:
+    """Copy of a webhook payload with the trace ID in tracker.latest_message.metadata."""
+    tracker = dict(payload.get("tracker") or {})
+    latest_message = dict(tracker.get("latest_message") or {})
+    latest_message["metadata"] = dict(latest_message.get("metadata") or {}, trace_id=trace_id)
+    tracker["latest_message"] = latest_message
+    return dict(payload, tracker=tracker)
+
+
+class RequestTimer:
+    """Phase timings and outcome of one webhook call, recorded when it ends."""
+
+    def __init__(self, trace_id: str = "") -> None:
+        self.started = time.perf_counter()
+        self.trace_id = trace_id
+        # (phase, start offset, duration) in call order, kept only when tracing.
+        self.spans: List[Tuple[str, float, float]] = []
+        self.next_action = ""
+        self.sender_id = ""
+        self.status = 200
+        self.error: Optional[str] = None
+        self.request_bytes: Optional[int] = None
+        self.response_bytes: Optional[int] = None
+        self.phases: Dict[str, float] = {}
+        # Request/response payloads (raw bytes or parsed) kept for the capture log.
+        self.request_payload: Any = None
+        self.response_payload: Any = None
+
+    def capture(self) -> Dict[str, Any]:
+        return {
+            "sender_id": self.sender_id,
+            "next_action": self.next_action,
+            "status": self.status,
+            "duration_ms": round((time.perf_counter() - self.started) * 1e3, 3),
+            "request": self.request_payload,
+            "response": self.response_payload,
+        }
+
+    def add(self, phase: str, started: float) -> None:
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - started
+        if self.trace_id:
+            self.spans.append((phase, started - self.started, now - started))
+
+    def trace(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "sender_id": sender_id_of(self.request_payload) if self.request_payload is not None else "",
+            "next_action": self.next_action,
+            "status": self.status,
+            "error": self.error,
+            "duration_ms": round((time.perf_counter() - self.started) * 1e3, 3),
+            "spans": [[phase, round(offset * 1e3, 3), round(duration * 1e3, 3)] for phase, offset, duration in self.spans],
+        }
+
+
+def log_trace(timer: RequestTimer) -> None:
+    record = timer.trace()
+    if json_log is not None:
+        json_log.submit("trace", record)
+        return
+    spans = " ".join(f"{phase}@{offset:.2f}+{duration:.2f}ms" for phase, offset, duration in record["spans"])
+    logger.info(
+        f"Trace {record['trace_id']} {record['next_action'] or 'unknown'} sender={record['sender_id']} "
+        f"status={record['status']} total={record['duration_ms']:.2f}ms {spans}".rstrip()
+    )
+
+
+def _worker_alive(worker_id: str) -> bool:
+    if not worker_id.isdigit():
+        return True
+    try:
+        os.kill(int(worker_id), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class Metrics:
+    """Process-wide webhook metrics rendered in Prometheus text format."""
+
+    def __init__(self) -> None:
+        self.in_flight = 0
+        self._actions: set = set()
+        self.requests = Counter(
+            "middleware_requests_total", "Webhook calls by next_action and status.", ("next_action", "status")
+        )
+        self.errors = Counter("middleware_upstream_errors_total", "Failed webhook calls by error type.", ("type",))
+        self.latency = Histogram(
+            "middleware_phase_seconds",
+            "Time spent per webhook phase (body_read, slimming, tracing, queue, upstream, logging, total).",
+            LATENCY_BUCKETS,
+            ("next_action", "phase"),
+        )
+        self.request_size = Histogram(
+            "middleware_request_bytes", "Webhook request body size.", SIZE_BUCKETS, ("next_action",)
+        )
+        self.response_size = Histogram(
+            "middleware_response_bytes", "Webhook response body size.", SIZE_BUCKETS, ("next_action",)
+        )
+
+    def action_label(self, next_action: str) -> str:
+        if next_action in self._actions:
+            return next_action
+        if len(self._actions) >= MAX_ACTION_LABELS:
+            return "other"
+        self._actions.add(next_action)
+        return next_action
+
+    def record(self, timer: RequestTimer) -> None:
+        action = self.action_label(timer.next_action or "unknown")
+        self.requests.inc(action, str(timer.status))
+        if timer.error is not None:
+            self.errors.inc(timer.error)
+        for phase, seconds in timer.phases.items():
+            self.latency.observe(seconds, action, phase)
+        self.latency.observe(time.perf_counter() - timer.started, action, "total")
+        if timer.request_bytes is not None:
+            self.request_size.observe(timer.request_bytes, action)
+        if timer.response_bytes is not None:
+            self.response_size.observe(timer.response_bytes, action)
+
+    def families(self) -> Tuple[Any, ...]:
+        return (self.requests, self.errors, self.latency, self.request_size, self.response_size)
+
+    def scalars(self) -> List[Tuple[str, str, str, Dict[str, float]]]:
+        """Gauges and counters owned by other components: (name, type, help, {labels: value})."""
+        scalars = [
+            ("middleware_requests_in_flight", "gauge", "Webhook calls being handled.", {"": self.in_flight}),
+            ("middleware_actions_in_flight", "gauge", "Action calls holding an admission slot.",
+             {"": admission.in_flight}),
+            ("middleware_admission_queue_depth", "gauge", "Action calls waiting for an admission slot.",
+             {"": admission.waiting}),
+            ("middleware_admission_shed_total", "counter", "Webhook calls shed because the queue was full.",
+             {"": admission.shed}),
+            ("middleware_backend_outstanding", "gauge", "Outstanding requests per action server.",
+             {f'{{backend="{backend.url}"}}': backend.outstanding for backend in backend_pool.backends}),
+            ("middleware_backend_up", "gauge", "Whether an action server is healthy with a closed circuit.",
+             {f'{{backend="{backend.url}"}}': int(backend.healthy and backend.state == "closed")
+              for backend in backend_pool.backends}),
+        ]
+        scalars.append(("middleware_upstream_events_total", "counter",
+                        "Retries, hedged requests, hedge wins and calls that ran out of deadline.",
+                        {'{kind="retry"}': upstream_policy.retried, '{kind="hedge"}': upstream_policy.hedged,
+                         '{kind="hedge_win"}': upstream_policy.hedge_wins,
+                         '{kind="deadline_exceeded"}': upstream_policy.deadline_exceeded}))
+        if tracker_slimmer is not None:
+            scalars.append(("middleware_tracker_events_dropped_total", "counter",
+                            "Tracker events left out of forwarded payloads by the tracker manifest.",
+                            {"": tracker_slimmer.events_dropped}))
+        if response_cache is not None:
+            scalars.append(("middleware_response_cache_lookups_total", "counter", "Response cache lookups by result.",
+                            {'{result="hit"}': response_cache.hits, '{result="miss"}': response_cache.misses}))
+        if json_log is not None:
+            scalars.append(("middleware_log_records_dropped_total", "counter", "Log records dropped or sampled out.",
+                            {'{reason="queue_full"}': json_log.dropped,
+                             '{reason="sampled_out"}': json_log.sampled_out}))
+        return scalars
+
+    def render(self) -> str:
+        if MULTIPROC_DIR:
+            families, scalars = self.aggregate(MULTIPROC_DIR)
+        else:
+            families, scalars = self.families(), self.scalars()
+        lines: List[str] = []
+        for metric in families:
+            lines.extend(metric.render())
+        for name, kind, help_text, values in scalars:
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+            lines.extend(f"{name}{labels} {value}" for labels, value in values.items())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self, final: bool = False) -> Dict[str, Any]:
+        """Everything `render` needs, as JSON; a final snapshot keeps only the counters."""
+        return {
+            "families": {metric.name: metric.snapshot() for metric in self.families()},
+            "scalars": [scalar for scalar in self.scalars() if not (final and scalar[1] == "gauge")],
+        }
+
+    def write_snapshot(self, directory: str, final: bool = False) -> None:
+        path = os.path.join(directory, f"metrics-{WORKER_ID}.json")
+        with open(path + ".tmp", "wb") as fh:
+            fh.write(dumps_json(self.snapshot(final)))
+        os.replace(path + ".tmp", path)
+
+    def retire(self, directory: str) -> None:
+        """Fold this worker's counters into EXITED_METRICS as it shuts down."""
+        if fcntl is None:
+            self.write_snapshot(directory, final=True)
+            return
+        with self._locked(directory):
+            self._fold(directory, [self.snapshot(final=True)])
+            try:
+                os.unlink(os.path.join(directory, f"metrics-{WORKER_ID}.json"))
+            except FileNotFoundError:
+                pass
+
+    def aggregate(self, directory: str) -> Tuple[Tuple[Any, ...], List[Tuple[str, str, str, Dict[str, float]]]]:
+        """Sum the snapshots of every worker, this one included.
+
+        Counters of exited workers stay in the totals so they never go
+        backwards; snapshots left behind by workers that died without
+        retiring are folded into EXITED_METRICS here. Gauges come only from
+        snapshots younger than METRICS_STALE_AFTER; backend_up takes the
+        maximum instead of the sum.
+        """
+        self.write_snapshot(directory)
+        now = time.time()
+        snapshots: List[Tuple[Dict[str, Any], bool]] = []
+        dead: List[Tuple[str, Dict[str, Any]]] = []
+        with self._locked(directory):
+            for entry in os.scandir(directory):
+                if not (entry.name.startswith("metrics-") and entry.name.endswith(".json")):
+                    continue
+                try:
+                    with open(entry.path, "rb") as fh:
+                        snapshot = loads_json(fh.read())
+                    fresh = now - entry.stat().st_mtime <= METRICS_STALE_AFTER
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Skipping metrics snapshot {entry.name}: {e}")
+                    continue
+                if fcntl is not None and not fresh and not _worker_alive(entry.name[len("metrics-"):-len(".json")]):
+                    dead.append((entry.path, snapshot))
+                else:
+                    snapshots.append((snapshot, fresh))
+            if dead:
+                # The fold rewrites EXITED_METRICS, already read above.
+                snapshots = [(snapshot, fresh) for snapshot, fresh in snapshots if "exited" not in snapshot]
+                snapshots.append((self._fold(directory, [snapshot for _, snapshot in dead]), False))
+                for path, _ in dead:
+                    os.unlink(path)
+        families, scalars = self._merge(snapshots)
+        return families, [(name, kind, help_text, values) for name, (kind, help_text, values) in scalars.items()]
+
+    @staticmethod
+    def _merge(snapshots: List[Tuple[Dict[str, Any], bool]]) -> Tuple[Tuple[Any, ...], Dict[str, Tuple[str, str, Dict[str, float]]]]:
+        merged = Metrics()
+        families = {metric.name: metric for metric in merged.families()}
+        scalars: Dict[str, Tuple[str, str, Dict[str, float]]] = {}
+        for snapshot, fresh in snapshots:
+            for name, values in snapshot["families"].items():
+                if name in families:
+                    families[name].merge(values)
+            for name, kind, help_text, values in snapshot["scalars"]:
+                if kind == "gauge" and not fresh:
+                    continue
+                merged_values = scalars.setdefault(name, (kind, help_text, {}))[2]
+                for labels, value in values.items():
+                    if name == "middleware_backend_up":
+                        merged_values[labels] = max(merged_values.get(labels, 0), value)
+                    else:
+                        merged_values[labels] = merged_values.get(labels, 0) + value
+        return merged.families(), scalars
+
+    def _fold(self, directory: str, snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Add the counters of `snapshots` to EXITED_METRICS; the caller holds the lock."""
+        path = os.path.join(directory, EXITED_METRICS)
+        try:
+            with open(path, "rb") as fh:
+                snapshots = [loads_json(fh.read())] + snapshots
+        except FileNotFoundError:
+            pass
+        families, scalars = self._merge([(snapshot, False) for snapshot in snapshots])
+        exited = {
+            "exited": True,
+            "families": {metric.name: metric.snapshot() for metric in families},
+            "scalars": [[name, kind, help_text, values] for name, (kind, help_text, values) in scalars.items()],
+        }
+        with open(path + ".tmp", "wb") as fh:
+            fh.write(dumps_json(exited))
+        os.replace(path + ".tmp", path)
+        return exited
+
+    @staticmethod
+    @contextmanager
+    def _locked(directory: str):
+        """Serialize folding and reading of the snapshots across workers."""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(directory, "metrics.lock"), "ab") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    async def sync_forever(self, directory: str, interval: float) -> None:
+        """Publish this worker's snapshot so /metrics on any worker sees it."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.write_snapshot(directory)
+            except OSError as e:
+                logger.error(f"Could not write metrics snapshot: {e}")
+
+
+metrics = Metrics()
+
+
+# /admin endpoints are only served when ADMIN_TOKEN is set, to callers sending
+# it in the x-admin-token header.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Seconds of CPU time between profiler samples.
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+
+
+class SamplingProfiler:
+    """Statistical CPU profiler of the event loop thread, armed on demand.
+
+    While armed, SIGPROF fires every `interval` seconds of process CPU time
+    and the handler counts the interrupted Python stack, a few microseconds
+    per sample, so it can run in production. It stops by itself after a
+    number of webhook calls or at the end of a time window. Needs setitimer
+    (Unix); in multi-worker mode each worker profiles only itself.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL, max_stacks: int = 5000) -> None:
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.running = False
+        self.stacks: Dict[Tuple[str, ...], int] = {}
+        self.samples = 0
+        self.dropped = 0
+        self.requests = 0
+        self.request_limit = 0
+        self.deadline: Optional[float] = None
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+
+    @staticmethod
+    def supported() -> bool:
+        return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+    def start(self, requests: int = 0, seconds: float = 0.0) -> None:
+        """Profile the next `requests` webhook calls or the next `seconds`, whichever ends first."""
+        self.stop()
+        self.stacks = {}
+        self.samples = self.dropped = self.requests = 0
+        self.request_limit = requests
+        self.deadline = time.monotonic() + seconds if seconds > 0 else None
+        self.started_at, self.stopped_at = time.time(), None
+        self.running = True
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        self.running = False
+        self.stopped_at = time.time()
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def _sample(self, signum: int, frame: Any) -> None:
+        if self.expired():
+            self.stop()
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        key = tuple(reversed(stack))
+        self.samples += 1
+        if key in self.stacks:
+            self.stacks[key] += 1
+        elif len(self.stacks) < self.max_stacks:
+            self.stacks[key] = 1
+        else:
+            self.dropped += 1
+
+    def request_finished(self) -> None:
+        self.requests += 1
+        if (self.request_limit and self.requests >= self.request_limit) or self.expired():
+            self.stop()
+
+    def report(self, limit: int = 30) -> Dict[str, Any]:
+        """Functions by samples spent in them (self) and under them (total), plus folded stacks for flame graphs."""
+        if self.running and self.expired():
+            self.stop()
+        # A sample can land while this runs, so work on a copy.
+        stacks = dict(self.stacks)
+        own: Dict[str, int] = {}
+        total: Dict[str, int] = {}
+        for stack, count in stacks.items():
+            own[stack[-1]] = own.get(stack[-1], 0) + count
+            for function in set(stack):
+                total[function] = total.get(function, 0) + count
+        samples = sum(stacks.values()) or 1
+        top = sorted(total, key=lambda function: (own.get(function, 0), total[function]), reverse=True)[:limit]
+        return {
+            "worker": WORKER_ID,
+            "running": self.running,
+            "interval": self.interval,
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+            "requests": self.requests,
+            "samples": self.samples,
+            "dropped_samples": self.dropped,
+            "functions": [
+                {
+                    "function": function,
+                    "self": own.get(function, 0),
+                    "total": total[function],
+                    "self_pct": round(100.0 * own.get(function, 0) / samples, 2),
+                    "total_pct": round(100.0 * total[function] / samples, 2),
+                }
+                for function in top
+            ],
+            "folded": [
+                f"{';'.join(stack)} {count}"
+                for stack, count in sorted(stacks.items(), key=lambda item: item[1], reverse=True)
+            ],
+        }
+
+
+profiler = SamplingProfiler()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global in_process_actions
+    app.state.upstream = create_upstream_client()
+    if IN_PROCESS_ACTIONS:
+        in_process_actions = load_in_process_actions()
+    health_probe = None
+    if HEALTH_CHECK_INTERVAL > 0:
+        health_probe = asyncio.create_task(
+            backend_pool.probe_forever(app.state.upstream, HEALTH_CHECK_INTERVAL, HEALTH_CHECK_TIMEOUT)
+        )
+    metrics_sync = None
+    if MULTIPROC_DIR:
+        metrics_sync = asyncio.create_task(metrics.sync_forever(MULTIPROC_DIR, METRICS_SYNC_INTERVAL))
+    for writer in (json_log, capture_log):
+        if writer is not None:
+            writer.start()
+    if isinstance(sender_state, SharedSenderStateStore):
+        sender_state.start()
+    try:
+        yield
+    finally:
+        if health_probe is not None:
+            health_probe.cancel()
+        if metrics_sync is not None:
+            metrics_sync.cancel()
+            metrics.retire(MULTIPROC_DIR)
+        await app.state.upstream.aclose()
+        for writer in (json_log, capture_log):
+            if writer is not None:
+                writer.stop()
+        if isinstance(sender_state, SharedSenderStateStore):
+            sender_state.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+@app.post("/webhook")
+async def action_webhook(request: Request, response: Response):
+    timer = RequestTimer(trace_id_for(request.headers) if TRACING else "")
+    metrics.in_flight += 1
+    try:
+        if PASSTHROUGH:
+            result = await passthrough_webhook(request, timer)
+        else:
+            result = await parsed_webhook(request, timer)
+        if timer.trace_id:
+            (result if isinstance(result, Response) else response).headers[TRACE_HEADER] = timer.trace_id
+        return result
+    except HTTPException as e:
+        timer.status = e.status_code
+        if timer.trace_id:
+            e.headers = dict(e.headers or {}, **{TRACE_HEADER: timer.trace_id})
+        raise
+    finally:
+        metrics.in_flight -= 1
+        metrics.record(timer)
+        if timer.trace_id:
+            log_trace(timer)
+        if profiler.running:
+            profiler.request_finished()
+        if capture_log is not None and timer.request_payload is not None:
+            capture_log.submit("exchange", timer.capture())
+        if sender_state is not None and 200 <= timer.status < 300 and timer.response_payload is not None:
+            observe_sender_state(timer)
+
+def observe_sender_state(timer: RequestTimer) -> None:
+    try:
+        request_data, response_data = timer.request_payload, timer.response_payload
+        if isinstance(request_data, bytes):
+            request_data = loads_json(request_data)
+        if isinstance(response_data, bytes):
+            response_data = loads_json(response_data)
+        sender_state.observe(request_data, response_data)
+    except Exception as e:
+        logger.error(f"Could not record sender state: {e}")
+
+def forwarded_payload(payload: Dict[str, Any], timer: RequestTimer) -> Dict[str, Any]:
+    """The payload as the actions get it: trimmed to the tracker manifest and tagged with the trace ID."""
+    if tracker_slimmer is not None:
+        payload = tracker_slimmer.slim(payload)
+    if timer.trace_id:
+        payload = with_trace_id(payload, timer.trace_id)
+    return payload
+
+def webhook_error(e: Exception, timer: RequestTimer) -> HTTPException:
+    """Log and count a failed webhook call and map it to the error Rasa sees."""
+    if isinstance(e, Overloaded):
+        logger.warning(str(e))
+        timer.error = "overloaded"
+        return HTTPException(503, "Middleware overloaded")
+    if isinstance(e, NoBackendAvailable):
+        logger.error(str(e))
+        timer.error = "no_backend"
+        return HTTPException(503, "No action server available")
+    if isinstance(e, DeadlineExceeded):
+        logger.error(str(e))
+        timer.error = "deadline"
+        return HTTPException(504, "Action server deadline exceeded")
+    if isinstance(e, httpx.RequestError):
         logger.error(f"Connection error: {e}")
-        raise HTTPException(500, "Failed to reach action server")
+        timer.error = type(e).__name__
+        return HTTPException(500, "Failed to reach action server")
+    logger.error(f"Unexpected error: {e}")
+    if isinstance(e, httpx.HTTPStatusError):
+        timer.error = f"http_{e.response.status_code}"
+    else:
+        timer.error = "internal"
+    return HTTPException(500, "Internal server error")
+
+async def parsed_webhook(request: Request, timer: RequestTimer):
+    try:
+        started = time.perf_counter()
+        body = await request.body()
+        incoming_data = loads_json(body)
+        timer.add("body_read", started)
+        timer.request_bytes = len(body)
+        timer.request_payload = body
+        timer.next_action = incoming_data.get("next_action") or ""
+        timer.sender_id = incoming_data.get("sender_id") or ""
+
+        started = time.perf_counter()
+        log_exchange("request", incoming_data)
+        timer.add("logging", started)
+
+        cache_key = response_cache.key_for(incoming_data) if response_cache is not None else None
+        if cache_key is not None:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                started = time.perf_counter()
+                log_exchange("response", cached, timer)
+                timer.add("logging", started)
+                timer.response_payload = cached
+                return cached
+
+        forward_data = forwarded_payload(incoming_data, timer)
+        started = time.perf_counter()
+        async with admission.slot(timer.sender_id):
+            timer.add("queue", started)
+            started = time.perf_counter()
+            # Rejections (400) and unknown actions (404) reach Rasa with the
+            # status and body the action server answered, as in passthrough mode.
+            error_response: Optional[Response] = None
+            if in_process_actions is not None and in_process_actions.handles(incoming_data.get("next_action")):
+                status_code, response_data = await in_process_actions.run(forward_data)
+                if status_code != 200:
+                    error_response = JSONResponse(response_data, status_code=status_code)
+            else:
+                client: httpx.AsyncClient = request.app.state.upstream
+                response = await upstream_policy.post(
+                    backend_pool, client, "/webhook", timer.next_action,
+                    request.headers.get(DEADLINE_HEADER), json=forward_data,
+                    headers={TRACE_HEADER: timer.trace_id} if timer.trace_id else None,
+                )
+                timer.response_bytes = len(response.content)
+                if response.is_success:
+                    response_data = response.json()
+                else:
+                    error_response = Response(
+                        response.content, status_code=response.status_code, headers=forwardable_headers(response.headers)
+                    )
+            timer.add("upstream", started)
+        if error_response is not None:
+            logger.error(f"Action server returned {error_response.status_code}: {error_response.body[:200]!r}")
+            timer.status = error_response.status_code
+            timer.error = f"http_{error_response.status_code}"
+            return error_response
+        timer.response_payload = response_data
+        started = time.perf_counter()
+        log_exchange("response", response_data, timer)
+        timer.add("logging", started)
+        if cache_key is not None:
+            # Only successful responses get here, errors are never cached.
+            response_cache.put(cache_key, response_data)
+        return response_data
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        raise HTTPException(500, "Internal server error")
+        raise webhook_error(e, timer)
+
+async def passthrough_webhook(request: Request, timer: RequestTimer) -> Response:
+    """Forward the raw webhook body and relay the raw upstream response.
+
+    Status codes and headers from the action server are kept, so Rasa sees
+    rejections such as 400s exactly as the action server sent them.
+    """
+    try:
+        started = time.perf_counter()
+        body = await request.body()
+        payload: Any = body
+        cache_key = None
+        if response_cache is not None or in_process_actions is not None:
+            payload = loads_json(body)
+        timer.add("body_read", started)
+        timer.request_bytes = len(body)
+        timer.request_payload = body
+        timer.next_action = top_level_field(payload, "next_action")
+        timer.sender_id = sender_id_of(payload)
+        if response_cache is not None:
+            cache_key = response_cache.key_for(payload)
+        started = time.perf_counter()
+        log_exchange("request", payload)
+        timer.add("logging", started)
+
+        if cache_key is not None:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                started = time.perf_counter()
+                log_exchange("response", cached, timer)
+                timer.add("logging", started)
+                timer.response_bytes = len(cached)
+                timer.response_payload = cached
+                return Response(cached, media_type="application/json")
+
+        forward_body = body
+        forwarded = payload
+        slim = tracker_slimmer is not None and tracker_slimmer.handles(timer.next_action)
+        if slim or timer.trace_id:
+            # Only actions in the manifest, and traced calls, pay for a parse and re-encode.
+            started = time.perf_counter()
+            if isinstance(payload, bytes):
+                payload = loads_json(body)
+            forwarded = forwarded_payload(payload, timer)
+            forward_body = dumps_json(forwarded)
+            timer.add("slimming" if slim else "tracing", started)
+        started = time.perf_counter()
+        async with admission.slot(timer.sender_id):
+            timer.add("queue", started)
+            started = time.perf_counter()
+            if in_process_actions is not None and in_process_actions.handles(payload.get("next_action")):
+                status_code, result = await in_process_actions.run(forwarded)
+                content = dumps_json(result)
+                headers = {"content-type": "application/json"}
+            else:
+                client: httpx.AsyncClient = request.app.state.upstream
+                upstream_headers = forwardable_headers(request.headers)
+                if timer.trace_id:
+                    upstream_headers[TRACE_HEADER] = timer.trace_id
+                response = await upstream_policy.post(
+                    backend_pool,
+                    client,
+                    "/webhook",
+                    timer.next_action,
+                    request.headers.get(DEADLINE_HEADER),
+                    content=forward_body,
+                    headers=upstream_headers,
+                )
+                status_code, content = response.status_code, response.content
+                headers = forwardable_headers(response.headers)
+            timer.add("upstream", started)
+        timer.status = status_code
+        timer.response_bytes = len(content)
+        timer.response_payload = content
+        if 200 <= status_code < 300:
+            started = time.perf_counter()
+            log_exchange("response", content, timer)
+            timer.add("logging", started)
+            if cache_key is not None:
+                response_cache.put(cache_key, content)
+        else:
+            logger.error(f"Action server returned {status_code}: {content[:200]!r}")
+            timer.error = f"http_{status_code}"
+        return Response(content, status_code=status_code, headers=headers)
+    except Exception as e:
+        raise webhook_error(e, timer)
+
+@app.get("/state/{sender_id}")
+async def get_sender_state(sender_id: str):
+    if sender_state is None:
+        raise HTTPException(404, "Sender state tracking is disabled (set SENDER_STATE=1)")
+    state = sender_state.get(sender_id)
+    if state is None:
+        raise HTTPException(404, f"No state for sender {sender_id!r}")
+    return state
+
+def check_admin(request: Request) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(404, "Admin endpoints are disabled (set ADMIN_TOKEN)")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(403, "Invalid admin token")
+
+def check_profiler(request: Request) -> None:
+    check_admin(request)
+    # Each worker has its own profiler and the request reaches only one of them.
+    if MULTIPROC_DIR:
+        raise HTTPException(409, "Profiling needs a single worker (run without --workers)")
+
+@app.post("/admin/profile")
+async def start_profile(request: Request, requests: int = 0, seconds: float = 0.0):
+    """Profile the next `requests` webhook calls or `seconds` seconds, replacing any previous profile."""
+    check_profiler(request)
+    if requests <= 0 and seconds <= 0:
+        raise HTTPException(400, "Give requests=N or seconds=S")
+    if not profiler.supported():
+        raise HTTPException(501, "Profiling needs setitimer (Unix)")
+    profiler.start(requests, seconds)
+    return {"worker": WORKER_ID, "running": True, "requests": requests, "seconds": seconds}
+
+@app.get("/admin/profile")
+async def get_profile(request: Request, limit: int = 30):
+    check_profiler(request)
+    return profiler.report(limit)
+
+@app.delete("/admin/profile")
+async def stop_profile(request: Request):
+    check_profiler(request)
+    profiler.stop()
+    return profiler.report()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 async def health():
-    return {"status": "ok"}
+    status: Dict[str, Any] = {
+        "status": "ok",
+        "worker": WORKER_ID,
+        "backends": backend_pool.stats(),
+        "admission": admission.stats(),
+        "upstream": upstream_policy.stats(),
+    }
+    if tracker_slimmer is not None:
+        status["tracker_manifest"] = tracker_slimmer.stats()
+    if json_log is not None:
+        status["log_queue"] = json_log.stats()
+    if response_cache is not None:
+        status["response_cache"] = response_cache.stats()
+    return status
+
+def serve(host: str, port: int, workers: int, loop: str = "auto", http: str = "auto") -> None:
+    """Run the middleware, with `workers` processes behind one listening socket.
+
+    uvicorn picks uvloop and httptools for "auto" when they are installed. In
+    multi-worker mode SIGHUP to the parent restarts the workers one at a time
+    (graceful reload) and SIGTTIN/SIGTTOU add or remove a worker.
+    """
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port, loop=loop, http=http)
+        return
+    if not os.environ.get("MULTIPROC_DIR"):
+        os.environ["MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="middleware-")
+    shared_dir = os.environ["MULTIPROC_DIR"]
+    for entry in os.scandir(shared_dir):
+        # Counters of a previous run must not leak into this one.
+        if entry.name.startswith("metrics-"):
+            os.unlink(entry.path)
+    logger.info(f"Starting {workers} workers sharing {shared_dir}")
+    # Workers re-import this module, so the app is passed by name.
+    uvicorn.run(
+        "middleware:app",
+        host=host,
+        port=port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+    )
+
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=5055)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Rasa action server middleware.")
+    parser.add_argument("--host", default=os.environ.get("MIDDLEWARE_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("MIDDLEWARE_PORT", "5055")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", "1")),
+                        help="worker processes; 0 means one per CPU")
+    parser.add_argument("--loop", default="auto", choices=("auto", "asyncio", "uvloop"))
+    parser.add_argument("--http", default="auto", choices=("auto", "h11", "httptools"))
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers or os.cpu_count() or 1, args.loop, args.http)
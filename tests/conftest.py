@@ -0,0 +1,10 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import middleware  # noqa: E402
+
+# Keep test runs out of middleware.log.
+middleware.logger.handlers.clear()
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import random
+
+import httpx
+
+from all_simple import RasaClient, build_dialogue, inform_city, load_nlu_examples
+
+NLU = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "nlu.yml")
+
+
+def lazy_client(replies):
+    """A lazy-mode client whose bot answers with `replies` in turn; returns it and its tracker fetches."""
+    fetches = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/tracker"):
+            fetches.append(request)
+            return httpx.Response(200, json={"active_loop": {"name": "flight_booking_form"}, "slots": {}})
+        return httpx.Response(200, json=replies.pop(0))
+
+    async def create():
+        return await RasaClient.create(
+            client=httpx.AsyncClient(transport=httpx.MockTransport(handler)), state_mode="lazy", refresh_every=5
+        )
+
+    return asyncio.run(create()), fetches
+
+
+def test_lazy_mode_refreshes_after_a_slot_prompt():
+    client, fetches = lazy_client([
+        [{"text": "Hello!"}],
+        [{"text": "Which city would you like to fly from? For example: Dhaka"}],
+    ])
+    asyncio.run(client.post_message("hi"))
+    assert fetches == [] and client.active_form is None
+    asyncio.run(client.post_message("book a flight"))
+    assert len(fetches) == 1
+    assert client.active_form == "flight_booking_form"
+
+
+def test_lazy_mode_skips_plain_replies_outside_forms():
+    client, fetches = lazy_client([[{"text": "Hello!"}], [{"text": "You're welcome!"}]])
+    asyncio.run(client.post_message("hi"))
+    asyncio.run(client.post_message("thanks"))
+    assert fetches == []
+
+
+def test_dialogue_answers_with_inform_examples():
+    examples = load_nlu_examples(NLU)
+    for seed in range(20):
+        dialogue = build_dialogue(examples, random.Random(seed), scripted=False)
+        source, destination = dialogue[2], dialogue[3]
+        assert source in examples["inform"] and destination in examples["inform"]
+        assert not source.startswith("to ") and not destination.startswith("from ")
+        assert inform_city(source) != inform_city(destination)
+    assert build_dialogue(examples, random.Random(0), scripted=True)[2:4] == ["Dhaka", "to New York"]
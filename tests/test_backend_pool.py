@@ -0,0 +1,148 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from middleware import Backend, BackendPool, NoBackendAvailable
+
+
+def failing_client() -> httpx.AsyncClient:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        # Yield so that every call is in flight before the first one fails.
+        await asyncio.sleep(0.01)
+        raise httpx.ConnectError("refused", request=request)
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def make_pool(**kwargs) -> BackendPool:
+    options = dict(failures_to_trip=3, cooloff=1.0, max_cooloff=60.0)
+    options.update(kwargs)
+    return BackendPool(["http://a"], **options)
+
+
+def fail(pool: BackendPool, trial: bool = False) -> None:
+    backend = pool.backends[0]
+    backend.outstanding += 1
+    pool.release(backend, False, trial)
+
+
+def to_half_open(backend: Backend) -> None:
+    backend.open_until = time.monotonic() - 0.001
+
+
+def test_opens_after_consecutive_failures():
+    pool = make_pool()
+    backend = pool.backends[0]
+    fail(pool)
+    fail(pool)
+    assert backend.state == "closed"
+    fail(pool)
+    assert backend.state == "open"
+    assert backend.trips == 1
+    assert not backend.available()
+
+
+def test_success_resets_the_failure_count():
+    pool = make_pool()
+    backend = pool.backends[0]
+    fail(pool)
+    fail(pool)
+    backend.outstanding += 1
+    pool.release(backend, True)
+    fail(pool)
+    assert backend.state == "closed"
+
+
+def test_in_flight_failures_do_not_trip_again():
+    pool = make_pool()
+    backend = pool.backends[0]
+
+    async def run():
+        async with failing_client() as client:
+            results = await asyncio.gather(
+                *(pool.post(client, "/webhook") for _ in range(10)), return_exceptions=True
+            )
+        assert all(isinstance(result, httpx.ConnectError) for result in results)
+
+    asyncio.run(run())
+    assert backend.trips == 1
+    assert backend.failures == 10
+    # The first incident gets the base cool-off, not the maximum.
+    assert backend.open_until - time.monotonic() <= 1.0
+
+
+def test_half_open_lets_one_trial_through():
+    pool = make_pool()
+    backend = pool.backends[0]
+    for _ in range(3):
+        fail(pool)
+    to_half_open(backend)
+    assert backend.state == "half_open"
+    chosen, trial = pool.acquire()
+    assert chosen is backend and trial
+    with pytest.raises(NoBackendAvailable):
+        pool.acquire()
+
+
+def test_failed_trial_doubles_the_cooloff():
+    pool = make_pool()
+    backend = pool.backends[0]
+    for _ in range(3):
+        fail(pool)
+    to_half_open(backend)
+    _, trial = pool.acquire()
+    pool.release(backend, False, trial)
+    assert backend.state == "open"
+    assert backend.trips == 2
+    assert 1.0 < backend.open_until - time.monotonic() <= 2.0
+    assert not backend.half_open_trial
+
+
+def test_failure_of_an_old_call_during_the_trial_does_not_reopen():
+    pool = make_pool()
+    backend = pool.backends[0]
+    for _ in range(3):
+        fail(pool)
+    to_half_open(backend)
+    pool.acquire()
+    fail(pool)
+    assert backend.state == "half_open"
+    assert backend.trips == 1
+
+
+def test_successful_trial_closes_the_circuit():
+    pool = make_pool()
+    backend = pool.backends[0]
+    for _ in range(3):
+        fail(pool)
+    to_half_open(backend)
+    _, trial = pool.acquire()
+    pool.release(backend, True, trial)
+    assert backend.state == "closed"
+    assert backend.trips == 0
+    assert backend.available()
+
+
+def test_cancelled_trial_frees_the_slot():
+    pool = make_pool()
+    backend = pool.backends[0]
+    for _ in range(3):
+        fail(pool)
+    to_half_open(backend)
+    _, trial = pool.acquire()
+    pool.release(backend, None, trial)
+    assert backend.available()
+
+
+def test_cooloff_is_capped_after_many_trips():
+    pool = make_pool(max_cooloff=60.0)
+    backend = pool.backends[0]
+    backend.trips = 5000
+    backend.open_until = time.monotonic() - 0.001
+    _, trial = pool.acquire()
+    pool.release(backend, False, trial)
+    assert backend.open_until - time.monotonic() <= 60.0
+    to_half_open(backend)
+    assert backend.available()
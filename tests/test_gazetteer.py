@@ -0,0 +1,65 @@
+import pytest
+
+from actions.gazetteer import Gazetteer
+
+GAZETTEER = Gazetteer([
+    {"name": "York"},
+    {"name": "New York", "aliases": ["New York City", "NYC"], "codes": ["JFK"]},
+    {"name": "Dhaka", "aliases": ["Dacca"], "codes": ["DAC"]},
+    {"name": "Mumbai", "aliases": ["Bombay"], "codes": ["BOM"]},
+    {"name": "Paris", "codes": ["CDG"]},
+])
+
+
+@pytest.mark.parametrize("message, expected", [
+    # The longest name wins where names overlap.
+    ("fly to New York", ["New York"]),
+    ("fly to new york city", ["New York"]),
+    ("from York to New York", ["York", "New York"]),
+    ("new yorkers love York", ["York"]),
+    # Aliases match case-insensitively and resolve to their city.
+    ("from Bombay to DACCA", ["Mumbai", "Dhaka"]),
+    ("NYC please", ["New York"]),
+    # Airport codes only in upper case.
+    ("DAC to JFK", ["Dhaka", "New York"]),
+    ("dac to jfk", []),
+    ("BOMBAY BOM", ["Mumbai", "Mumbai"]),
+    # Mentions sit on word boundaries, punctuation included.
+    ("Parisian food", []),
+    ("Paris, then Dhaka.", ["Paris", "Dhaka"]),
+    ("(Paris)-Dhaka!", ["Paris", "Dhaka"]),
+    ("new-york", ["New York"]),
+    ("Dhakaa", []),
+    ("", []),
+])
+def test_find_all(message, expected):
+    assert [name for _, _, name in GAZETTEER.find_all(message)] == expected
+
+
+def test_match_offsets_cover_the_mention():
+    message = "book from new  york to Dacca"
+    assert [message[start:end] for start, end, _ in GAZETTEER.find_all(message)] == ["new  york", "Dacca"]
+
+
+def test_mentioned_keeps_first_mentions_in_order():
+    assert GAZETTEER.mentioned("Paris, Dhaka, then DAC and Paris again") == ["Paris", "Dhaka"]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("new york", "New York"),
+    ("  New   York ", "New York"),
+    ("Bombay", "Mumbai"),
+    ("dac", "Dhaka"),
+    ("nyc", "New York"),
+    ("Paris Dhaka", None),
+    ("Parisian", None),
+    ("", None),
+])
+def test_canonical(text, expected):
+    assert GAZETTEER.canonical(text) == expected
+
+
+def test_shipped_cities_load():
+    gazetteer = Gazetteer.from_file()
+    assert "Dhaka" in gazetteer and "Bombay" not in gazetteer
+    assert gazetteer.canonical("Bombay") == "Mumbai"
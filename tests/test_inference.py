@@ -0,0 +1,106 @@
+import pytest
+
+pytest.importorskip("rasa_sdk")
+
+from actions.actions import (  # noqa: E402
+    VALID_CITIES,
+    _infer_source_destination,
+    infer_source_destination,
+    parse_cities_from_message,
+)
+
+
+def substring_infer(message, source, destination):
+    """The substring matcher the gazetteer replaced, kept as the reference for plain messages."""
+    message = " ".join(message.split())
+    lower = message.lower()
+    mentioned = sorted((c for c in VALID_CITIES if c.lower() in lower), key=lambda c: lower.index(c.lower()))
+    if not mentioned:
+        return None, None
+    if source and not destination:
+        others = [c for c in mentioned if c.lower() != source.lower()]
+        if not others:
+            return source, None
+        to_idx = lower.find("to ")
+        if len(others) > 1 and to_idx != -1:
+            for c in others:
+                if lower.find(c.lower()) > to_idx:
+                    return source, c
+        return source, others[0]
+    if destination and not source:
+        others = [c for c in mentioned if c.lower() != destination.lower()]
+        if not others:
+            return None, destination
+        from_idx = lower.find("from ")
+        if len(others) > 1 and from_idx != -1:
+            for c in others:
+                if lower.find(c.lower()) > from_idx:
+                    return c, destination
+        return others[0], destination
+    from_idx, to_idx = lower.find("from "), lower.find("to ")
+    if from_idx != -1 and to_idx != -1:
+        after_from = after_to = None
+        for c in mentioned:
+            cidx = lower.find(c.lower())
+            if cidx > from_idx and (after_from is None or cidx < lower.find(after_from.lower())):
+                after_from = c
+            if cidx > to_idx and (after_to is None or cidx < lower.find(after_to.lower())):
+                after_to = c
+        if after_from and after_to and after_from.lower() != after_to.lower():
+            return after_from, after_to
+    if len(mentioned) >= 2:
+        return mentioned[0], mentioned[1]
+    return mentioned[0], None
+
+
+# (message, source slot, destination slot, expected source, expected destination)
+PLAIN = [
+    ("I want to book a flight from Dhaka to New York", None, None, "Dhaka", "New York"),
+    ("to London from Paris", None, None, "Paris", "London"),
+    ("Dubai   Tokyo", None, None, "Dubai", "Tokyo"),
+    ("fly from Khulna", None, None, "Khulna", None),
+    ("book a flight", None, None, None, None),
+    ("London please", "Dhaka", None, "Dhaka", "London"),
+    ("Dhaka then to Paris", "Dhaka", None, "Dhaka", "Paris"),
+    ("from Dhaka to Tokyo or Dubai", "Dhaka", None, "Dhaka", "Tokyo"),
+    ("just Dhaka", "Dhaka", None, "Dhaka", None),
+    ("Mumbai", None, "Paris", "Mumbai", "Paris"),
+    ("London or from Rajshahi", None, "Paris", "Rajshahi", "Paris"),
+    ("to Paris", None, "Paris", None, "Paris"),
+]
+
+# Messages the substring matcher got wrong.
+CHANGED = [
+    # Word boundaries: no city inside another word.
+    ("Parisian food, then fly to London", None, None, "London", None),
+    ("from Dhakar to Tokyo", None, None, "Tokyo", None),
+    # Aliases and upper-case airport codes resolve to the city.
+    ("from Bombay to NYC", None, None, "Mumbai", "New York"),
+    ("DAC to LHR", None, None, "Dhaka", "London"),
+    ("fly to jfk", None, None, None, None),
+    # Punctuation is a boundary.
+    ("from Dhaka, to London.", None, None, "Dhaka", "London"),
+]
+
+
+@pytest.mark.parametrize("message, source, destination, expected_source, expected_destination", PLAIN)
+def test_plain_messages_match_the_substring_behaviour(message, source, destination, expected_source, expected_destination):
+    expected = (expected_source, expected_destination)
+    assert substring_infer(message, source, destination) == expected
+    assert infer_source_destination(message, source, destination) == expected
+
+
+@pytest.mark.parametrize("message, source, destination, expected_source, expected_destination", CHANGED)
+def test_gazetteer_matching(message, source, destination, expected_source, expected_destination):
+    assert infer_source_destination(message, source, destination) == (expected_source, expected_destination)
+
+
+def test_cities_in_order_of_first_mention():
+    assert parse_cities_from_message("Tokyo, then London, then Tokyo") == ["Tokyo", "London"]
+
+
+def test_cached_results_are_not_shared_mutable_state():
+    _infer_source_destination.cache_clear()
+    first = infer_source_destination("from Dhaka to London", None, None)
+    assert infer_source_destination("from Dhaka to London", None, None) == first
+    assert _infer_source_destination.cache_info().hits == 1
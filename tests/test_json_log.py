@@ -0,0 +1,27 @@
+import json
+
+import pytest
+
+from middleware import QueuedJsonLogger
+
+
+def written(tmp_path, *records) -> list:
+    path = tmp_path / "log.jsonl"
+    log = QueuedJsonLogger(str(path), flush_interval=0.01)
+    log.start()
+    for event, data in records:
+        log.submit(event, data)
+    log.stop()
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_raw_json_bodies_are_embedded(tmp_path):
+    lines = written(tmp_path, ("response", b'{"events":[]}'), ("response", b'{\n  "events": []\n}'))
+    assert [line["data"] for line in lines] == [{"events": []}, {"events": []}]
+
+
+@pytest.mark.parametrize("body", [b"<html>oops</html>", b"<html>\noops\n</html>", b'{"events": [', b"\xff"])
+def test_non_json_bodies_are_logged_as_text(tmp_path, body):
+    (line,) = written(tmp_path, ("response", body))
+    assert line["event"] == "response"
+    assert line["data"] == body.decode("utf-8", "replace")
@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+import middleware
+from log_query import LogIndex, read_rows
+from middleware import QueuedJsonLogger, RequestTimer
+
+STAMP = "2025-01-31 02:40:00,000 [INFO] "
+
+
+def request(sender_id: str, next_action: str) -> dict:
+    return {"next_action": next_action, "sender_id": sender_id, "tracker": {"sender_id": sender_id, "events": []}}
+
+
+def response(name: str) -> dict:
+    return {"events": [{"event": "slot", "name": name, "value": None}], "responses": []}
+
+
+def timer_for(sender_id: str, next_action: str) -> RequestTimer:
+    timer = RequestTimer()
+    timer.sender_id, timer.next_action = sender_id, next_action
+    return timer
+
+
+@pytest.fixture
+def text_log(tmp_path, monkeypatch):
+    """middleware.log as log_exchange writes it in the default LOG_MODE."""
+    path = tmp_path / "middleware.log"
+    handler = middleware.AppendFileHandler(str(path))
+    handler.setFormatter(middleware.formatter)
+    middleware.logger.addHandler(handler)
+    monkeypatch.setattr(middleware, "json_log", None)
+    monkeypatch.setattr(middleware, "tracker_delta_log", None)
+    yield path
+    middleware.logger.removeHandler(handler)
+    handler.close()
+
+
+def interleaved(log) -> None:
+    # Two calls in flight at once: the second request's response comes first.
+    log("request", request("alice", "action_ask_source"), None)
+    log("request", request("bob", "action_submit_flight"), None)
+    log("response", response("bob"), timer_for("bob", "action_submit_flight"))
+    log("response", response("alice"), timer_for("alice", "action_ask_source"))
+
+
+def responses_of(path, **query) -> list:
+    index = LogIndex(str(path))
+    index.update()
+    rows = list(index.query(direction="response", **query))
+    return [record["data"]["events"][0]["name"] for record in read_rows(str(path), rows)]
+
+
+def test_text_log_responses_carry_their_request(text_log):
+    interleaved(middleware.log_exchange)
+    assert responses_of(text_log, sender_id="alice") == ["alice"]
+    assert responses_of(text_log, next_action="action_submit_flight") == ["bob"]
+
+
+def test_queue_records_carry_their_request(tmp_path):
+    path = tmp_path / "middleware.jsonl"
+    log = QueuedJsonLogger(str(path), flush_interval=0.01)
+    log.start()
+    interleaved(lambda event, data, timer: log.submit(
+        event, json.dumps(data).encode() if event == "response" else data,
+        {"sender_id": timer.sender_id, "next_action": timer.next_action} if timer else None,
+    ))
+    log.stop()
+    assert responses_of(path, sender_id="alice") == ["alice"]
+    assert responses_of(path, sender_id="bob", next_action="action_submit_flight") == ["bob"]
+
+
+def test_older_logs_attribute_responses_to_the_previous_request(tmp_path):
+    path = tmp_path / "middleware.log"
+    with open(path, "w") as fh:
+        for sender_id in ("alice", "bob"):
+            fh.write(STAMP + "Incoming request from Rasa: %r\n" % request(sender_id, "action_ask_source"))
+            fh.write(STAMP + "Outgoing response from action server: %r\n" % response(sender_id))
+    assert responses_of(path, sender_id="bob") == ["bob"]
+
+
+def test_update_only_indexes_appended_records(text_log):
+    middleware.log_exchange("request", request("alice", "action_ask_source"))
+    index = LogIndex(str(text_log))
+    assert index.update() == 1
+    middleware.log_exchange("response", response("alice"), timer_for("alice", "action_ask_source"))
+    assert LogIndex(str(text_log)).update() == 1
+    assert len(LogIndex(str(text_log))) == 2
+
+
+def test_lookups_use_the_key_indexes(text_log):
+    interleaved(middleware.log_exchange)
+    index = LogIndex(str(text_log))
+    index.update()
+    for column, name in (("sender_id", "records_sender"), ("next_action", "records_action"), ("ts", "records_ts")):
+        plan = index.db.execute(f"EXPLAIN QUERY PLAN SELECT * FROM records WHERE {column} = ? ORDER BY ts", ("x",))
+        assert any(name in row[-1] for row in plan)
+
+
+def test_an_index_in_the_old_line_format_is_rebuilt(text_log):
+    interleaved(middleware.log_exchange)
+    with open(str(text_log) + ".idx", "w") as fh:
+        fh.write("[0,10,0.0,\"request\",null,null]\n" * 100)
+    index = LogIndex(str(text_log))
+    assert index.update() == 4
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import middleware
+from middleware import EXITED_METRICS, Metrics, RequestTimer, SharedSenderStateStore
+
+
+def state(sender_id: str, updated: float) -> dict:
+    return {"sender_id": sender_id, "active_loop": None, "slots": {}, "updated": updated}
+
+
+def test_put_is_stored_by_the_next_flush(tmp_path):
+    path = str(tmp_path / "state.db")
+    store = SharedSenderStateStore(path)
+    other = SharedSenderStateStore(path)
+    store.put("a", state("a", 1.0))
+    store.put("a", state("a", 2.0))
+    assert store.get("a")["updated"] == 2.0
+    assert other.get("a") is None
+    assert store.flush() == 1
+    assert other.get("a")["updated"] == 2.0
+
+
+def test_writer_thread_flushes_on_stop(tmp_path):
+    path = str(tmp_path / "state.db")
+    store = SharedSenderStateStore(path, flush_interval=60.0)
+    store.start()
+    store.put("a", state("a", 1.0))
+    store.stop()
+    assert SharedSenderStateStore(path).get("a") is not None
+
+
+def test_flush_prunes_oldest_senders(tmp_path):
+    store = SharedSenderStateStore(str(tmp_path / "state.db"), max_senders=2, prune_every=3)
+    for i, sender_id in enumerate("abc"):
+        store.put(sender_id, state(sender_id, float(i)))
+    store.flush()
+    rows = store._db.execute("SELECT sender_id FROM sender_state ORDER BY sender_id").fetchall()
+    assert [row[0] for row in rows] == ["b", "c"]
+
+
+def served(metrics: Metrics, requests: int) -> Metrics:
+    for _ in range(requests):
+        timer = RequestTimer()
+        timer.next_action = "action_test"
+        metrics.record(timer)
+    return metrics
+
+
+def request_total(metrics: Metrics, directory: str) -> float:
+    families, _ = metrics.aggregate(directory)
+    return sum(value for _, value in families[0].snapshot())
+
+
+def snapshot_files(directory) -> list:
+    return sorted(name for name in os.listdir(directory) if name.startswith("metrics-"))
+
+
+@pytest.mark.skipif(middleware.fcntl is None, reason="needs fcntl")
+def test_retired_workers_are_folded_into_one_snapshot(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    for worker in ("101", "102"):
+        monkeypatch.setattr(middleware, "WORKER_ID", worker)
+        served(Metrics(), 2).retire(directory)
+    assert snapshot_files(directory) == [EXITED_METRICS]
+    monkeypatch.setattr(middleware, "WORKER_ID", "103")
+    assert request_total(served(Metrics(), 1), directory) == 5
+
+
+@pytest.mark.skipif(middleware.fcntl is None, reason="needs fcntl")
+def test_snapshots_of_dead_workers_are_folded(tmp_path, monkeypatch):
+    directory = str(tmp_path)
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+    monkeypatch.setattr(middleware, "WORKER_ID", dead.stdout.strip())
+    served(Metrics(), 3).write_snapshot(directory)
+    path = os.path.join(directory, f"metrics-{middleware.WORKER_ID}.json")
+    os.utime(path, (0, 0))
+    monkeypatch.setattr(middleware, "WORKER_ID", str(os.getpid()))
+    metrics = served(Metrics(), 1)
+    assert request_total(metrics, directory) == 4
+    assert snapshot_files(directory) == sorted([EXITED_METRICS, f"metrics-{os.getpid()}.json"])
+    assert request_total(metrics, directory) == 4
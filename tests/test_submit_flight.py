@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("rasa_sdk")
+
+from rasa_sdk import Tracker  # noqa: E402
+from rasa_sdk.executor import CollectingDispatcher  # noqa: E402
+
+import actions.actions as actions  # noqa: E402
+from actions.inventory import InventoryStore  # noqa: E402
+
+
+def write_schedule(path, *flights) -> None:
+    start = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(days=1)
+    with open(path, "w") as fh:
+        fh.write("flight,source,destination,departure,arrival\n")
+        for hours, flight in enumerate(flights):
+            departure = start + timedelta(hours=hours)
+            fh.write(f"{flight},Dhaka,London,{departure.isoformat()},{(departure + timedelta(hours=9)).isoformat()}\n")
+
+
+def submit(slots, intent):
+    tracker = Tracker(
+        "s", dict({"source": "Dhaka", "destination": "London"}, **slots),
+        {"text": intent, "intent": {"name": intent}, "intent_ranking": [{"name": intent}]},
+        [], False, None, {}, "",
+    )
+    dispatcher = CollectingDispatcher()
+    events = actions.ActionSubmitFlight().run(dispatcher, tracker, {})
+    return events, [message["text"] for message in dispatcher.messages]
+
+
+@pytest.fixture
+def schedule(tmp_path, monkeypatch):
+    path = tmp_path / "schedule.csv"
+    write_schedule(path, "DL100", "DL200")
+    monkeypatch.setattr(actions, "INVENTORY", InventoryStore(str(path), resolve=actions.GAZETTEER.canonical))
+    return path
+
+
+def test_importing_the_actions_loads_nothing():
+    assert actions.INVENTORY.loaded_mtime is None
+    assert actions.INVENTORY._watcher is None
+
+
+def test_affirm_books_the_offered_flight(schedule):
+    events, texts = submit({}, "inform")
+    assert "DL100" in texts[0]
+    offered = events[0]["value"]
+    assert events[0]["name"] == actions.OFFERED_FLIGHT_SLOT and offered["flight"] == "DL100"
+
+    # The schedule changes between the offer and the answer.
+    write_schedule(schedule, "DL300")
+    actions.INVENTORY.load()
+    _, texts = submit({actions.OFFERED_FLIGHT_SLOT: offered}, "affirm")
+    assert "DL100" in texts[0] and "booked" in texts[0]
+
+
+def test_affirm_without_an_offer_books_the_route(schedule):
+    _, texts = submit({}, "affirm")
+    assert texts == ["Your flight from Dhaka to London has been booked successfully!"]
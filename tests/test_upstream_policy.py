@@ -0,0 +1,166 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from middleware import DEADLINE_HEADER, BackendPool, DeadlineExceeded, UpstreamPolicy
+
+
+def make_policy(**kwargs) -> UpstreamPolicy:
+    options = dict(default_deadline=1.0, idempotent=["action_ask_source"], retries=2, retry_backoff=0.001)
+    options.update(kwargs)
+    return UpstreamPolicy(**options)
+
+
+def call(policy: UpstreamPolicy, pool: BackendPool, handler, action: str = "action_ask_source", **kwargs):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await policy.post(pool, client, "/webhook", action, json={}, **kwargs)
+
+    return asyncio.run(run())
+
+
+def scripted(*outcomes):
+    """Handler answering each request with the next outcome: a status code, an exception class or a delay.
+
+    Delays honour the request's read timeout the way a real transport does.
+    """
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        outcome = outcomes[min(len(requests), len(outcomes)) - 1]
+        if isinstance(outcome, float):
+            read_timeout = request.extensions["timeout"]["read"]
+            if read_timeout is not None and outcome > read_timeout:
+                await asyncio.sleep(read_timeout)
+                raise httpx.ReadTimeout("timed out", request=request)
+            await asyncio.sleep(outcome)
+            return httpx.Response(200, json={"events": []})
+        if isinstance(outcome, type):
+            raise outcome("scripted", request=request)
+        return httpx.Response(outcome, json={"events": []})
+
+    return handler, requests
+
+
+def test_connect_errors_are_retried_for_any_action():
+    policy, pool = make_policy(), BackendPool(["http://a"])
+    handler, requests = scripted(httpx.ConnectError, httpx.ConnectError, 200)
+    response = call(policy, pool, handler, action="action_submit_flight")
+    assert response.status_code == 200
+    assert len(requests) == 3
+    assert policy.retried == 2
+
+
+@pytest.mark.parametrize("error", [httpx.ConnectTimeout, httpx.PoolTimeout])
+def test_connect_and_pool_timeouts_are_connection_failures(error):
+    policy, pool = make_policy(), BackendPool(["http://a"])
+    handler, requests = scripted(error, 200)
+    response = call(policy, pool, handler, action="action_submit_flight")
+    assert response.status_code == 200
+    assert len(requests) == 2
+    assert policy.deadline_exceeded == 0
+
+
+def test_a_timeout_with_budget_left_is_not_a_deadline():
+    policy, pool = make_policy(), BackendPool(["http://a"])
+    handler, requests = scripted(httpx.ReadTimeout)
+    with pytest.raises(httpx.ReadTimeout):
+        call(policy, pool, handler, action="action_submit_flight")
+    assert len(requests) == 1
+    assert policy.deadline_exceeded == 0
+
+
+def test_a_refused_call_counts_once_towards_the_breaker():
+    policy, pool = make_policy(), BackendPool(["http://a"], failures_to_trip=3)
+    handler, requests = scripted(httpx.ConnectError)
+    with pytest.raises(httpx.ConnectError):
+        call(policy, pool, handler)
+    backend = pool.backends[0]
+    assert len(requests) == 3
+    assert backend.failures == 3
+    assert backend.consecutive_failures == 1
+    assert backend.state == "closed"
+
+
+def test_retryable_status_is_retried_only_for_idempotent_actions():
+    policy, pool = make_policy(), BackendPool(["http://a"])
+    handler, requests = scripted(503, 200)
+    assert call(policy, pool, handler).status_code == 200
+    assert len(requests) == 2
+
+    handler, requests = scripted(503, 200)
+    assert call(policy, pool, handler, action="action_submit_flight").status_code == 503
+    assert len(requests) == 1
+
+
+def test_timeouts_are_retried_only_for_idempotent_actions():
+    policy, pool = make_policy(default_deadline=0.2), BackendPool(["http://a"])
+    handler, requests = scripted(5.0, 0.0)
+    started = time.monotonic()
+    assert call(policy, pool, handler).status_code == 200
+    assert len(requests) == 2
+    # The first attempt only had attempt_share of the budget.
+    assert time.monotonic() - started < 0.15
+
+    handler, requests = scripted(5.0, 0.0)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        call(policy, pool, handler, action="action_submit_flight")
+    assert len(requests) == 1
+    assert policy.deadline_exceeded == 1
+    assert time.monotonic() - started >= 0.2
+
+
+def test_last_attempt_gets_the_rest_of_the_budget():
+    policy, pool = make_policy(default_deadline=0.4, retries=1), BackendPool(["http://a"])
+    handler, requests = scripted(5.0, 0.15)
+    assert call(policy, pool, handler).status_code == 200
+    assert len(requests) == 2
+    assert float(requests[0].extensions["timeout"]["read"]) == pytest.approx(0.2, abs=0.01)
+
+
+def test_deadline_is_sent_and_enforced():
+    policy, pool = make_policy(deadlines={"action_ask_source": 0.2}), BackendPool(["http://a"])
+    handler, requests = scripted(200)
+    call(policy, pool, handler)
+    assert 0 < int(requests[0].headers[DEADLINE_HEADER]) <= 200
+
+    slow, _ = scripted(5.0)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        call(make_policy(default_deadline=0.2), pool, slow, action="action_submit_flight")
+    assert time.monotonic() - started < 0.5
+
+
+def test_incoming_deadline_header_can_only_shorten_the_budget():
+    policy = make_policy(deadlines={"action_ask_source": 2.0})
+    assert policy.deadline_for("action_ask_source", "500") == 0.5
+    assert policy.deadline_for("action_ask_source", "5000") == 2.0
+    assert policy.deadline_for("action_ask_source", "junk") == 2.0
+
+
+def test_hedge_wins_over_a_slow_first_request():
+    policy = make_policy(hedge=True, hedge_min_samples=5, hedge_min_delay=0.01, hedge_max_ratio=1.0)
+    for _ in range(5):
+        policy.observe("action_ask_source", 0.02)
+    pool = BackendPool(["http://a", "http://b"])
+    handler, requests = scripted(0.5, 0.0)
+    started = time.monotonic()
+    response = call(policy, pool, handler)
+    assert response.status_code == 200
+    assert len(requests) == 2
+    assert policy.hedged == 1 and policy.hedge_wins == 1
+    assert time.monotonic() - started < 0.4
+
+
+def test_no_hedge_for_non_idempotent_actions():
+    policy = make_policy(hedge=True, hedge_min_samples=5, hedge_max_ratio=1.0)
+    for _ in range(5):
+        policy.observe("action_submit_flight", 0.01)
+    handler, requests = scripted(0.1)
+    call(policy, BackendPool(["http://a"]), handler, action="action_submit_flight")
+    assert len(requests) == 1
+    assert policy.hedged == 0
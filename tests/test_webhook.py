@@ -0,0 +1,60 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import middleware
+
+PAYLOAD = {"next_action": "action_submit_flight", "sender_id": "s", "tracker": {"sender_id": "s", "events": []}}
+REJECTION = {"error": "Slot not filled", "action_name": "action_submit_flight"}
+
+
+class StubActions:
+    """In-process actions answering every call with one status and body."""
+
+    def __init__(self, status_code: int, body: dict) -> None:
+        self.status_code, self.body = status_code, body
+
+    def handles(self, action_name) -> bool:
+        return True
+
+    async def run(self, action_call):
+        return self.status_code, self.body
+
+
+@pytest.fixture(params=[False, True], ids=["parsed", "passthrough"])
+def webhook(request, monkeypatch):
+    monkeypatch.setattr(middleware, "PASSTHROUGH", request.param)
+    monkeypatch.setattr(middleware, "HEALTH_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(middleware, "json_log", None)
+    with TestClient(middleware.app) as client:
+        yield client
+
+
+def upstream(app, status_code: int, body: dict) -> None:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(status_code, json=body)
+
+    app.state.upstream = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+@pytest.mark.parametrize("status_code", [400, 404])
+def test_action_server_errors_are_relayed(webhook, status_code):
+    upstream(webhook.app, status_code, REJECTION)
+    response = webhook.post("/webhook", json=PAYLOAD)
+    assert response.status_code == status_code
+    assert response.json() == REJECTION
+
+
+@pytest.mark.parametrize("status_code", [400, 404])
+def test_in_process_errors_are_relayed(webhook, monkeypatch, status_code):
+    monkeypatch.setattr(middleware, "in_process_actions", StubActions(status_code, REJECTION))
+    response = webhook.post("/webhook", json=PAYLOAD)
+    assert response.status_code == status_code
+    assert response.json() == REJECTION
+
+
+def test_success_is_returned(webhook):
+    upstream(webhook.app, 200, {"events": [], "responses": []})
+    response = webhook.post("/webhook", json=PAYLOAD)
+    assert response.status_code == 200
+    assert response.json() == {"events": [], "responses": []}